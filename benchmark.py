@@ -0,0 +1,1316 @@
+"""Benchmarks for the scraping pipeline
+
+Runs against the saved HTML pages in fixtures/ (or any directory passed with
+--fixtures) and prints timings for each stage.
+
+    python benchmark.py clean
+    python benchmark.py text-modes
+    python benchmark.py parsers
+    python benchmark.py crawl
+    python benchmark.py llm
+    python benchmark.py chunking
+    python benchmark.py streaming
+    python benchmark.py output-formats
+    python benchmark.py merge --rows 100000
+    python benchmark.py relevance --chunk-tokens 500
+    python benchmark.py import
+    python benchmark.py clean-pool --pages 400
+    python benchmark.py pipeline --save-baseline
+    python benchmark.py pipeline
+    python benchmark.py large-page --page-mb 50
+    python benchmark.py normalize --text-mb 5
+    python benchmark.py incremental --edits 3
+    python benchmark.py templates
+    python benchmark.py jobs --pages 120
+    python benchmark.py export --rows 100000
+"""
+import argparse
+import asyncio
+import codecs
+import glob
+import hashlib
+import itertools
+import json
+import math
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.request import urlopen
+
+from bs4 import BeautifulSoup
+
+import scraper.llm
+from scraper.cache import clean_with_cache
+from scraper.chunking import (DEFAULT_CHUNK_TOKENS, chunk_records, count_tokens, get_tokenizer, split_content,
+                              split_records)
+from scraper.clean_pool import CleaningPool
+from scraper.cleaning import PARSER_BACKENDS, TEXT_MODES, clean_dom_content, extract_text_records, normalize_text
+from scraper.crawl import CrawlStats, crawl
+from scraper.incremental import SnapshotStore, extract_incremental
+from scraper.jobs import SQLiteQueue, job_settings, start_workers
+from scraper.llm import aparse_with_llm, extract_chunks, parse_columns, parse_json_rows, parse_llm_response
+from scraper.merge import ROW_FUZZY_SIMILARITY, RowMerger, TableMerger, markdown_table_to_df, normalize_column
+from scraper.metrics import get_metrics
+from scraper.relevance import RELEVANCE_MIN_SCORE_RATIO, select_relevant_chunks
+from scraper.sinks import RowSink, count_export_rows, export_options, read_export
+from scraper.templates import (TEMPLATE_MIN_AGREEMENT, TemplateStore, apply_template, extract_with_template,
+                               learn_template, row_agreement, template_key)
+
+# Probes run in subprocesses from the repo directory, so they import this
+# checkout's scraper package wherever the benchmark is started from
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(REPO_DIR, 'fixtures')
+
+
+def load_fixtures(fixtures_dir):
+    """Load every saved HTML page in a directory"""
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(fixtures_dir, '*.html'))):
+        with open(path, encoding='utf-8') as f:
+            pages[os.path.basename(path)] = f.read()
+    return pages
+
+
+def legacy_clean_dom_content(html_content):
+    """The multi-pass clean_dom_content, kept as a reference for output and speed"""
+    soup = BeautifulSoup(html_content, 'html.parser')
+
+    unwanted_elements = [
+        'script', 'style', 'meta', 'link', 'noscript', 'iframe',
+        'header', 'footer', 'nav', 'aside', 'cookie', 'banner',
+        '[class*="cookie"]', '[class*="popup"]', '[class*="modal"]',
+        '[class*="overlay"]', '[class*="banner"]', '[class*="notice"]',
+        '[id*="cookie"]', '[id*="popup"]', '[id*="modal"]',
+        '[class*="advertising"]', '[class*="ad-"]', '[class*="tracker"]',
+        '[data-tracking]', '[data-analytics]'
+    ]
+    for element in unwanted_elements:
+        for tag in soup.select(element):
+            tag.decompose()
+
+    for element in soup.find_all(True):
+        # Newer bs4 releases clear the attributes of decomposed descendants
+        if element.decomposed:
+            continue
+        tracking_attrs = ['data-tracking', 'data-analytics', 'data-ga',
+                          'data-gtm', 'data-pixel', 'data-fb']
+        for attr in tracking_attrs:
+            if element.has_attr(attr):
+                del element[attr]
+        if element.get('class'):
+            classes = ' '.join(element.get('class'))
+            if any(term in classes.lower() for term in ['track', 'pixel', 'gtm', 'analytics',
+                                                      'cookie', 'popup', 'modal', 'overlay']):
+                element.decompose()
+                continue
+
+    text_elements = []
+    valid_tags = ['p', 'div', 'span', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+                  'li', 'td', 'th', 'a', 'article', 'section', 'main']
+    for element in soup.find_all(valid_tags):
+        if element.get('style') and ('display: none' in element['style'] or
+                                   'visibility: hidden' in element['style']):
+            continue
+        text = element.get_text(strip=True)
+        if not text:
+            continue
+        if len(text) < 3:
+            continue
+        if element.name in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
+            text = f"HEADING: {text}"
+        elif element.name == 'a' and element.get('href'):
+            href = element.get('href')
+            if href.startswith('javascript:') or href.startswith('#'):
+                continue
+            if not href.startswith(('http://', 'https://', '/')):
+                continue
+            text = f"LINK: {text} (URL: {href})"
+        elif element.name in ['td', 'th']:
+            text = f"TABLE_CELL: {text}"
+        text_elements.append(text)
+
+    return legacy_normalize('\n'.join(text_elements))
+
+
+def legacy_normalize(clean_content):
+    """The regex cascade clean_dom_content used to run over the joined element texts"""
+    clean_content = re.sub(r'\s+', ' ', clean_content)
+    clean_content = re.sub(r'\n\s*\n', '\n', clean_content)
+    clean_content = re.sub(r'[^\S\n]+', ' ', clean_content)
+
+    cleaned_lines = []
+    for line in clean_content.split('\n'):
+        line = line.strip()
+        if line and len(line) > 3:
+            line = re.sub(r'\[.*?\]', '', line)
+            line = re.sub(r'\((?!URL:).*?\)', '', line)
+            line = re.sub(r'^\W+|\W+$', '', line)
+            if line:
+                cleaned_lines.append(line)
+
+    final_content = '\n'.join(cleaned_lines)
+    final_content = re.sub(r'(\b\w+\b)\s+\1', r'\1', final_content)
+    final_content = re.sub(r'\s*\|\s*', ' | ', final_content)
+    return final_content
+
+
+def time_pages(func, pages, repeat):
+    """Run func over every page, returning the best total time and the outputs"""
+    best = None
+    outputs = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for name, html in pages.items():
+            outputs[name] = func(html)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, outputs
+
+
+def bench_clean(pages, args):
+    """Compare the single-pass cleaner against the legacy multi-pass one
+
+    Outputs are compared before line normalization, which changed on purpose
+    (see the normalize benchmark): the element texts the single-pass walk
+    extracts, run through the legacy regex cascade, must match the legacy
+    cleaner's output.
+    """
+    total_mb = sum(len(html.encode('utf-8')) for html in pages.values()) / 1e6
+    legacy_time, legacy_out = time_pages(legacy_clean_dom_content, pages, args.repeat)
+    current_time, _ = time_pages(
+        lambda html: clean_dom_content(html, parser=args.parser), pages, args.repeat)
+
+    mismatches = [name for name, html in pages.items()
+                  if legacy_out[name] != legacy_normalize('\n'.join(extract_text_records(html, parser=args.parser)))]
+    print(f"{len(pages)} pages, {total_mb:.2f} MB")
+    print(f"legacy clean:  {legacy_time:.3f}s ({len(pages) / legacy_time:.1f} pages/s)")
+    print(f"current clean: {current_time:.3f}s ({len(pages) / current_time:.1f} pages/s)")
+    print(f"speedup:       {legacy_time / current_time:.2f}x")
+    if mismatches:
+        print(f"OUTPUT MISMATCH on: {', '.join(mismatches)}")
+        return 1
+    print("extracted element texts identical")
+    return 0
+
+
+def bench_text_modes(pages, args):
+    """Compare output size and chunk count of the nested and block text modes"""
+    totals = {mode: [0, 0] for mode in TEXT_MODES}
+    print(f"{'page':<28}{'mode':<8}{'bytes':>10}{'chunks':>8}")
+    for name, html in pages.items():
+        for mode in TEXT_MODES:
+            content = clean_dom_content(html, text_mode=mode)
+            size = len(content.encode('utf-8'))
+            chunks = len(chunk_records(content, args.chunk_tokens))
+            totals[mode][0] += size
+            totals[mode][1] += chunks
+            print(f"{name:<28}{mode:<8}{size:>10}{chunks:>8}")
+
+    nested_bytes, nested_chunks = totals['nested']
+    blocks_bytes, blocks_chunks = totals['blocks']
+    print(f"total bytes:  {nested_bytes} -> {blocks_bytes} "
+          f"({100 * (1 - blocks_bytes / max(nested_bytes, 1)):.1f}% smaller)")
+    print(f"total chunks: {nested_chunks} -> {blocks_chunks} "
+          f"({100 * (1 - blocks_chunks / max(nested_chunks, 1)):.1f}% fewer LLM calls)")
+    return 0
+
+
+def bench_parsers(pages, args):
+    """Measure parse+clean throughput per parser backend and check outputs match html.parser"""
+    mismatched = False
+    for mode in TEXT_MODES:
+        outputs = {}
+        for name, backend in PARSER_BACKENDS.items():
+            if not backend.is_available():
+                print(f"{mode:<8}{name:<13}not installed")
+                continue
+            elapsed, outputs[name] = time_pages(
+                lambda html: clean_dom_content(html, text_mode=mode, parser=name), pages, args.repeat)
+            print(f"{mode:<8}{name:<13}{len(pages) / elapsed:8.1f} pages/s")
+
+        reference = outputs['html.parser']
+        for name, backend_outputs in outputs.items():
+            if name == 'html.parser':
+                continue
+            mismatches = [page for page in pages if backend_outputs[page] != reference[page]]
+            if mismatches:
+                mismatched = True
+                print(f"{mode:<8}{name:<13}OUTPUT MISMATCH vs html.parser on: {', '.join(mismatches)}")
+            else:
+                print(f"{mode:<8}{name:<13}output identical to html.parser")
+    return 1 if mismatched else 0
+
+
+@contextmanager
+def serve_fixtures(fixtures_dir, handler_class=None):
+    """Serve a fixtures directory over HTTP on a free local port"""
+    handler = partial(handler_class or QuietHandler, directory=fixtures_dir)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server.server_address[1]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def fetch_over_http(url):
+    with urlopen(url, timeout=30) as response:
+        return response.read().decode('utf-8', errors='replace')
+
+
+def bench_crawl(pages, args):
+    """Crawl the fixtures end-to-end from a local HTTP server, without a browser"""
+    with serve_fixtures(args.fixtures) as port:
+        # localhost and 127.0.0.1 count as two domains for the politeness limits
+        hosts = [f'http://127.0.0.1:{port}', f'http://localhost:{port}']
+        names = list(pages) + ['missing.html']
+        urls = [f'{hosts[i % 2]}/{names[i % len(names)]}' for i in range(args.pages)]
+
+        stats = CrawlStats()
+        get_metrics().reset()
+        for _ in crawl(urls, concurrency=args.concurrency, per_domain_concurrency=args.concurrency,
+                            per_domain_delay=0, fetch=fetch_over_http, stats=stats):
+            pass
+
+    report = stats.report()
+    for key, value in report.items():
+        print(f"{key + ':':<24}{value}")
+    print(f"\n{'stage':<14}{'calls':>7}{'total s':>10}{'avg s':>9}{'p95 s':>9}")
+    for row in get_metrics().stage_summary():
+        print(f"{row['stage']:<14}{row['calls']:>7}{row['total_s']:>10.3f}{row['avg_s']:>9.3f}{row['p95_s']:>9.3f}")
+    return 0
+
+
+class StubRateLimitError(Exception):
+    status_code = 429
+
+
+class StubLLM:
+    """Local stand-in for the chat model: fixed latency, 429s above a concurrency cap"""
+
+    def __init__(self, latency, rate_limit_concurrency):
+        self.latency = latency
+        self.rate_limit_concurrency = rate_limit_concurrency
+        self.active = 0
+        self.calls = 0
+        self.rate_limited = 0
+
+    async def __call__(self, chunk, parse_description):
+        self.calls += 1
+        self.active += 1
+        try:
+            if self.active > self.rate_limit_concurrency:
+                self.rate_limited += 1
+                raise StubRateLimitError("429 rate limit exceeded")
+            await asyncio.sleep(self.latency * random.uniform(0.8, 1.2))
+            return f"| Text |\n|---|\n| {' '.join(chunk.split()[:5])} |"
+        finally:
+            self.active -= 1
+
+
+def bench_llm(pages, args):
+    """Chunks/sec of the async extraction engine against a stubbed LLM at several concurrency caps"""
+    chunks = [chunk for html in pages.values()
+              for chunk in chunk_records(clean_dom_content(html, 'blocks'), args.chunk_tokens)]
+    # Scale backoff to the stub's latency so runs stay short
+    scraper.llm.LLM_BACKOFF_BASE_SECONDS = args.llm_latency
+    print(f"{len(chunks)} chunks, {args.llm_latency * 1000:.0f} ms latency, "
+          f"429 above {args.rate_limit_concurrency} concurrent calls")
+    print(f"{'cap':>4}{'chunks/s':>10}{'calls':>7}{'429s':>6}")
+    for cap in (1, 2, 4, 8, 16):
+        llm = StubLLM(args.llm_latency, args.rate_limit_concurrency)
+        start = time.perf_counter()
+        results = list(extract_chunks(chunks, 'Extract the text', llm_call=llm,
+                                           max_concurrency=cap, tokens_per_minute=10 ** 9))
+        elapsed = time.perf_counter() - start
+        failed = sum(1 for _, table in results if table is None)
+        print(f"{cap:>4}{len(chunks) / elapsed:>10.1f}{llm.calls:>7}{llm.rate_limited:>6}"
+              f"{'  (' + str(failed) + ' failed)' if failed else ''}")
+    return 0
+
+
+def bench_streaming(pages, args):
+    """Time to first merged row when streaming chunk results versus waiting for the whole batch"""
+    chunks = [chunk for html in pages.values()
+              for chunk in chunk_records(clean_dom_content(html, 'blocks'), args.chunk_tokens)]
+    scraper.llm.LLM_BACKOFF_BASE_SECONDS = args.llm_latency
+    llm = StubLLM(args.llm_latency, args.rate_limit_concurrency)
+    merger = TableMerger()
+    first_row = None
+    start = time.perf_counter()
+    for _, table in extract_chunks(chunks, 'Extract the text', llm_call=llm,
+                                        max_concurrency=args.rate_limit_concurrency, tokens_per_minute=10 ** 9):
+        if merger.add(table) and first_row is None:
+            first_row = time.perf_counter() - start
+    total = time.perf_counter() - start
+    print(f"{len(chunks)} chunks, {len(merger)} rows, {args.llm_latency * 1000:.0f} ms latency")
+    print(f"first row {first_row:.2f}s, batch complete {total:.2f}s ({first_row / total:.0%} of total)")
+
+    # Stopping early must cancel the chunks still in flight
+    llm = StubLLM(args.llm_latency, args.rate_limit_concurrency)
+    stream = extract_chunks(chunks, 'Extract the text', llm_call=llm,
+                                 max_concurrency=args.rate_limit_concurrency, tokens_per_minute=10 ** 9)
+    next(stream)
+    stream.close()
+    print(f"stopped after first chunk: {llm.calls} of {len(chunks)} calls made, {llm.active} still active")
+    return 0
+
+
+class StubMessage:
+    """Chat model message whose str() matches what parse_llm_response expects"""
+
+    def __init__(self, content):
+        self.content = content
+
+    def __str__(self):
+        return f"content={self.content!r} additional_kwargs={{}} response_metadata={{}}"
+
+
+# Real-world cell values that the markdown path mangles
+AWKWARD_VALUES = ['plain text', 'Say "hello"', "O'Reilly", '5\'11" tall', 'A | B combo', 'C:\\Users\\shop',
+                  '$1,299.00']
+
+
+def padded_markdown_table(columns, rows):
+    """Render rows as the aligned markdown table the prompt asks for"""
+    cells = [columns] + [[str(row[column]) for column in columns] for row in rows]
+    widths = [max(len(line[i]) for line in cells) for i in range(len(columns))]
+    lines = ['| ' + ' | '.join(cell.ljust(width) for cell, width in zip(line, widths)) + ' |' for line in cells]
+    lines.insert(1, '|' + '|'.join('-' * (width + 2) for width in widths) + '|')
+    return '\n'.join(lines)
+
+
+def bench_output_formats(pages, args):
+    """Rows and cells that survive the markdown-table and JSON-rows paths, and the output tokens each costs"""
+    records = [record for html in pages.values()
+               for record in split_records(clean_dom_content(html, 'blocks'))]
+    columns = parse_columns('item, detail, price:number')
+    names = [name for name, _ in columns]
+    truth = [{'item': ' '.join(record.split()[:8]), 'detail': AWKWARD_VALUES[i % len(AWKWARD_VALUES)],
+              'price': round(1 + i * 0.25, 2)} for i, record in enumerate(records[:args.pages])]
+    batches = [truth[i:i + 25] for i in range(0, len(truth), 25)]
+
+    table_merger, row_merger = TableMerger(), RowMerger()
+    table_tokens = json_tokens = 0
+    for batch in batches:
+        table = padded_markdown_table(names, batch)
+        table_tokens += count_tokens(table)
+        table_merger.add(parse_llm_response(StubMessage(table)))
+        # Tool-call arguments as the model emits them, with the price as text
+        arguments = {'rows': [dict(row, price=f"${row['price']:,.2f}") for row in batch]}
+        json_tokens += count_tokens(json.dumps(arguments))
+        row_merger.add(parse_json_rows(arguments, columns))
+
+    expected = {tuple(str(row[name]) for name in names) for row in truth}
+    print(f"{len(truth)} rows in {len(batches)} chunk responses")
+    print(f"{'format':<8}{'rows':>7}{'intact rows':>13}{'output tokens':>15}")
+    for label, frame, tokens in (('table', table_merger.to_dataframe(), table_tokens),
+                                 ('json', row_merger.to_dataframe(), json_tokens)):
+        got = [] if frame is None else [tuple(str(value) for value in row) for row in frame.itertuples(index=False)]
+        intact = sum(1 for row in got if row in expected)
+        print(f"{label:<8}{len(got):>7}{intact:>13}{tokens:>15}")
+    return 0
+
+
+def legacy_merge_tables(tables):
+    """merge_tables before the columnar merge: first table's header, exact-string dedup"""
+    if not tables:
+        return None
+    table_lines = [table.split('\n') for table in tables if table]
+    headers = table_lines[0][0]
+    separator = table_lines[0][1]
+    seen_rows = set()
+    merged_rows = []
+    for table in table_lines:
+        for row in table[2:]:
+            if row not in seen_rows and row.strip():
+                seen_rows.add(row)
+                merged_rows.append(row)
+    return '\n'.join([headers, separator] + merged_rows)
+
+
+MERGE_HEADERS = {'name': ['Product Name', 'product name', 'PRODUCT  NAME', 'Product_Name'],
+                 'price': ['Price', 'price', ' PRICE '],
+                 'stock': ['Stock', 'stock', 'Stock:']}
+
+
+def synthetic_chunk_tables(total_rows, rows_per_table=50, seed=0):
+    """Chunk tables with shuffled/renamed headers; about 20% repeat rows with case or spacing
+    changes and 10% repeat them with a one-character typo. Returns (tables, unique rows)"""
+    rng = random.Random(seed)
+    kept = []
+    tables = []
+    for start in range(0, total_rows, rows_per_table):
+        fields = list(MERGE_HEADERS)
+        rng.shuffle(fields)
+        header = [rng.choice(MERGE_HEADERS[field]) for field in fields]
+        lines = ['| ' + ' | '.join(header) + ' |', '|' + '|'.join('---' for _ in fields) + '|']
+        for _ in range(min(rows_per_table, total_rows - start)):
+            roll = rng.random()
+            if kept and roll < 0.3:
+                row = dict(rng.choice(kept))
+                if roll < 0.2:
+                    row['name'] = rng.choice([row['name'].upper(), row['name'].replace(' ', '  ')])
+                else:
+                    i = rng.randrange(len(row['name']) - 7, len(row['name']))
+                    row['name'] = row['name'][:i] + rng.choice('xyz') + row['name'][i + 1:]
+            else:
+                row = {'name': f"Item {len(kept)} {rng.choice(['Deluxe', 'Basic', 'Pro'])} edition",
+                       'price': f"${rng.randrange(1, 2000)}.{rng.randrange(100):02d}",
+                       'stock': rng.choice(['in stock', 'out of stock'])}
+                kept.append(row)
+            lines.append('| ' + ' | '.join(row[field] for field in fields) + ' |')
+        tables.append('\n'.join(lines))
+    return tables, len(kept)
+
+
+def count_misaligned(frame):
+    """Rows whose product-name column does not hold a product name"""
+    name_column = next(column for column in frame.columns if normalize_column(column) == 'product_name')
+    return sum(1 for value in frame[name_column] if not str(value).lower().startswith('item'))
+
+
+def bench_merge(pages, args):
+    """Legacy merge_tables vs. the columnar, header-aligned merge on synthetic chunk tables"""
+    tables, unique = synthetic_chunk_tables(args.rows)
+    print(f"{args.rows} rows in {len(tables)} tables, {unique} unique records")
+    mergers = [
+        ('legacy merge_tables', lambda: markdown_table_to_df(legacy_merge_tables(tables))),
+        ('RowMerger', lambda: merge_with(TableMerger(), tables)),
+        ('RowMerger fuzzy', lambda: merge_with(TableMerger(ROW_FUZZY_SIMILARITY), tables)),
+    ]
+    markdown_table_to_df(legacy_merge_tables(tables[:1]))  # import pandas outside the timings
+    print(f"{'merge':<22}{'seconds':>9}{'peak MB':>9}{'rows':>9}{'misaligned':>12}")
+    for label, merge in mergers:
+        start = time.perf_counter()
+        frame = merge()
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()
+        merge()
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+        print(f"{label:<22}{elapsed:>9.2f}{peak:>9.1f}{len(frame):>9}{count_misaligned(frame):>12}")
+    return 0
+
+
+def merge_with(merger, tables):
+    for table in tables:
+        merger.add(table)
+    return merger.to_dataframe()
+
+
+def bench_relevance(pages, args):
+    """Recall and tokens sent by the BM25 relevance filter on the labelled requests in relevance_labels.json"""
+    with open(os.path.join(args.fixtures, 'relevance_labels.json'), encoding='utf-8') as f:
+        cases = json.load(f)
+    ratios = (0, 0.1, 0.25, 0.5, 0.75)
+    print(f"{len(cases)} labelled requests, {args.chunk_tokens}-token chunks")
+    print(f"{'ratio':>6}{'recall':>9}{'chunks sent':>13}{'tokens sent':>13}{'ms/request':>12}")
+    chunked = {}
+    for ratio in ratios:
+        found = labelled = sent_chunks = all_chunks = sent_tokens = all_tokens = 0
+        elapsed = 0.0
+        for case in cases:
+            if case['fixture'] not in chunked:
+                content = clean_dom_content(pages[case['fixture']], 'blocks')
+                chunks = chunk_records(content, args.chunk_tokens)
+                chunked[case['fixture']] = (chunks, [' '.join(chunk.split()) for chunk in chunks],
+                                            [count_tokens(chunk) for chunk in chunks])
+            chunks, normalized, tokens = chunked[case['fixture']]
+            start = time.perf_counter()
+            kept = select_relevant_chunks(chunks, case['request'], ratio)
+            elapsed += time.perf_counter() - start
+            # Recall counts labelled items that reach the LLM whole
+            for item in case['relevant']:
+                if any(item in text for text in normalized):
+                    labelled += 1
+                    found += any(item in normalized[i] for i in kept)
+            sent_chunks += len(kept)
+            all_chunks += len(chunks)
+            sent_tokens += sum(tokens[i] for i in kept)
+            all_tokens += sum(tokens)
+        print(f"{ratio:>6}{found / labelled:>9.1%}{sent_chunks:>7}/{all_chunks:<5}{sent_tokens / all_tokens:>13.1%}"
+              f"{elapsed / len(cases) * 1000:>12.2f}")
+    return 0
+
+
+def count_cut_records(records, chunks):
+    """Records that do not appear whole in any chunk"""
+    normalized_chunks = [' '.join(chunk.split()) for chunk in chunks]
+    return sum(1 for record in records
+               if not any(' '.join(record.split()) in chunk for chunk in normalized_chunks))
+
+
+# split_content gets the character budget of the same token budget, at the
+# 4 characters per token count_tokens assumes without a tokenizer
+CHUNKING_BUDGETS = [1000, DEFAULT_CHUNK_TOKENS]
+CHARS_PER_TOKEN = 4
+
+
+def bench_chunking(pages, args):
+    """Compare split_content with the token-aware record chunker at equal budgets on chunks, packing and cut records"""
+    contents = [clean_dom_content(html, 'blocks') for html in pages.values()]
+    print(f"{'chunker':<34}{'chunks':>8}{'packing':>9}{'records cut':>13}")
+    for budget in sorted(set(CHUNKING_BUDGETS + [args.chunk_tokens])):
+        chars = budget * CHARS_PER_TOKEN
+        for label, chunker in ((f"split_content({chars} chars)", lambda content: split_content(content, chars)),
+                               (f"chunk_records({budget} tokens)", lambda content: chunk_records(content, budget))):
+            total_chunks = total_tokens = total_cut = 0
+            for content in contents:
+                chunks = chunker(content)
+                total_chunks += len(chunks)
+                total_tokens += sum(count_tokens(chunk) for chunk in chunks)
+                total_cut += count_cut_records(split_records(content), chunks)
+            packing = total_tokens / (total_chunks * budget) if total_chunks else 0.0
+            print(f"{label:<34}{total_chunks:>8}{packing:>9.1%}{total_cut:>13}")
+    return 0
+
+
+def bench_clean_pool(pages, args):
+    """Pages/s of CleaningPool per worker count against cleaning in-process"""
+    corpus = [html for _, html in zip(range(args.pages), itertools.cycle(pages.values()))]
+    start = time.perf_counter()
+    expected = [clean_dom_content(html, 'blocks') for html in corpus]
+    serial_rate = len(corpus) / (time.perf_counter() - start)
+    print(f"{len(corpus)} pages, {os.cpu_count()} CPUs")
+    print(f"{'workers':<10}{'pages/s':>9}{'speedup':>9}")
+    print(f"{'in-process':<10}{serial_rate:>9.1f}{1:>9.2f}")
+
+    mismatched = False
+    workers = 1
+    while workers <= max(4, os.cpu_count() or 1):
+        with CleaningPool(workers) as pool:
+            list(pool.map(corpus[:workers], 'blocks'))  # start the workers outside the timing
+            start = time.perf_counter()
+            outputs = list(pool.map(corpus, 'blocks'))
+            rate = len(corpus) / (time.perf_counter() - start)
+        mismatched = mismatched or outputs != expected
+        print(f"{workers:<10}{rate:>9.1f}{rate / serial_rate:>9.2f}")
+        workers *= 2
+    if mismatched:
+        print("OUTPUT MISMATCH vs in-process cleaning")
+        return 1
+    print("outputs identical")
+    return 0
+
+
+# The pipeline benchmark replays the fixtures through clean, chunk, relevance,
+# extraction and merge with a fake LLM, and compares the figures against a
+# baseline saved with --save-baseline.
+PIPELINE_DESCRIPTION = "Extract all product names and prices"
+PIPELINE_BASELINE_PATH = os.path.join(FIXTURES_DIR, 'pipeline_baseline.json')
+LLM_RECORDINGS_PATH = os.path.join(FIXTURES_DIR, 'llm_recordings.json')
+# Figures where higher is better; every other timing, memory and token figure is better lower
+HIGHER_IS_BETTER = ('pages_per_second', 'per_second')
+# Stages faster than this per call, and p95s over fewer calls, are too noisy to flag
+PIPELINE_NOISE_FLOOR_SECONDS = 0.001
+PIPELINE_P95_MIN_CALLS = 20
+
+
+def recording_key(chunk, parse_description):
+    return hashlib.sha256(f"{parse_description}\0{chunk}".encode('utf-8')).hexdigest()[:32]
+
+
+class ReplayLLM:
+    """Fake chat model with seeded latency: replays recorded responses, else tabulates the chunk's numeric records"""
+
+    def __init__(self, latency, recordings=None, seed=0):
+        self.latency = latency
+        self.recordings = recordings or {}
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.replayed = 0
+
+    async def __call__(self, chunk, parse_description):
+        self.calls += 1
+        await asyncio.sleep(self.latency * self.random.uniform(0.8, 1.2))
+        key = recording_key(chunk, parse_description)
+        if key in self.recordings:
+            self.replayed += 1
+            return self.recordings[key]
+        rows = [record.replace('|', '/') for record in split_records(chunk) if re.search(r'\d', record)][:20]
+        return '| Text |\n|---|\n' + '\n'.join(f'| {row} |' for row in rows) if rows else None
+
+
+class RecordingLLM:
+    """Calls the real model and keeps its responses for ReplayLLM"""
+
+    def __init__(self, recordings):
+        self.recordings = recordings
+
+    async def __call__(self, chunk, parse_description):
+        table = await aparse_with_llm(chunk, parse_description)
+        self.recordings[recording_key(chunk, parse_description)] = table
+        return table
+
+
+def run_pipeline(pages, args, llm_call):
+    """Clean, chunk, filter, extract and merge every page in turn; returns (seconds, rows)"""
+    merger = TableMerger()
+    start = time.perf_counter()
+    for html in pages.values():
+        content = clean_with_cache(html, 'blocks')
+        chunks = chunk_records(content, args.chunk_tokens)
+        chunks = [chunks[i] for i in select_relevant_chunks(chunks, PIPELINE_DESCRIPTION, args.relevance)]
+        for _, table in extract_chunks(chunks, PIPELINE_DESCRIPTION, llm_call=llm_call,
+                                       max_concurrency=args.concurrency, tokens_per_minute=10 ** 9):
+            merger.add(table)
+    return time.perf_counter() - start, len(merger)
+
+
+def pipeline_results(pages, args, seconds, rows, peak_bytes, snapshot):
+    """Figures for one pipeline run from its metrics snapshot"""
+    stages = {}
+    counters = Counter()
+    for item in snapshot:
+        if item['name'] == 'stage_seconds':
+            stages[item['labels']['stage']] = {
+                'calls': item['count'],
+                'per_second': round(item['count'] / item['sum'], 1) if item['sum'] else 0.0,
+                'p50_seconds': item['p50'], 'p95_seconds': item['p95'],
+            }
+        elif item['type'] == 'counter':
+            counters[item['name'], *item['labels'].values()] += item['value']
+    return {
+        'settings': {'pages': sorted(pages), 'llm_latency': args.llm_latency, 'concurrency': args.concurrency,
+                     'chunk_tokens': args.chunk_tokens, 'relevance': args.relevance,
+                     'tokenizer': 'cl100k_base' if get_tokenizer() else 'estimate'},
+        'seconds': round(seconds, 3),
+        'pages_per_second': round(len(pages) / seconds, 2),
+        'peak_mb': round(peak_bytes / 1e6, 1),
+        'tokens_per_page': round((counters['llm_tokens_total', 'prompt'] +
+                                  counters['llm_tokens_total', 'completion']) / len(pages)),
+        'llm_calls': counters['llm_calls_total', 'ok'] + counters['llm_calls_total', 'no_result'],
+        'rows': rows,
+        'stages': stages,
+    }
+
+
+def flatten_results(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten_results(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Print each figure next to the baseline; returns the figures worse by more than tolerance"""
+    if baseline['settings'] != results['settings']:
+        print("warning: baseline was recorded with different settings or fixtures")
+    current, previous = flatten_results(results), flatten_results(baseline)
+    regressions = []
+    print(f"{'figure':<38}{'baseline':>12}{'current':>12}{'change':>9}")
+    for name, value in current.items():
+        if name.startswith('settings.') or name not in previous:
+            continue
+        before = previous[name]
+        change = (value - before) / before if before else 0.0
+        worse = -change if name.endswith(HIGHER_IS_BETTER) else change
+        stage = name.split('.')[1] if name.startswith('stages.') else None
+        noisy = stage is not None and (
+            previous.get(f'stages.{stage}.p50_seconds', 0) < PIPELINE_NOISE_FLOOR_SECONDS or
+            name.endswith('p95_seconds') and previous.get(f'stages.{stage}.calls', 0) < PIPELINE_P95_MIN_CALLS)
+        # Counts are deterministic: any difference is a behaviour change
+        flag = ''
+        if (name in ('rows', 'llm_calls') or name.endswith('.calls')) and value != before:
+            flag = '  CHANGED'
+        elif worse > tolerance and not noisy:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f"{name:<38}{before:>12}{value:>12}{change:>+9.0%}{flag}")
+    return regressions
+
+
+def bench_pipeline(pages, args):
+    """Full offline pipeline with a fake LLM: per-stage throughput and latency, peak memory, tokens per page"""
+    scraper.llm.LLM_BACKOFF_BASE_SECONDS = args.llm_latency
+    recordings = {}
+    if os.path.exists(LLM_RECORDINGS_PATH):
+        with open(LLM_RECORDINGS_PATH, encoding='utf-8') as f:
+            recordings = json.load(f)
+
+    if args.record_llm:
+        get_metrics().reset()
+        seconds, rows = run_pipeline(pages, args, RecordingLLM(recordings))
+        with open(LLM_RECORDINGS_PATH, 'w', encoding='utf-8') as f:
+            json.dump(recordings, f, indent=1, sort_keys=True)
+        print(f"recorded {len(recordings)} LLM responses to {LLM_RECORDINGS_PATH}")
+
+    # Each figure keeps its best value over the runs; peak memory comes from one extra traced run
+    runs = []
+    for _ in range(args.repeat):
+        get_metrics().reset()
+        llm = ReplayLLM(args.llm_latency, recordings)
+        seconds, rows = run_pipeline(pages, args, llm)
+        runs.append(flatten_results(pipeline_results(pages, args, seconds, rows, 0, get_metrics().snapshot())))
+    get_metrics().reset()
+    tracemalloc.start()
+    run_pipeline(pages, args, ReplayLLM(args.llm_latency, recordings))
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    results = pipeline_results(pages, args, seconds, rows, peak_bytes, get_metrics().snapshot())
+    best = {name: (max if name.endswith(HIGHER_IS_BETTER) else min)(run[name] for run in runs)
+            for name in runs[0]}
+    results.update(seconds=best['seconds'], pages_per_second=best['pages_per_second'])
+    for stage, figures in results['stages'].items():
+        for figure in figures:
+            figures[figure] = best.get(f'stages.{stage}.{figure}', figures[figure])
+    print(f"{len(pages)} pages, {llm.calls} LLM calls ({llm.replayed} replayed from recordings), "
+          f"{args.llm_latency * 1000:.0f} ms latency")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+        print(json.dumps(results, indent=2))
+        print(f"baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(json.dumps(results, indent=2))
+        print(f"no baseline at {args.baseline}; save one with --save-baseline")
+        return 0
+    with open(args.baseline, encoding='utf-8') as f:
+        regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} figures regressed by more than {args.tolerance:.0%}")
+        return 1
+    print(f"no regressions beyond {args.tolerance:.0%}")
+    return 0
+
+
+LARGE_PAGE_PROBE = """
+import re, sys, time
+mode, path, chunk_tokens = sys.argv[1], sys.argv[2], int(sys.argv[3])
+from scraper.chunking import chunk_records
+from scraper.cleaning import clean_dom_content
+from scraper.streaming import iter_chunks
+
+def status_mb(field):
+    with open('/proc/self/status') as f:
+        return int(re.search(field + r':\\s+(\\d+)', f.read()).group(1)) / 1024
+
+# Reset the peak RSS so it only covers the run below (Linux)
+with open('/proc/self/clear_refs', 'w') as f:
+    f.write('5')
+before = status_mb('VmRSS')
+start = time.perf_counter()
+if mode == 'streaming':
+    with open(path, 'rb') as f:
+        chunks = sum(1 for _ in iter_chunks(f, chunk_tokens))
+else:
+    with open(path, encoding='utf-8') as f:
+        html = f.read()
+    chunks = len(chunk_records(clean_dom_content(html, 'blocks', mode), chunk_tokens))
+seconds = time.perf_counter() - start
+print(seconds, chunks, status_mb('VmHWM') - before)
+"""
+
+
+def write_large_page(path, target_mb, seed=0):
+    """Write a synthetic infinite-scroll listing of about target_mb megabytes"""
+    rng = random.Random(seed)
+    words = ['compact', 'widget', 'premium', 'steel', 'portable', 'cotton', 'deluxe', 'travel', 'blue', 'set']
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<html><head><script>window.feed = [];</script><style>.card{}</style></head><body>'
+                '<nav><a href="/">Home</a></nav><main><h1>All products</h1>')
+        written, i = 0, 0
+        while written < target_mb * 1e6:
+            card = (f'<div class="product-card" data-id="{i}"><h3>{" ".join(rng.sample(words, 3)).title()} #{i}</h3>'
+                    f'<span class="price">${rng.uniform(5, 500):.2f}</span>'
+                    f'<p>{" ".join(rng.choices(words, k=25))}.</p>'
+                    f'<div class="tracking-pixel" data-tracking="1">t</div>'
+                    f'<a href="/p/{i}">View product</a></div>\n')
+            f.write(card)
+            written += len(card)
+            i += 1
+        f.write('</main><footer>Footer</footer></body></html>')
+
+
+def bench_large_page(pages, args):
+    """Peak RSS and time to clean and chunk one very large page, whole-tree vs. streaming"""
+    path = os.path.join(tempfile.mkdtemp(), 'large_page.html')
+    try:
+        write_large_page(path, args.page_mb)
+        size_mb = os.path.getsize(path) / 1e6
+        print(f"{size_mb:.1f} MB page")
+        print(f"{'mode':<14}{'seconds':>9}{'chunks':>8}{'peak RSS MB':>13}{'x page':>8}")
+        for mode in ('selectolax', 'html.parser', 'streaming'):
+            result = subprocess.run([sys.executable, '-c', LARGE_PAGE_PROBE, mode, path, str(args.chunk_tokens)],
+                                    capture_output=True, text=True, cwd=REPO_DIR)
+            if result.returncode:
+                print(f"{mode:<14}failed: {result.stderr.strip().splitlines()[-1]}")
+                continue
+            seconds, chunks, peak_mb = result.stdout.split()[-3:]
+            print(f"{mode:<14}{float(seconds):>9.2f}{chunks:>8}{float(peak_mb):>13.1f}"
+                  f"{float(peak_mb) / size_mb:>8.1f}")
+    finally:
+        shutil.rmtree(os.path.dirname(path))
+    return 0
+
+
+NORMALIZE_ADVERSARIAL = {
+    'unclosed brackets': '[',
+    'unclosed parentheses': '(',
+    'repeated words': 'ab ',
+    'pipes': ' |',
+    'punctuation': '.,;',
+}
+def bench_normalize(pages, args):
+    """Line normalizer vs. the legacy regex cascade: MB/s and growth on adversarial input"""
+    records = [record for html in pages.values() for mode in TEXT_MODES
+               for record in extract_text_records(html, mode)]
+    base = '\n'.join(records)
+    text = (base + '\n') * max(1, math.ceil(args.text_mb * 1e6 / len(base)))
+    size_mb = len(text.encode('utf-8')) / 1e6
+    print(f"{size_mb:.1f} MB of extracted element text")
+    for name, func in (('legacy cascade', legacy_normalize), ('normalize_text', normalize_text)):
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            func(text)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"{name:<16}{best:>8.3f}s {size_mb / best:>8.1f} MB/s")
+
+    # Doubling twice should take about 4x as long in linear time, 16x in quadratic
+    print(f"\n{'adversarial input':<22}{'legacy 4x growth':>18}{'normalize 4x growth':>21}")
+    for name, unit in NORMALIZE_ADVERSARIAL.items():
+        growth = []
+        for func in (legacy_normalize, normalize_text):
+            times = []
+            for size in (4000, 16000):
+                sample = unit * (size // len(unit)) + 'end'
+                start = time.perf_counter()
+                func(sample)
+                times.append(time.perf_counter() - start)
+            growth.append(times[1] / max(times[0], 1e-6))
+        print(f"{name:<22}{growth[0]:>17.1f}x{growth[1]:>20.1f}x")
+
+    return 0
+
+
+# The incremental benchmark re-extracts each fixture after a simulated day of
+# catalog edits: prices changed, one record removed, one inserted.
+CATALOG_NUMBER_RE = re.compile(r'[$€£]?\d[\d.,]*(?=\D*$)')
+
+
+class CatalogLLM:
+    """Fake chat model that tabulates each record with a number as an Item / Price row"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self, chunk, parse_description):
+        self.calls += 1
+        rows = []
+        for record in split_records(chunk):
+            match = CATALOG_NUMBER_RE.search(record)
+            if match:
+                item = record[:match.start()].strip().replace('|', '/')
+                rows.append(f"| {item} | {match.group()} |")
+        return '| Item | Price |\n|---|---|\n' + '\n'.join(rows) if rows else None
+
+
+def edit_catalog(content, edits, rng):
+    """A day's changes to cleaned content: edits prices bumped, one record removed, one inserted"""
+    records = content.split('\n')
+    counts = Counter(records)
+    candidates = [i for i, record in enumerate(records) if counts[record] == 1 and CATALOG_NUMBER_RE.search(record)]
+    if len(candidates) < edits + 1:
+        return content
+    chosen = rng.sample(candidates, edits + 1)
+    for i in chosen[:edits]:
+        records[i] = CATALOG_NUMBER_RE.sub(lambda match: match.group() + '9', records[i])
+    del records[chosen[-1]]
+    records.insert(rng.randrange(len(records) + 1), 'LINK: New arrival 1234 (URL: /p/new)')
+    return '\n'.join(records)
+
+
+def row_set(rows):
+    return Counter(tuple(sorted(map(str, row.items()))) for row in rows)
+
+
+def bench_incremental(pages, args):
+    """LLM calls and prompt tokens of an incremental re-extraction after small edits, vs. a full one
+
+    The relevance filter is off, so every chunk counts.
+    """
+    rng = random.Random(0)
+    directory = tempfile.mkdtemp()
+    try:
+        store = SnapshotStore(os.path.join(directory, 'snapshots.sqlite3'))
+        print(f"{args.edits} prices changed, 1 record removed, 1 inserted per page; "
+              f"{args.chunk_tokens} token chunks")
+        print(f"{'page':<24}{'chunks':>7}{'full':>6}{'sent':>6}{'avoided':>8}{'tokens saved':>13}"
+              f"{'+/~/-':>9}  same rows")
+        totals = Counter()
+        for name, html in sorted(pages.items()):
+            before = clean_dom_content(html, 'blocks')
+            after = edit_catalog(before, args.edits, rng)
+            options = dict(chunk_tokens=args.chunk_tokens, relevance=0,
+                           tokens_per_minute=10 ** 9, max_concurrency=args.concurrency)
+            extract_incremental(name, before, PIPELINE_DESCRIPTION, store, llm_call=CatalogLLM(), **options)
+
+            get_metrics().reset()
+            full_llm = CatalogLLM()
+            full = extract_incremental(name, after, PIPELINE_DESCRIPTION, SnapshotStore(os.path.join(directory, name)),
+                                       llm_call=full_llm, **options)
+            full_tokens = get_metrics().counter('llm_tokens_total', kind='prompt')
+            get_metrics().reset()
+            llm = CatalogLLM()
+            incremental = extract_incremental(name, after, PIPELINE_DESCRIPTION, store, llm_call=llm, **options)
+            tokens = get_metrics().counter('llm_tokens_total', kind='prompt')
+
+            report = incremental['report']
+            same = row_set(incremental['rows']) == row_set(full['rows'])
+            changes = f"{report['added']}/{report['changed']}/{report['removed']}"
+            saved = 1 - tokens / full_tokens if full_tokens else 0.0
+            print(f"{name:<24}{report['chunks']:>7}{full_llm.calls:>6}{llm.calls:>6}"
+                  f"{report['llm_calls_avoided']:>8}{saved:>13.0%}{changes:>9}  {'yes' if same else 'NO'}")
+            totals.update(full_calls=full_llm.calls, calls=llm.calls, full_tokens=full_tokens, tokens=tokens,
+                          mismatched=not same)
+        print(f"{'total':<24}{'':>7}{totals['full_calls']:>6}{totals['calls']:>6}"
+              f"{totals['full_calls'] - totals['calls']:>8}{1 - totals['tokens'] / max(1, totals['full_tokens']):>13.0%}")
+    finally:
+        shutil.rmtree(directory)
+    return 1 if totals['mismatched'] else 0
+
+
+# The templates benchmark learns a template from each labelled page's rows,
+# which stand in for the LLM's answer, then applies it to a reworded copy of
+# the page (same layout, different text) and to a restyled copy (classes
+# renamed, cells turned into headers), where its checks must fail.
+TEMPLATE_ROWS_PATH = os.path.join(FIXTURES_DIR, 'template_rows.json')
+TEMPLATE_WORD_RE = re.compile(r'(?<!&)\b[A-Za-z]+\b')
+TEXT_NODE_RE = re.compile(r'>([^<]+)<')
+CLASS_ATTR_RE = re.compile(r'class="([^"]*)"')
+
+
+def reword(text):
+    return TEMPLATE_WORD_RE.sub(lambda match: codecs.encode(match.group(), 'rot13'), text)
+
+
+def reword_page(html):
+    return TEXT_NODE_RE.sub(lambda match: '>' + reword(match.group(1)) + '<', html)
+
+
+def restyle_page(html):
+    html = CLASS_ATTR_RE.sub(lambda match: 'class="' + ' '.join(f'{name}-v2' for name in match.group(1).split()) + '"',
+                             html)
+    return html.replace('<td', '<th').replace('</td>', '</th>')
+
+
+def bench_templates(pages, args):
+    """Precision and recall of learned extraction templates against labelled LLM rows, and their speed"""
+    with open(TEMPLATE_ROWS_PATH, encoding='utf-8') as f:
+        labels = json.load(f)
+    directory = tempfile.mkdtemp()
+    failed = 0
+    try:
+        store = TemplateStore(os.path.join(directory, 'templates.sqlite3'))
+        print(f"{'page':<24}{'rows':>6}{'learn s':>9}{'source P/R':>12}{'reworded P/R':>14}{'apply ms':>10}"
+              f"{'restyled':>10}{'relearned P/R':>15}")
+        for entry in labels:
+            if entry['fixture'] not in pages:
+                continue
+            html = pages[entry['fixture']]
+            url = f"https://fixtures.test/{entry['fixture']}"
+            columns = parse_columns(entry['columns'])
+            rows = [dict(zip([name for name, _ in columns], row)) for row in entry['rows']]
+            options = (entry['request'], entry['format'], columns if entry['format'] == 'json' else None)
+
+            start = time.perf_counter()
+            version = learn_template(store, url, html, rows, *options)
+            learn_seconds = time.perf_counter() - start
+            if version is None:
+                print(f"{entry['fixture']:<24}{len(rows):>6}{learn_seconds:>9.2f}  no template learned")
+                failed += 1
+                continue
+            template = store.latest(*template_key(url, *options))[1]
+            source = row_agreement(apply_template(template, html), rows)
+
+            reworded_html = reword_page(html)
+            reworded_rows = [{name: reword(value) if isinstance(value, str) else value for name, value in row.items()}
+                             for row in rows]
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                extracted = extract_with_template(store, url, reworded_html, *options)
+                times.append(time.perf_counter() - start)
+            reworded = row_agreement(extracted or [], reworded_rows)
+
+            restyled_html = restyle_page(html)
+            fell_back = extract_with_template(store, url, restyled_html, *options) is None
+            relearned = learn_template(store, url, restyled_html, rows, *options)
+            relearned_figures = row_agreement(extract_with_template(store, url, restyled_html, *options) or [], rows)
+
+            failed += min(reworded) < TEMPLATE_MIN_AGREEMENT or not fell_back or relearned is None
+            print(f"{entry['fixture']:<24}{len(rows):>6}{learn_seconds:>9.2f}"
+                  f"{f'{source[0]:.2f}/{source[1]:.2f}':>12}{f'{reworded[0]:.2f}/{reworded[1]:.2f}':>14}"
+                  f"{min(times) * 1000:>10.1f}{'LLM' if fell_back else 'TEMPLATE':>10}"
+                  f"{f'v{relearned} {relearned_figures[0]:.2f}/{relearned_figures[1]:.2f}':>15}")
+    finally:
+        shutil.rmtree(directory)
+    return 1 if failed else 0
+
+
+# The jobs benchmark crawls the fixtures through the job queue with 1, 2, 4
+# and 8 worker processes. The local server answers after --fetch-latency
+# seconds like a remote site would, so fetches overlap across workers even
+# on one CPU; cleaning is CPU-bound and caps the speedup at the CPU count.
+JOB_WORKER_COUNTS = [1, 2, 4, 8]
+JOB_LEASE_SECONDS = 2
+
+
+class SlowHandler(QuietHandler):
+    latency = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        try:
+            super().do_GET()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the benchmark killed the worker that was reading
+
+
+def run_job(queue_path, urls, workers, kill_after=None):
+    """Run a fetch-and-clean job to the end with worker processes; returns (seconds, status)
+
+    With kill_after, the first worker is killed that many seconds in, while
+    it holds a lease, and a replacement is started.
+    """
+    queue = SQLiteQueue(queue_path)
+    job_id = queue.submit(urls, job_settings())
+    options = dict(fetch=fetch_over_http, use_cache=False, lease_seconds=JOB_LEASE_SECONDS,
+                   poll_seconds=0.05, exit_when_idle=True)
+    started = time.perf_counter()
+    processes = start_workers(workers, queue_path, **options)
+    if kill_after is not None:
+        time.sleep(kill_after)
+        processes[0].kill()
+        processes += start_workers(1, queue_path, **options)
+    for process in processes:
+        process.join()
+    return time.perf_counter() - started, queue.status(job_id)
+
+
+def bench_jobs(pages, args):
+    """Pages per second of a queued crawl with more worker processes, and recovery from a killed worker"""
+    SlowHandler.latency = args.fetch_latency
+    directory = tempfile.mkdtemp()
+    failed = 0
+    try:
+        with serve_fixtures(args.fixtures, SlowHandler) as port:
+            names = sorted(pages)
+            urls = [f'http://127.0.0.1:{port}/{names[i % len(names)]}?page={i}' for i in range(args.pages)]
+            print(f"{args.pages} pages, {args.fetch_latency:.2f}s fetch latency, {os.cpu_count()} CPUs")
+            print(f"{'workers':<9}{'seconds':>9}{'pages/s':>9}{'speedup':>9}{'efficiency':>11}  pages done")
+            single = None
+            for workers in JOB_WORKER_COUNTS:
+                seconds, status = run_job(os.path.join(directory, f'{workers}.sqlite3'), urls, workers)
+                single = single or seconds
+                failed += status['pages_done'] != len(urls)
+                print(f"{workers:<9}{seconds:>9.2f}{len(urls) / seconds:>9.1f}{single / seconds:>9.2f}"
+                      f"{single / seconds / workers:>11.0%}  {status['pages_done']}/{len(urls)}")
+
+            seconds, status = run_job(os.path.join(directory, 'killed.sqlite3'), urls, 4,
+                                      kill_after=args.fetch_latency * 2)
+            failed += status['pages_done'] != len(urls)
+            print(f"\n4 workers, one killed mid-lease and replaced: {status['pages_done']}/{len(urls)} pages done "
+                  f"in {seconds:.2f}s ({status['pages_failed']} failed)")
+    finally:
+        shutil.rmtree(directory)
+    return 1 if failed else 0
+
+
+# The export benchmark writes the merge benchmark's synthetic chunk tables,
+# spread over EXPORT_DOMAINS sites, once through the legacy merged-markdown
+# path and once per sink configuration, at a tenth of --rows and at --rows.
+EXPORT_DOMAINS = 20
+EXPORT_SINKS = [('jsonl', None, ()), ('jsonl', 'gzip', ('domain',)), ('csv', None, ()),
+                ('csv', 'gzip', ('domain', 'date')), ('parquet', 'snappy', ('domain',))]
+
+
+def directory_mb(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path) / 2 ** 20
+    return sum(os.path.getsize(os.path.join(directory, name))
+               for directory, _, files in os.walk(path) for name in files) / 2 ** 20
+
+
+def legacy_export(tables, path):
+    """Rows as one merged markdown string, parsed into a DataFrame and written as CSV"""
+    markdown_table_to_df(legacy_merge_tables(tables)).to_csv(path, index=False)
+
+
+def sink_export(tables, path, format, compression, partition_by):
+    with RowSink(path, format, partition_by, compression) as sink:
+        for i, table in enumerate(tables):
+            sink.write(table, f'https://shop{i % EXPORT_DOMAINS}.example/page{i}')
+
+
+def bench_export(pages, args):
+    """Time, peak memory and file size of exporting rows through the sinks vs. the legacy DataFrame path"""
+    directory = tempfile.mkdtemp()
+    markdown_table_to_df(legacy_merge_tables(synthetic_chunk_tables(10)[0]))  # import pandas outside the timings
+    try:
+        print(f"{'export':<28}{'rows':>9}{'seconds':>9}{'rows/s':>10}{'peak MB':>9}{'file MB':>9}")
+        for rows in (args.rows // 10, args.rows):
+            tables, _ = synthetic_chunk_tables(rows)
+            runs = [('legacy markdown + DataFrame', partial(legacy_export, tables))]
+            for format, compression, partition_by in EXPORT_SINKS:
+                try:
+                    export_options(f'rows.{format}', format, compression)
+                except ValueError as e:
+                    print(f"{format + ' sink':<28}skipped: {str(e)}")
+                    continue
+                label = f"{format} {compression or ''} {'/'.join(partition_by)}"
+                runs.append((label, partial(sink_export, tables, format=format, compression=compression,
+                                            partition_by=partition_by)))
+            for number, (label, export) in enumerate(runs):
+                path = os.path.join(directory, f'{rows}-{number}')
+                start = time.perf_counter()
+                export(path)
+                elapsed = time.perf_counter() - start
+                traced_path = path + '-traced'
+                tracemalloc.start()
+                export(traced_path)
+                peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                tracemalloc.stop()
+                print(f"{label:<28}{rows:>9}{elapsed:>9.2f}{rows / elapsed:>10.0f}{peak:>9.1f}"
+                      f"{directory_mb(path):>9.1f}")
+
+        path = os.path.join(directory, f'{args.rows}-1')
+        start = time.perf_counter()
+        total = count_export_rows(path)
+        counted = time.perf_counter() - start
+        start = time.perf_counter()
+        last_page = read_export(path, total - 100, 100)
+        paged = time.perf_counter() - start
+        print(f"\npaging the {total} row jsonl export: count {counted * 1000:.0f} ms, "
+              f"last page of {len(last_page)} rows {paged * 1000:.0f} ms")
+    finally:
+        shutil.rmtree(directory)
+    return 0
+
+
+IMPORT_TARGETS = ['scraper.cleaning', 'scraper.chunking', 'scraper.llm', 'scraper.fetch',
+                  'scraper.crawl', 'scraper.cli']
+HEAVY_MODULES = ['streamlit', 'langchain_groq', 'pandas', 'selenium']
+IMPORT_PROBE = """
+import sys, time
+start = time.perf_counter()
+__import__(sys.argv[1])
+seconds = time.perf_counter() - start
+heavy = [name for name in sys.argv[2:] if name in sys.modules]
+print(seconds, ','.join(heavy))
+"""
+
+
+def bench_import(pages, args):
+    """Cold import time of each module in a fresh interpreter, and which heavy dependencies it pulls in"""
+    print(f"{'module':<20}{'seconds':>9}  heavy dependencies loaded")
+    for target in IMPORT_TARGETS:
+        times = []
+        for _ in range(args.repeat):
+            result = subprocess.run([sys.executable, '-c', IMPORT_PROBE, target] + HEAVY_MODULES,
+                                    capture_output=True, text=True, cwd=REPO_DIR)
+            if result.returncode:
+                print(f"{target:<20}{'failed':>9}  {result.stderr.strip().splitlines()[-1]}")
+                break
+            seconds, heavy = result.stdout.split(' ', 1)
+            times.append(float(seconds))
+        else:
+            print(f"{target:<20}{min(times):>9.3f}  {heavy.strip() or '-'}")
+
+    times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-m', 'scraper', '--help'], capture_output=True, check=True, cwd=REPO_DIR)
+        times.append(time.perf_counter() - start)
+    print(f"{'scraper --help':<20}{min(times):>9.3f}  (whole process)")
+
+
+BENCHMARKS = {
+    'clean': bench_clean,
+    'text-modes': bench_text_modes,
+    'parsers': bench_parsers,
+    'crawl': bench_crawl,
+    'llm': bench_llm,
+    'chunking': bench_chunking,
+    'streaming': bench_streaming,
+    'output-formats': bench_output_formats,
+    'merge': bench_merge,
+    'relevance': bench_relevance,
+    'import': bench_import,
+    'clean-pool': bench_clean_pool,
+    'pipeline': bench_pipeline,
+    'large-page': bench_large_page,
+    'normalize': bench_normalize,
+    'incremental': bench_incremental,
+    'templates': bench_templates,
+    'jobs': bench_jobs,
+    'export': bench_export,
+}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Scraping pipeline benchmarks")
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--fixtures', default=FIXTURES_DIR, help="Directory of saved HTML pages")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per measurement (best is kept)")
+    parser.add_argument('--parser', default='html.parser', choices=sorted(PARSER_BACKENDS),
+                        help="Parser backend for the clean benchmark")
+    parser.add_argument('--pages', type=int, default=200, help="Pages fetched by the crawl and jobs benchmarks, or cleaned by clean-pool")
+    parser.add_argument('--concurrency', type=int, default=8, help="Concurrency for the crawl benchmark")
+    parser.add_argument('--llm-latency', type=float, default=0.2, help="Stub LLM latency in seconds")
+    parser.add_argument('--fetch-latency', type=float, default=0.25,
+                        help="Seconds the jobs benchmark's local server waits before each response")
+    parser.add_argument('--rate-limit-concurrency', type=int, default=6,
+                        help="Concurrent calls above which the stub LLM returns 429")
+    parser.add_argument('--rows', type=int, default=100000, help="Rows generated for the merge and export benchmarks")
+    parser.add_argument('--page-mb', type=float, default=50, help="Size of the large-page benchmark's page")
+    parser.add_argument('--text-mb', type=float, default=5, help="Text size for the normalize benchmark")
+    parser.add_argument('--edits', type=int, default=3, help="Prices changed per page by the incremental benchmark")
+    parser.add_argument('--chunk-tokens', type=int, default=DEFAULT_CHUNK_TOKENS,
+                        help="Token budget passed to chunk_records")
+    parser.add_argument('--relevance', type=float, default=RELEVANCE_MIN_SCORE_RATIO,
+                        help="Relevance filter ratio for the pipeline benchmark")
+    parser.add_argument('--baseline', default=PIPELINE_BASELINE_PATH, help="Baseline file for the pipeline benchmark")
+    parser.add_argument('--save-baseline', action='store_true', help="Store this pipeline run as the baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Fraction a pipeline figure may worsen by before it counts as a regression")
+    parser.add_argument('--record-llm', action='store_true',
+                        help="Call the real LLM once and save its responses for the fake LLM to replay")
+    args = parser.parse_args()
+
+    pages = load_fixtures(args.fixtures)
+    if not pages:
+        parser.error(f"no .html fixtures found in {args.fixtures}")
+    return BENCHMARKS[args.benchmark](pages, args)
+
+
+if __name__ == '__main__':
+    raise SystemExit(main_cli())
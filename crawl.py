@@ -0,0 +1,17 @@
+"""Batch crawl from the command line
+
+Same as `python -m scraper crawl`: fetches every URL in a text file or
+sitemap, cleans it and optionally runs the LLM extraction, writing one JSON
+line per page:
+
+    python crawl.py urls.txt --describe "product names and prices" --output results.jsonl
+    python crawl.py https://example.com/sitemap.xml --concurrency 8
+    python crawl.py urls.txt --describe "products" --format json --columns "name, price:number"
+    python crawl.py urls.txt --describe "products" --merged products.csv --fuzzy
+"""
+import sys
+
+from scraper.cli import main_cli
+
+if __name__ == '__main__':
+    raise SystemExit(main_cli(['crawl'] + sys.argv[1:]))
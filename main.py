@@ -1,396 +1,29 @@
-
 import streamlit as st
-from selenium.webdriver import Remote, ChromeOptions
-from selenium.webdriver.chromium.remote_connection import ChromiumRemoteConnection
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from bs4 import BeautifulSoup
-from langchain.prompts import MessagesPlaceholder
-from langchain_groq import ChatGroq
-from langchain.load import dumps, loads
-from langchain_core.prompts import ChatPromptTemplate
-import pandas as pd
+import json
+import math
+import os
+import shutil
 import time
-import re
-from concurrent.futures import ThreadPoolExecutor
-
-# Constants
-AUTH = ''
-SBR_WEBDRIVER = ''
-GROQ_API_KEY = ''
-
-# Initialize the LLM model
-model = ChatGroq(
-    api_key=GROQ_API_KEY,
-    model="llama3-8b-8192",
-)
-
-def clean_dom_content(html_content):
-    """Clean and extract text content from HTML with improved filtering"""
-    soup = BeautifulSoup(html_content, 'html.parser')
-    
-    # Remove unwanted elements
-    unwanted_elements = [
-        'script', 'style', 'meta', 'link', 'noscript', 'iframe', 
-        'header', 'footer', 'nav', 'aside', 'cookie', 'banner',
-        '[class*="cookie"]', '[class*="popup"]', '[class*="modal"]',
-        '[class*="overlay"]', '[class*="banner"]', '[class*="notice"]',
-        '[id*="cookie"]', '[id*="popup"]', '[id*="modal"]',
-        '[class*="advertising"]', '[class*="ad-"]', '[class*="tracker"]',
-        '[data-tracking]', '[data-analytics]'
-    ]
-    
-    # Remove elements by tag name and CSS selectors
-    for element in unwanted_elements:
-        for tag in soup.select(element):
-            tag.decompose()
-    
-    # Additional cleanup of common tracking and cookie elements
-    for element in soup.find_all(True):  # Find all elements
-        # Remove tracking attributes
-        tracking_attrs = ['data-tracking', 'data-analytics', 'data-ga', 
-                         'data-gtm', 'data-pixel', 'data-fb']
-        for attr in tracking_attrs:
-            if element.has_attr(attr):
-                del element[attr]
-                
-        # Remove elements with tracking-related classes
-        if element.get('class'):
-            classes = ' '.join(element.get('class'))
-            if any(term in classes.lower() for term in ['track', 'pixel', 'gtm', 'analytics', 
-                                                      'cookie', 'popup', 'modal', 'overlay']):
-                element.decompose()
-                continue
-    
-    # Extract useful text content
-    text_elements = []
-    valid_tags = ['p', 'div', 'span', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 
-                  'li', 'td', 'th', 'a', 'article', 'section', 'main']
-    
-    for element in soup.find_all(valid_tags):
-        # Skip if element is hidden
-        if element.get('style') and ('display: none' in element['style'] or 
-                                   'visibility: hidden' in element['style']):
-            continue
-            
-        # Skip empty elements
-        text = element.get_text(strip=True)
-        if not text:
-            continue
-            
-        # Skip very short text that might be buttons or labels
-        if len(text) < 3:
-            continue
-            
-        # Add structured markers based on element type
-        if element.name in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
-            text = f"HEADING: {text}"
-        elif element.name == 'a' and element.get('href'):
-            # Clean and validate URL
-            href = element.get('href')
-            if href.startswith('javascript:') or href.startswith('#'):
-                continue
-            if not href.startswith(('http://', 'https://', '/')):
-                continue
-            text = f"LINK: {text} (URL: {href})"
-        elif element.name in ['td', 'th']:
-            text = f"TABLE_CELL: {text}"
-            
-        # Add the cleaned text
-        text_elements.append(text)
-    
-    # Join elements with proper spacing
-    clean_content = '\n'.join(text_elements)
-    
-    # Clean up whitespace and formatting
-    clean_content = re.sub(r'\s+', ' ', clean_content)  # Replace multiple spaces
-    clean_content = re.sub(r'\n\s*\n', '\n', clean_content)  # Remove empty lines
-    clean_content = re.sub(r'[^\S\n]+', ' ', clean_content)  # Clean up horizontal whitespace
-    
-    # Split into lines and clean each line
-    lines = clean_content.split('\n')
-    cleaned_lines = []
-    
-    for line in lines:
-        line = line.strip()
-        if line and len(line) > 3:  # Skip very short lines
-            # Remove common noise patterns
-            line = re.sub(r'\[.*?\]', '', line)  # Remove square bracket content
-            line = re.sub(r'\((?!URL:).*?\)', '', line)  # Remove parentheses except URLs
-            line = re.sub(r'^\W+|\W+$', '', line)  # Remove leading/trailing non-word chars
-            
-            if line:  # Only add non-empty lines
-                cleaned_lines.append(line)
-    
-    # Join cleaned lines
-    final_content = '\n'.join(cleaned_lines)
-    
-    # Remove any remaining noise patterns
-    final_content = re.sub(r'(\b\w+\b)\s+\1', r'\1', final_content)  # Remove repeated words
-    final_content = re.sub(r'\s*\|\s*', ' | ', final_content)  # Clean up table separators
-    
-    return final_content
-
-def scrape_website(url):
-    """Scrape website content with improved handling and waits"""
-    print("Connecting to Scraping Browser...")
-    options = ChromeOptions()
-    options.add_argument('--headless')
-    options.add_argument('--no-sandbox')
-    options.add_argument('--disable-dev-shm-usage')
-    
-    # Additional options to block unwanted content
-    options.add_argument('--disable-notifications')
-    options.add_argument('--disable-geolocation')
-    options.add_argument('--disable-plugins')
-    options.add_argument('--disable-javascript')  # Optional: disable JS if you don't need it
-    
-    prefs = {
-        'profile.default_content_setting_values': {
-            'cookies': 2,  # Block cookies
-            'images': 2,   # Block images
-            'notifications': 2,  # Block notifications
-            'auto_select_certificate': 2,
-            'fullscreen': 2,
-            'mouselock': 2,
-            'mixed_script': 2,
-            'media_stream': 2,
-            'media_stream_mic': 2,
-            'media_stream_camera': 2,
-            'protocol_handlers': 2,
-            'ppapi_broker': 2,
-            'automatic_downloads': 2,
-            'midi_sysex': 2,
-            'push_messaging': 2,
-            'ssl_cert_decisions': 2,
-            'metro_switch_to_desktop': 2,
-            'protected_media_identifier': 2,
-            'app_banner': 2,
-            'site_engagement': 2,
-            'durable_storage': 2
-        }
-    }
-    options.add_experimental_option('prefs', prefs)
-
-    try:
-        sbr_connection = ChromiumRemoteConnection(SBR_WEBDRIVER, "goog", "chrome")
-        with Remote(sbr_connection, options=options) as driver:
-            try:
-                driver.get(url)
-                print("Waiting for captcha to solve...")
-                solve_res = driver.execute(
-                    "executeCdpCommand",
-                    {
-                        "cmd": "Captcha.waitForSolve",
-                        "params": {"detectTimeout": 10000},
-                    },
-                )
-                print("Captcha solve status:", solve_res["value"]["status"])
-
-                # Wait for main content to load
-                time.sleep(3)
-
-                # Get the page source
-                html = driver.page_source
-                
-                # Clean and return the content
-                return clean_dom_content(html)
-
-            except Exception as e:
-                print(f"Error during page load: {str(e)}")
-                return None
-
-    except Exception as e:
-        print(f"Error connecting to browser: {str(e)}")
-        return None
-
-def scrape_website(url):
-    """Scrape website content using Selenium with improved error handling"""
-    print("Connecting to Scraping Browser...")
-    options = ChromeOptions()
-    options.add_argument('--headless')
-    options.add_argument('--no-sandbox')
-    options.add_argument('--disable-dev-shm-usage')
-
-    try:
-        sbr_connection = ChromiumRemoteConnection(SBR_WEBDRIVER, "goog", "chrome")
-        with Remote(sbr_connection, options=options) as driver:
-            driver.get(url)
-            print("Waiting for captcha to solve...")
-            solve_res = driver.execute(
-                "executeCdpCommand",
-                {
-                    "cmd": "Captcha.waitForSolve",
-                    "params": {"detectTimeout": 10000},
-                },
-            )
-            print("Captcha solve status:", solve_res["value"]["status"])
-
-            # Wait for page to load completely
-            time.sleep(3)  # Allow dynamic content to load
-
-            # Get the page source and clean it
-            html = driver.page_source
-            return clean_dom_content(html)
-
-    except Exception as e:
-        print(f"Error during scraping: {str(e)}")
-        return None
-
-def parse_with_llm(content, parse_description):
-    """Parse content using LLM with improved prompt and response handling"""
-    template = """
-You are a web scraping assistant. Based on the text content provided and the user's extraction request,
-please extract and organize the information in a clean table format.
-
-Content to analyze: {dom_content}
-
-Extraction request: {parse_description}
-
-Rules:
-1. Format the output as a SINGLE clean markdown table
-2. Use clear, concise column headers
-3. Each row must contain related information
-4. Remove duplicates and irrelevant information
-5. Ensure consistent column alignment
-6. Follow this exact format:
-   | Header1 | Header2 | Header3 |
-   |---------|---------|---------|
-   | Data1   | Data2   | Data3   |
-
-Important: 
-- Output ONLY the markdown table
-- Do not include any explanatory text
-- Do not create multiple separate tables
-- Ensure all table rows have the same number of columns
-- Use proper markdown table syntax with aligned separators
-"""
-
-    prompt = ChatPromptTemplate.from_template(template)
-    chain = prompt | model
-
-    try:
-        response = chain.invoke({
-            "dom_content": content,
-            "parse_description": parse_description
-        })
-
-        # Extract just the table content
-        result = str(response).strip()
-        
-        # Clean up the response
-        if "content=" in result:
-            start = result.find("content=") + len("content=")
-            end = result.find("additional_kwargs", start)
-            if start != -1 and end != -1:
-                table_content = result[start:end].strip().strip('"').replace("\\n", "\n")
-                
-                # Clean up any remaining quotes or escape characters
-                table_content = re.sub(r'[\'"]', '', table_content)
-                table_content = re.sub(r'\\+', '', table_content)
-                
-                # Ensure proper table formatting
-                lines = table_content.split('\n')
-                cleaned_lines = []
-                for line in lines:
-                    if '|' in line:
-                        # Ensure proper spacing in table cells
-                        cells = [cell.strip() for cell in line.split('|')]
-                        cleaned_line = '| ' + ' | '.join(cells[1:-1]) + ' |'
-                        cleaned_lines.append(cleaned_line)
-                
-                return '\n'.join(cleaned_lines)
-        
-        return None
-    except Exception as e:
-        print(f"Error in LLM parsing: {str(e)}")
-        return None
-
-def merge_tables(tables):
-    """Merge multiple tables while removing duplicates"""
-    if not tables:
-        return None
-        
-    # Split each table into lines
-    table_lines = [table.split('\n') for table in tables if table]
-    
-    # Get headers from first table
-    headers = table_lines[0][0]
-    separator = table_lines[0][1]
-    
-    # Collect all unique data rows
-    seen_rows = set()
-    merged_rows = []
-    
-    for table in table_lines:
-        # Skip headers and separator, process only data rows
-        for row in table[2:]:
-            if row not in seen_rows and row.strip():
-                seen_rows.add(row)
-                merged_rows.append(row)
-    
-    # Combine everything back together
-    return '\n'.join([headers, separator] + merged_rows)
-
-def markdown_table_to_df(markdown_table):
-    """Convert markdown table to pandas DataFrame with improved error handling"""
-    try:
-        if not markdown_table or '|' not in markdown_table:
-            return None
-
-        # Split the table into lines
-        lines = markdown_table.strip().split('\n')
-        lines = [line for line in lines if line.strip()]
-
-        if len(lines) < 2:
-            return None
-
-        # Extract headers
-        headers = [col.strip() for col in lines[0].split('|')[1:-1]]
-
-        # Skip the separator line
-        data_lines = lines[2:]
-
-        # Parse data rows
-        data = []
-        for line in data_lines:
-            row = [cell.strip() for cell in line.split('|')[1:-1]]
-            if len(row) == len(headers):  # Only include rows that match header count
-                data.append(row)
+import uuid
 
-        return pd.DataFrame(data, columns=headers)
-    except Exception as e:
-        print(f"Error converting to DataFrame: {str(e)}")
-        return None
-
-def split_content(content, max_chunk_size=4000):
-    """Split content into smaller chunks with improved chunking logic"""
-    words = content.split()
-    chunks = []
-    current_chunk = []
-    current_length = 0
-
-    for word in words:
-        word_length = len(word)
-        if current_length + word_length + 1 > max_chunk_size:
-            chunks.append(' '.join(current_chunk))
-            current_chunk = [word]
-            current_length = word_length
-        else:
-            current_chunk.append(word)
-            current_length += word_length + 1
-
-    if current_chunk:
-        chunks.append(' '.join(current_chunk))
-
-    return chunks
-
-def process_chunk(chunk, parse_description):
-    """Process a single chunk with the LLM"""
-    return parse_with_llm(chunk, parse_description)
+from scraper.browser import get_browser_pool, get_readiness_log
+from scraper.cache import get_extraction_cache, get_page_cache
+from scraper.chunking import DEFAULT_CHUNK_TOKENS, chunk_records, count_tokens
+from scraper.cleaning import TEXT_MODES
+from scraper.fetch import get_tiered_fetcher, scrape_website
+from scraper.jobs import get_job_queue, job_settings
+from scraper.llm import (COLUMN_TYPES, LLM_MAX_CONCURRENCY, OUTPUT_FORMATS, extract_chunks, max_chunk_tokens,
+                         parse_columns)
+from scraper.merge import ROW_FUZZY_SIMILARITY, RowMerger, TableMerger
+from scraper.metrics import get_metrics
+from scraper.relevance import RELEVANCE_MIN_SCORE_RATIO, select_relevant_chunks
+from scraper.sinks import EXPORT_PATH, RowSink, count_export_rows, read_export
 
 
+# Seconds between refreshes of the background job table
+JOB_POLL_SECONDS = 2
+# Rows shown per page of the extracted data, read from the run's export file
+EXPORT_PAGE_ROWS = 100
 
 
 # Set page configuration
@@ -577,21 +210,107 @@ def main():
     with st.sidebar:
         st.markdown("### ⚙️ Configuration")
         st.markdown("---")
-        chunk_size = st.slider(
-            "Content Chunk Size",
-            min_value=2000,
-            max_value=8000,
-            value=4000,
-            step=500,
-            help="Adjust the content chunk size for processing"
+        chunk_tokens = st.slider(
+            "Chunk Token Budget",
+            min_value=500,
+            max_value=max_chunk_tokens(),
+            value=DEFAULT_CHUNK_TOKENS,
+            step=250,
+            help="Maximum tokens of page content sent per LLM call; chunks break only between records"
+        )
+        relevance = st.slider(
+            "Relevance Filter",
+            min_value=0.0,
+            max_value=1.0,
+            value=RELEVANCE_MIN_SCORE_RATIO,
+            step=0.05,
+            help="Only send chunks scoring at least this fraction of the best chunk's BM25 match "
+                 "with the extraction description; 0 sends every chunk"
+        )
+        chunk_overlap = st.slider(
+            "Chunk Overlap (records)",
+            min_value=0,
+            max_value=5,
+            value=0,
+            help="Repeat the last records of each chunk at the start of the next"
+        )
+        text_mode = st.selectbox(
+            "Text Extraction Mode",
+            options=TEXT_MODES,
+            index=TEXT_MODES.index('blocks'),
+            help="'blocks' emits each piece of text once; 'nested' repeats the text of nested containers"
+        )
+        
+        max_concurrency = st.slider(
+            "Max LLM Concurrency",
+            min_value=1,
+            max_value=16,
+            value=LLM_MAX_CONCURRENCY,
+            help="Upper bound for concurrent LLM calls; the limit adapts down on rate-limit errors"
+        )
+        output_format = st.selectbox(
+            "Output Format",
+            options=OUTPUT_FORMATS,
+            index=OUTPUT_FORMATS.index('json'),
+            help="'json' has the model return typed rows through tool calling; 'table' asks for a markdown table"
+        )
+        column_spec = st.text_input(
+            "Columns (optional)",
+            placeholder="name, price:number, in_stock:boolean",
+            help="Fixed columns for the 'json' format, with types: " + ', '.join(COLUMN_TYPES),
+            disabled=output_format != 'json'
+        )
+        fuzzy_dedup = st.checkbox(
+            "Fuzzy Row Deduplication",
+            value=False,
+            help="Also drop rows that differ from a kept row only by a typo or a few characters"
         )
         
         st.markdown("### 📊 Statistics")
+        metrics = get_metrics()
+        pages_ok = metrics.counter('pages_total', outcome='ok')
+        pages_failed = metrics.counter('pages_total', outcome='error')
         stats_col1, stats_col2 = st.columns(2)
         with stats_col1:
-            st.metric(label="Processed Pages", value="0")
+            st.metric(label="Processed Pages", value=pages_ok + pages_failed)
         with stats_col2:
-            st.metric(label="Success Rate", value="100%", delta="↑")
+            st.metric(label="Success Rate",
+                      value=f"{pages_ok / (pages_ok + pages_failed):.0%}" if pages_ok + pages_failed else "–")
+        llm_stats = get_extraction_cache().stats()
+        llm_col1, llm_col2 = st.columns(2)
+        with llm_col1:
+            st.metric(label="LLM Cache Hits", value=llm_stats['hit'])
+        with llm_col2:
+            st.metric(label="LLM Cache Misses", value=llm_stats['miss'])
+        pool_stats = get_browser_pool().stats()
+        st.caption(
+            f"Browser sessions: {pool_stats['created']} created, "
+            f"{pool_stats['reused']} reused, {pool_stats['recycled']} recycled"
+        )
+        fetch_stats = get_tiered_fetcher().stats()
+        st.caption(f"Fetches: {fetch_stats['http']} over HTTP, {fetch_stats['browser']} in browser")
+        cache_stats = get_page_cache().stats()
+        st.caption(f"Cache hit rate: {cache_stats['page_hit_rate']:.0%} pages, "
+                   f"{cache_stats['cleaned_hit_rate']:.0%} cleaned text")
+        readiness_log = get_readiness_log()
+        if readiness_log:
+            average_ready = sum(record[2] for record in readiness_log) / len(readiness_log)
+            st.caption(f"Time to ready: {average_ready:.2f}s average over {len(readiness_log)} pages")
+        stage_rows = metrics.stage_summary()
+        if stage_rows:
+            with st.expander("⏱️ Stage Timings", expanded=False):
+                st.dataframe(stage_rows, hide_index=True, use_container_width=True)
+                llm_calls = metrics.counter('llm_calls_total', outcome='ok')
+                st.caption(f"LLM: {llm_calls} successful calls, "
+                           f"{metrics.counter('llm_tokens_total', kind='prompt'):,} prompt / "
+                           f"{metrics.counter('llm_tokens_total', kind='completion'):,} completion tokens")
+                export_col1, export_col2 = st.columns(2)
+                with export_col1:
+                    st.download_button("Prometheus", metrics.to_prometheus(), file_name="scraper_metrics.prom",
+                                       use_container_width=True)
+                with export_col2:
+                    st.download_button("JSON lines", metrics.to_jsonl(), file_name="scraper_metrics.jsonl",
+                                       use_container_width=True)
     
     # Main content area
     
@@ -617,7 +336,7 @@ def main():
             """, unsafe_allow_html=True)
         else:
             with st.spinner("🔄 Scraping website..."):
-                clean_content = scrape_website(url)
+                clean_content = scrape_website(url, text_mode)
                 if clean_content:
                     st.session_state.dom_content = clean_content
                     st.markdown("""
@@ -658,28 +377,91 @@ def main():
         
       
         
+        if not extract_button and st.session_state.get('export_path'):
+            # Show the rows from the last (possibly stopped) extraction
+            st.markdown("### 📋 Extracted Data")
+            show_export(st.session_state.export_path)
+
         if extract_button:
-            if parse_description:
-                with st.spinner("🔄 Extracting information..."):
-                    content_chunks = split_content(st.session_state.dom_content, chunk_size)
-                    
-                    with ThreadPoolExecutor(max_workers=3) as executor:
-                        futures = [executor.submit(process_chunk, chunk, parse_description) 
-                                 for chunk in content_chunks]
-                        all_tables = [f.result() for f in futures if f.result()]
-                    
-                    if all_tables:
-                        final_table = merge_tables(all_tables)
-                        
-                        st.markdown("### 📋 Extracted Data")
-                        st.write(markdown_table_to_df(final_table))
-                      
-                    else:
-                        st.markdown("""
-                            <div class="status-message error">
-                                ❌ Extraction failed. Please adjust your description or try again.
-                            </div>
-                        """, unsafe_allow_html=True)
+            columns_error = None
+            try:
+                columns = parse_columns(column_spec) if output_format == 'json' else None
+            except ValueError as e:
+                columns_error = str(e)
+            if columns_error:
+                st.markdown(f"""
+                    <div class="status-message error">
+                        ⚠️ {columns_error}
+                    </div>
+                """, unsafe_allow_html=True)
+            elif parse_description:
+                all_chunks = chunk_records(st.session_state.dom_content, chunk_tokens, chunk_overlap)
+                content_chunks = [all_chunks[i] for i in select_relevant_chunks(all_chunks, parse_description, relevance)]
+                if len(content_chunks) < len(all_chunks):
+                    sent_tokens = sum(count_tokens(chunk) for chunk in content_chunks)
+                    total_tokens = sum(count_tokens(chunk) for chunk in all_chunks)
+                    st.caption(f"Relevance filter: sending {len(content_chunks)} of {len(all_chunks)} chunks "
+                               f"({sent_tokens:,} of {total_tokens:,} tokens)")
+                st.session_state.pop('export_path', None)
+                st.session_state.pop('extraction_timing', None)
+
+                # Any click while extracting makes Streamlit rerun the script, which
+                # closes the chunk stream below and cancels the calls still in flight
+                st.button('⏹ Stop extraction')
+                progress = st.progress(0.0, text=f"0 / {len(content_chunks)} chunks")
+                st.markdown("### 📋 Extracted Data")
+                table_placeholder = st.empty()
+
+                # Exact duplicates are dropped by the sink from row hashes alone;
+                # fuzzy matching compares values, so only then are rows merged in memory
+                fuzzy_similarity = ROW_FUZZY_SIMILARITY if fuzzy_dedup else 0
+                merger = None
+                if fuzzy_similarity:
+                    merger = (RowMerger if output_format == 'json' else TableMerger)(fuzzy_similarity)
+                # Rows are appended to the session's export directory, which each
+                # run replaces, and the table shows its first page instead of
+                # re-rendering every row
+                export_path = st.session_state.setdefault(
+                    'export_dir', os.path.join(EXPORT_PATH, f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"))
+                shutil.rmtree(export_path, ignore_errors=True)
+                started = time.monotonic()
+                first_row_seconds = None
+                completed = 0
+                with RowSink(export_path, 'jsonl', columns=columns, dedupe=merger is None) as sink:
+                    for index, table in extract_chunks(content_chunks, parse_description,
+                                                       cache=get_extraction_cache(),
+                                                       max_concurrency=max_concurrency,
+                                                       output_format=output_format, columns=columns):
+                        completed += 1
+                        kept = sink.rows
+                        if merger is None:
+                            added = sink.write(table)
+                        else:
+                            merged = len(merger)
+                            added = merger.add(table) and sink.write(list(merger.iter_records(merged)))
+                        if added:
+                            if first_row_seconds is None:
+                                first_row_seconds = time.monotonic() - started
+                            sink.flush()
+                            st.session_state.export_path = export_path
+                            if kept < EXPORT_PAGE_ROWS:
+                                table_placeholder.dataframe(read_export(export_path, 0, EXPORT_PAGE_ROWS))
+                        progress.progress(completed / len(content_chunks),
+                                          text=f"{completed} / {len(content_chunks)} chunks, {sink.rows:,} rows")
+
+                st.session_state.extraction_timing = (first_row_seconds, time.monotonic() - started)
+                if not sink.rows:
+                    st.markdown("""
+                        <div class="status-message error">
+                            ❌ Extraction failed. Please adjust your description or try again.
+                        </div>
+                    """, unsafe_allow_html=True)
+                else:
+                    # Page through the finished export in this run, not only after the next rerun
+                    with table_placeholder.container():
+                        show_export(export_path)
+                    st.caption(f"First rows after {first_row_seconds:.1f}s, "
+                               f"all {len(content_chunks)} chunks after {st.session_state.extraction_timing[1]:.1f}s")
             else:
                 st.markdown("""
                     <div class="status-message error">
@@ -687,5 +469,63 @@ def main():
                     </div>
                 """, unsafe_allow_html=True)
 
+    # Background jobs run in worker processes, so they survive closing the tab
+    st.markdown("### 🗂️ Background Jobs")
+    with st.expander("Queue a crawl", expanded=False):
+        job_urls = st.text_area(
+            "URLs",
+            placeholder="https://example.com/shop?page=1\nhttps://example.com/shop?page=2",
+            help="One URL per line; each page is fetched, cleaned and extracted by the worker processes"
+        )
+        job_description = st.text_input(
+            "What to extract (optional)",
+            placeholder="Example: Extract all product names and prices",
+            help="Leave empty to only fetch and clean the pages; the sidebar settings apply"
+        )
+        if st.button('📤 Submit Job'):
+            urls = [line.strip() for line in job_urls.splitlines() if line.strip()]
+            try:
+                columns = parse_columns(column_spec) if output_format == 'json' else None
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                if urls:
+                    job_id = get_job_queue().submit(urls, job_settings(job_description or None, text_mode, chunk_tokens,
+                                                                       output_format, columns, relevance))
+                    st.success(f"Queued job {job_id} with {len(urls)} pages")
+                else:
+                    st.error("Please enter at least one URL")
+        st.caption("Start workers with `python -m scraper worker --workers 4`")
+    show_jobs()
+
+
+def show_export(path):
+    """Page through an extraction's export file, reading only the rows shown"""
+    total = count_export_rows(path)
+    pages = max(1, math.ceil(total / EXPORT_PAGE_ROWS))
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1,
+                           key='export_page') if pages > 1 else 1
+    st.dataframe(read_export(path, (page - 1) * EXPORT_PAGE_ROWS, EXPORT_PAGE_ROWS))
+    st.caption(f"{total:,} rows saved to {path}")
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_jobs():
+    """Table of recent jobs, refreshed every JOB_POLL_SECONDS, with downloads of finished pages"""
+    statuses = get_job_queue().jobs()
+    if not statuses:
+        return
+    st.dataframe([{'Job': status['job'], 'State': status['state'], 'Pages': status['urls'],
+                   'Done': status['pages_done'], 'Failed': status['pages_failed'],
+                   'Progress': (status['pages_done'] + status['pages_failed']) / max(1, status['urls'])}
+                  for status in statuses],
+                 hide_index=True, use_container_width=True,
+                 column_config={'Progress': st.column_config.ProgressColumn(min_value=0, max_value=1)})
+    st.caption(f"{statuses[0]['workers']} workers active")
+    job_id = st.selectbox("Job results", [status['job'] for status in statuses])
+    if job_id:
+        results = '\n'.join(json.dumps(result) for result in get_job_queue().results(job_id))
+        st.download_button("Download JSON lines", results, file_name=f"job_{job_id}.jsonl")
+
 if __name__ == "__main__":
     main()
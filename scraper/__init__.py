@@ -0,0 +1,22 @@
+"""Scraping pipeline: fetch, clean, chunk and extract, without Streamlit
+
+    scraper.fetch       HTTP-first page fetching with a browser fallback
+    scraper.browser     Selenium session pool and page readiness waits
+    scraper.cleaning    HTML to text
+    scraper.clean_pool  cleaning in worker processes for batch jobs
+    scraper.cache       on-disk page, cleaned-text and LLM result caches
+    scraper.chunking    token-aware chunking
+    scraper.streaming   memory-bounded clean-and-chunk for very large pages
+    scraper.relevance   BM25 filtering of chunks before extraction
+    scraper.llm         LLM extraction and the async extraction engine
+    scraper.merge       merging chunk results into one table
+    scraper.sinks       streaming export of rows to CSV, JSON lines or Parquet files
+    scraper.incremental re-extracting only the changed chunks of pages seen before
+    scraper.templates   CSS extraction templates learned from LLM rows
+    scraper.crawl       batch crawling
+    scraper.jobs        durable job queue and worker processes
+    scraper.cli         the scrape / extract / crawl / job command line
+
+Selenium, pandas and LangChain are imported where they are first needed, so
+processes that only fetch, clean or chunk start quickly.
+"""
@@ -0,0 +1,3 @@
+from .cli import main_cli
+
+raise SystemExit(main_cli())
@@ -0,0 +1,267 @@
+"""Remote browser sessions: a reusable session pool and page readiness waits"""
+import functools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from selenium.webdriver import Remote, ChromeOptions
+from selenium.webdriver.chromium.remote_connection import ChromiumRemoteConnection
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
+
+from .fetch import get_readiness_settings
+from .metrics import get_metrics
+
+# WebDriver URL of the Scraping Browser zone, credentials included
+SBR_WEBDRIVER = ''
+
+
+def create_remote_driver(webdriver_url=None):
+    """Open a new remote browser session on the scraping browser"""
+    print("Connecting to Scraping Browser...")
+    options = ChromeOptions()
+    options.add_argument('--headless')
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-dev-shm-usage')
+
+    sbr_connection = ChromiumRemoteConnection(webdriver_url or SBR_WEBDRIVER, "goog", "chrome")
+    return Remote(sbr_connection, options=options)
+
+
+class BrowserSession:
+    """A pooled remote driver and its usage counters"""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+        self.last_used = time.monotonic()
+
+
+class BrowserSessionPool:
+    """Bounded pool of warm remote browser sessions reused across scrapes
+
+    Sessions are health-checked before reuse and recycled after an error,
+    after max_pages_per_session pages, or after sitting idle for
+    max_idle_seconds. create_driver can point the pool at any WebDriver
+    endpoint, e.g. a local chromedriver standing in for the scraping browser.
+    """
+
+    def __init__(self, create_driver=create_remote_driver, max_size=3,
+                 max_pages_per_session=50, max_idle_seconds=60, acquire_timeout=120):
+        self.create_driver = create_driver
+        self.max_pages_per_session = max_pages_per_session
+        self.max_idle_seconds = max_idle_seconds
+        self.acquire_timeout = acquire_timeout
+        self.idle = deque()
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.created = 0
+        self.reused = 0
+        self.recycled = 0
+        self.in_use = 0
+
+    def is_healthy(self, session):
+        """Check that an idle session is still usable"""
+        if time.monotonic() - session.last_used > self.max_idle_seconds:
+            return False
+        try:
+            session.driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def discard(self, session):
+        """Close a session that will not be reused"""
+        with self.lock:
+            self.recycled += 1
+        try:
+            session.driver.quit()
+        except Exception as e:
+            print(f"Error closing browser session: {str(e)}")
+
+    def acquire(self):
+        """Take a warm session from the pool, or open a new one"""
+        if not self.slots.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError("Timed out waiting for a free browser session")
+
+        try:
+            while True:
+                with self.lock:
+                    session = self.idle.popleft() if self.idle else None
+                if session is None:
+                    break
+                if self.is_healthy(session):
+                    with self.lock:
+                        self.reused += 1
+                        self.in_use += 1
+                    return session
+                self.discard(session)
+
+            session = BrowserSession(self.create_driver())
+            with self.lock:
+                self.created += 1
+                self.in_use += 1
+            return session
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, session, failed=False):
+        """Return a session to the pool, recycling it if it failed or is worn out"""
+        session.pages += 1
+        session.last_used = time.monotonic()
+        with self.lock:
+            self.in_use -= 1
+
+        if failed or session.pages >= self.max_pages_per_session:
+            self.discard(session)
+        else:
+            with self.lock:
+                self.idle.append(session)
+        self.slots.release()
+
+    @contextmanager
+    def session(self):
+        """Borrow a driver for the duration of a with block"""
+        session = self.acquire()
+        try:
+            yield session.driver
+        except BaseException:
+            self.release(session, failed=True)
+            raise
+        self.release(session)
+
+    def close(self):
+        """Quit every idle session"""
+        with self.lock:
+            sessions = list(self.idle)
+            self.idle.clear()
+        for session in sessions:
+            self.discard(session)
+
+    def stats(self):
+        """Counters for sessions created, reused and recycled so far"""
+        with self.lock:
+            return {
+                'created': self.created,
+                'reused': self.reused,
+                'recycled': self.recycled,
+                'idle': len(self.idle),
+                'in_use': self.in_use,
+            }
+
+
+@functools.cache
+def get_browser_pool():
+    """Browser session pool shared by everything in this process"""
+    return BrowserSessionPool()
+
+
+# JavaScript probes for the readiness strategies (see fetch.DEFAULT_READINESS)
+RESOURCE_COUNT_JS = "return performance.getEntriesByType('resource').length"
+INSTALL_MUTATION_OBSERVER_JS = """
+if (!window.__scraperLastMutation) {
+    window.__scraperLastMutation = performance.now();
+    new MutationObserver(function () {
+        window.__scraperLastMutation = performance.now();
+    }).observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+}
+"""
+MUTATION_QUIET_MS_JS = "return performance.now() - window.__scraperLastMutation"
+
+
+def is_document_complete(driver):
+    return driver.execute_script("return document.readyState") == 'complete'
+
+
+class QuietPeriod:
+    """WebDriverWait condition that holds once a sampled value stops changing for quiet_seconds"""
+
+    def __init__(self, sample, quiet_seconds):
+        self.sample = sample
+        self.quiet_seconds = quiet_seconds
+        self.last_value = None
+        self.changed_at = time.monotonic()
+
+    def __call__(self, driver):
+        value = self.sample(driver)
+        now = time.monotonic()
+        if value != self.last_value:
+            self.last_value = value
+            self.changed_at = now
+            return False
+        return now - self.changed_at >= self.quiet_seconds
+
+
+def wait_until_ready(driver, settings):
+    """Block until the page is ready under the given settings, or the timeout expires
+
+    Returns True if the page became ready before the timeout.
+    """
+    strategy = settings['strategy']
+    wait = WebDriverWait(driver, settings['timeout'], poll_frequency=0.1)
+    quiet_seconds = settings.get('quiet_seconds', 0.5)
+
+    if strategy == 'document':
+        condition = is_document_complete
+    elif strategy == 'network':
+        resources_quiet = QuietPeriod(lambda d: d.execute_script(RESOURCE_COUNT_JS), quiet_seconds)
+        condition = lambda d: is_document_complete(d) and resources_quiet(d)
+    elif strategy == 'mutations':
+        driver.execute_script(INSTALL_MUTATION_OBSERVER_JS)
+        condition = lambda d: d.execute_script(MUTATION_QUIET_MS_JS) >= quiet_seconds * 1000
+    elif strategy == 'selector':
+        condition = EC.presence_of_element_located((By.CSS_SELECTOR, settings['selector']))
+    else:
+        raise ValueError(f"Unknown readiness strategy: {strategy}")
+
+    try:
+        wait.until(condition)
+        return True
+    except TimeoutException:
+        return False
+
+
+@functools.cache
+def get_readiness_log():
+    """Recent (url, strategy, seconds, ready) records for this process"""
+    return deque(maxlen=500)
+
+
+def fetch_page_html(url, pool=None):
+    """Load a page in a pooled browser session and return its raw HTML"""
+    pool = pool or get_browser_pool()
+    metrics = get_metrics()
+
+    connect_start = time.perf_counter()
+    with pool.session() as driver:
+        metrics.observe_stage('connect', time.perf_counter() - connect_start)
+        with metrics.timer('navigate'):
+            driver.get(url)
+        print("Waiting for captcha to solve...")
+        with metrics.timer('captcha_wait'):
+            solve_res = driver.execute(
+                "executeCdpCommand",
+                {
+                    "cmd": "Captcha.waitForSolve",
+                    "params": {"detectTimeout": 10000},
+                },
+            )
+        print("Captcha solve status:", solve_res["value"]["status"])
+
+        # Wait until the page is ready instead of sleeping a fixed time
+        settings = get_readiness_settings(url)
+        ready_start = time.monotonic()
+        ready = wait_until_ready(driver, settings)
+        ready_seconds = time.monotonic() - ready_start
+        metrics.observe_stage('ready_wait', ready_seconds)
+        get_readiness_log().append((url, settings['strategy'], ready_seconds, ready))
+        print(f"Page ready after {ready_seconds:.2f}s ({settings['strategy']}"
+              f"{'' if ready else ', timed out'})")
+
+        # Get the page source
+        with metrics.timer('page_source'):
+            return driver.page_source
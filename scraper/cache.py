@@ -0,0 +1,314 @@
+"""On-disk caches for fetched pages, cleaned text and LLM chunk results"""
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+
+from .cleaning import clean_dom_content, get_parser_backend
+from .llm import EXTRACTION_PROMPT_VERSION, MODEL_NAME
+from .metrics import get_metrics
+
+
+# On-disk cache shared by every app and crawl process on this machine.
+# Bump CLEANING_RULES_VERSION whenever clean_dom_content's output changes,
+# so only the cleaned tier is invalidated.
+CACHE_PATH = os.path.join('.scraper_cache', 'cache.sqlite3')
+CACHE_TTL_SECONDS = 24 * 3600
+CACHE_MAX_BYTES = 500 * 1024 * 1024
+CLEANING_RULES_VERSION = 2
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def size_total_schema(table):
+    """Schema keeping a running SUM(size) of table, so eviction checks do not scan it
+
+    Triggers keep the one-row <table>_size table in step with every insert,
+    delete and size change, in the same transaction and from any process.
+    Rows must be replaced by upsert rather than INSERT OR REPLACE, whose
+    implicit delete fires no trigger.
+    """
+    return f"""
+        CREATE TABLE IF NOT EXISTS {table}_size (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL);
+        INSERT INTO {table}_size (id, bytes) SELECT 0, (SELECT COALESCE(SUM(size), 0) FROM {table})
+            WHERE NOT EXISTS (SELECT 1 FROM {table}_size);
+        CREATE TRIGGER IF NOT EXISTS {table}_size_insert AFTER INSERT ON {table}
+            BEGIN UPDATE {table}_size SET bytes = bytes + new.size; END;
+        CREATE TRIGGER IF NOT EXISTS {table}_size_delete AFTER DELETE ON {table}
+            BEGIN UPDATE {table}_size SET bytes = bytes - old.size; END;
+        CREATE TRIGGER IF NOT EXISTS {table}_size_update AFTER UPDATE OF size ON {table}
+            BEGIN UPDATE {table}_size SET bytes = bytes - old.size + new.size; END;
+    """
+
+
+def stored_bytes(db, table):
+    return db.execute(f"SELECT bytes FROM {table}_size").fetchone()[0]
+
+
+class SQLiteStore:
+    """Base for the on-disk caches: a SQLite file with per-thread connections and hit counters
+
+    Subclasses set SCHEMA. SQLite's locking makes the stores safe to share
+    between threads and processes.
+    """
+
+    SCHEMA = ""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.connect() as db:
+            db.executescript(self.SCHEMA)
+
+    def connect(self):
+        """One connection per thread; SQLite connections cannot be shared across threads"""
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return db
+
+    def count(self, event):
+        with self.lock:
+            self.counts[event] += 1
+
+
+class PageCache(SQLiteStore):
+    """Content-addressed SQLite cache for fetched pages and cleaned text
+
+    Page bodies and cleaned text are stored once per content hash as
+    compressed blobs. Fetched pages are looked up by URL plus fetch options
+    and expire after ttl seconds, after which HTTP validators (ETag /
+    Last-Modified) allow a conditional revalidation. Cleaned text is looked
+    up by the raw HTML hash and cleaning settings. Least recently used blobs
+    are evicted once the total size exceeds max_bytes.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS blobs (
+            hash TEXT PRIMARY KEY, data BLOB NOT NULL,
+            size INTEGER NOT NULL, last_access REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS blobs_last_access ON blobs (last_access);
+        CREATE TABLE IF NOT EXISTS pages (
+            key TEXT PRIMARY KEY, url TEXT NOT NULL, body_hash TEXT NOT NULL,
+            etag TEXT, last_modified TEXT, fetched_at REAL NOT NULL);
+        CREATE TABLE IF NOT EXISTS cleaned (
+            key TEXT PRIMARY KEY, text_hash TEXT NOT NULL);
+    """ + size_total_schema('blobs')
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL_SECONDS, max_bytes=CACHE_MAX_BYTES):
+        super().__init__(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+    def read_blob(self, db, blob_hash):
+        row = db.execute("SELECT data FROM blobs WHERE hash = ?", (blob_hash,)).fetchone()
+        if row is None:
+            return None
+        db.execute("UPDATE blobs SET last_access = ? WHERE hash = ?", (time.time(), blob_hash))
+        return zlib.decompress(row[0]).decode('utf-8')
+
+    def write_blob(self, db, text):
+        blob_hash = content_hash(text)
+        data = zlib.compress(text.encode('utf-8'))
+        db.execute("INSERT INTO blobs (hash, data, size, last_access) VALUES (?, ?, ?, ?) "
+                   "ON CONFLICT (hash) DO UPDATE SET last_access = excluded.last_access",
+                   (blob_hash, data, len(data), time.time()))
+        return blob_hash
+
+    def evict(self, db):
+        """Drop least recently used blobs until the cache fits in max_bytes"""
+        total = stored_bytes(db, 'blobs')
+        if total <= self.max_bytes:
+            return
+        doomed = []
+        for blob_hash, size in db.execute("SELECT hash, size FROM blobs ORDER BY last_access"):
+            if total <= self.max_bytes:
+                break
+            doomed.append((blob_hash,))
+            total -= size
+        db.executemany("DELETE FROM blobs WHERE hash = ?", doomed)
+        db.execute("DELETE FROM pages WHERE body_hash NOT IN (SELECT hash FROM blobs)")
+        db.execute("DELETE FROM cleaned WHERE text_hash NOT IN (SELECT hash FROM blobs)")
+        self.count('evicted')
+
+    @staticmethod
+    def page_key(url, options):
+        return content_hash(json.dumps([url, options], sort_keys=True))
+
+    def get_page(self, url, options):
+        """Return the cached page as a dict with html, etag, last_modified and fresh, or None"""
+        with self.connect() as db:
+            row = db.execute("SELECT body_hash, etag, last_modified, fetched_at FROM pages WHERE key = ?",
+                             (self.page_key(url, options),)).fetchone()
+            html = self.read_blob(db, row[0]) if row else None
+        if html is None:
+            return None
+        return {'html': html, 'etag': row[1], 'last_modified': row[2],
+                'fresh': time.time() - row[3] < self.ttl}
+
+    def put_page(self, url, options, html, etag=None, last_modified=None):
+        with self.connect() as db:
+            body_hash = self.write_blob(db, html)
+            db.execute("INSERT OR REPLACE INTO pages (key, url, body_hash, etag, last_modified, fetched_at) "
+                       "VALUES (?, ?, ?, ?, ?, ?)",
+                       (self.page_key(url, options), url, body_hash, etag, last_modified, time.time()))
+            self.evict(db)
+
+    def touch_page(self, url, options):
+        """Mark a cached page fresh again after a 304 Not Modified"""
+        with self.connect() as db:
+            db.execute("UPDATE pages SET fetched_at = ? WHERE key = ?",
+                       (time.time(), self.page_key(url, options)))
+
+    @staticmethod
+    def cleaned_key(raw_hash, text_mode, parser):
+        return f"{raw_hash}:{CLEANING_RULES_VERSION}:{text_mode}:{parser}"
+
+    def get_cleaned(self, html, text_mode, parser):
+        with self.connect() as db:
+            row = db.execute("SELECT text_hash FROM cleaned WHERE key = ?",
+                             (self.cleaned_key(content_hash(html), text_mode, parser),)).fetchone()
+            text = self.read_blob(db, row[0]) if row else None
+        self.count('cleaned_hit' if text is not None else 'cleaned_miss')
+        return text
+
+    def put_cleaned(self, html, text_mode, parser, text):
+        with self.connect() as db:
+            text_hash = self.write_blob(db, text)
+            db.execute("INSERT OR REPLACE INTO cleaned (key, text_hash) VALUES (?, ?)",
+                       (self.cleaned_key(content_hash(html), text_mode, parser), text_hash))
+            self.evict(db)
+
+    def stats(self):
+        """Hit rates for the page and cleaned tiers in this process"""
+        with self.lock:
+            counts = dict(self.counts)
+        page_lookups = sum(counts.get(event, 0) for event in ('page_hit', 'page_revalidated', 'page_miss'))
+        cleaned_lookups = counts.get('cleaned_hit', 0) + counts.get('cleaned_miss', 0)
+        page_hits = counts.get('page_hit', 0) + counts.get('page_revalidated', 0)
+        return {
+            **counts,
+            'page_hit_rate': page_hits / page_lookups if page_lookups else 0.0,
+            'cleaned_hit_rate': counts.get('cleaned_hit', 0) / cleaned_lookups if cleaned_lookups else 0.0,
+        }
+
+
+@functools.cache
+def get_page_cache():
+    """Page cache shared by everything in this process"""
+    return PageCache()
+
+
+def clean_with_cache(html_content, text_mode='nested', parser=None, cache=None, pool=None):
+    """clean_dom_content, reusing cleaned text for HTML that was cleaned before
+
+    With a CleaningPool, pages that miss the cache are cleaned in its worker
+    processes.
+    """
+    clean = pool.clean if pool is not None else clean_dom_content
+    if cache is None:
+        with get_metrics().timer('clean'):
+            return clean(html_content, text_mode, parser)
+
+    parser_name = get_parser_backend(parser).name
+    text = cache.get_cleaned(html_content, text_mode, parser_name)
+    if text is None:
+        with get_metrics().timer('clean'):
+            text = clean(html_content, text_mode, parser_name)
+        cache.put_cleaned(html_content, text_mode, parser_name, text)
+    return text
+
+
+# Persistent cache of per-chunk LLM results. Only exact chunk matches are
+# reused: a near-duplicate chunk can add a single product line, so anything
+# short of the same text is sent again.
+EXTRACTION_CACHE_PATH = os.path.join('.scraper_cache', 'extractions.sqlite3')
+EXTRACTION_CACHE_MAX_BYTES = 100 * 1024 * 1024
+
+
+class ExtractionCache(SQLiteStore):
+    """Persistent cache of LLM chunk extractions
+
+    Results are keyed by a hash of the chunk text, the extraction request,
+    EXTRACTION_PROMPT_VERSION and MODEL_NAME, so a result is only served for
+    the chunk it was extracted from. Least recently used results are evicted
+    past max_bytes.
+    """
+
+    # The extractions table of older versions also indexed SimHash bands
+    # for near-duplicate lookups; it is dropped in favour of results.
+    SCHEMA = """
+        DROP TABLE IF EXISTS extractions;
+        CREATE TABLE IF NOT EXISTS results (
+            key TEXT PRIMARY KEY, result TEXT NOT NULL,
+            size INTEGER NOT NULL, last_access REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access);
+    """ + size_total_schema('results')
+
+    def __init__(self, path=EXTRACTION_CACHE_PATH, max_bytes=EXTRACTION_CACHE_MAX_BYTES):
+        super().__init__(path)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def scope(parse_description, variant=None):
+        key = [parse_description, EXTRACTION_PROMPT_VERSION, MODEL_NAME]
+        return content_hash(json.dumps(key if variant is None else key + [variant]))
+
+    def get(self, chunk, parse_description, variant=None):
+        """Return the cached result for this exact chunk, or None
+
+        variant separates results for other output formats (see extraction_variant).
+        """
+        key = content_hash(self.scope(parse_description, variant) + chunk)
+        with self.connect() as db:
+            row = db.execute("SELECT result FROM results WHERE key = ?", (key,)).fetchone()
+            if row:
+                db.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key))
+        self.count('hit' if row else 'miss')
+        return row[0] if row else None
+
+    def put(self, chunk, parse_description, result, variant=None):
+        key = content_hash(self.scope(parse_description, variant) + chunk)
+        with self.connect() as db:
+            db.execute("INSERT INTO results (key, result, size, last_access) VALUES (?, ?, ?, ?) "
+                       "ON CONFLICT (key) DO UPDATE SET result = excluded.result, size = excluded.size, "
+                       "last_access = excluded.last_access", (key, result, len(result), time.time()))
+            self.evict(db)
+
+    def evict(self, db):
+        """Drop least recently used results until the cache fits in max_bytes"""
+        total = stored_bytes(db, 'results')
+        if total <= self.max_bytes:
+            return
+        doomed = []
+        for key, size in db.execute("SELECT key, size FROM results ORDER BY last_access"):
+            if total <= self.max_bytes:
+                break
+            doomed.append((key,))
+            total -= size
+        db.executemany("DELETE FROM results WHERE key = ?", doomed)
+
+    def stats(self):
+        """Hits and misses in this process"""
+        with self.lock:
+            return {event: self.counts[event] for event in ('hit', 'miss')}
+
+
+@functools.cache
+def get_extraction_cache():
+    """Extraction cache shared by everything in this process"""
+    return ExtractionCache()
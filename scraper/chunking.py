@@ -0,0 +1,143 @@
+"""Token-aware chunking of cleaned page text"""
+import re
+
+from .metrics import get_metrics
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+def split_content(content, max_chunk_size=4000):
+    """Split content into smaller chunks with improved chunking logic"""
+    words = content.split()
+    chunks = []
+    current_chunk = []
+    current_length = 0
+
+    for word in words:
+        word_length = len(word)
+        if current_length + word_length + 1 > max_chunk_size:
+            chunks.append(' '.join(current_chunk))
+            current_chunk = [word]
+            current_length = word_length
+        else:
+            current_chunk.append(word)
+            current_length += word_length + 1
+
+    if current_chunk:
+        chunks.append(' '.join(current_chunk))
+
+    return chunks
+
+
+# Token-aware chunking. Chunks must leave room in the model's context for
+# the prompt template and the generated table (see llm.max_chunk_tokens).
+DEFAULT_CHUNK_TOKENS = 3000
+RECORD_MARKER_RE = re.compile(r' (?=(?:HEADING|TABLE_CELL|LINK): )')
+SENTENCE_END_RE = re.compile(r'(?<=[.!?]) +')
+tokenizer = None
+
+
+def get_tokenizer():
+    """tiktoken's cl100k_base encoding (close to llama3's BPE), or None if it cannot be loaded"""
+    global tokenizer
+    if tokenizer is None:
+        tokenizer = False
+        if tiktoken is not None:
+            try:
+                # The encoding file is downloaded on first use, which fails offline
+                tokenizer = tiktoken.get_encoding('cl100k_base')
+            except Exception as e:
+                print(f"Tokenizer unavailable, estimating token counts: {str(e)}")
+    return tokenizer or None
+
+
+def count_tokens(text):
+    """Count tokens with the tokenizer, or estimate about 4 characters per token"""
+    encoding = get_tokenizer()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def record_token_cost(text):
+    """Tokens a record or word adds to a chunk, including its separator"""
+    encoding = get_tokenizer()
+    if encoding is None:
+        return (len(text) + 1) / 4
+    return len(encoding.encode(text, disallowed_special=())) + 1
+
+
+def split_records(content):
+    """Split cleaned content into records: lines, and marked records within a line"""
+    records = []
+    for line in content.split('\n'):
+        records.extend(record for record in RECORD_MARKER_RE.split(line.strip()) if record)
+    return records
+
+
+def split_oversized_record(record, max_tokens):
+    """Break a record that exceeds max_tokens at sentence ends, then at words"""
+    pieces = []
+    current, current_tokens = [], 0
+    for sentence in SENTENCE_END_RE.split(record):
+        sentence_tokens = record_token_cost(sentence)
+        if sentence_tokens > max_tokens:
+            # A single over-long sentence is split word by word
+            units = [(word, record_token_cost(word)) for word in sentence.split(' ')]
+        else:
+            units = [(sentence, sentence_tokens)]
+        for unit, unit_tokens in units:
+            if current and current_tokens + unit_tokens > max_tokens:
+                pieces.append(' '.join(current))
+                current, current_tokens = [], 0
+            current.append(unit)
+            current_tokens += unit_tokens
+    if current:
+        pieces.append(' '.join(current))
+    return pieces
+
+
+def pack_records(records, max_tokens=DEFAULT_CHUNK_TOKENS, overlap_records=0):
+    """Greedily pack an iterable of records into chunks of at most max_tokens, yielding each when full"""
+    current = []  # (record, tokens) pairs
+    current_tokens = 0
+
+    for record in records:
+        record_tokens = record_token_cost(record)
+        if record_tokens > max_tokens:
+            pieces = [(piece, record_token_cost(piece)) for piece in split_oversized_record(record, max_tokens)]
+        else:
+            pieces = [(record, record_tokens)]
+
+        for piece, piece_tokens in pieces:
+            if current and current_tokens + piece_tokens > max_tokens:
+                yield '\n'.join(text for text, _ in current)
+                carried = []
+                carried_tokens = 0
+                overlap_budget = min(max_tokens // 2, max_tokens - piece_tokens)
+                for text, tokens in reversed(current[-overlap_records:] if overlap_records else []):
+                    if carried_tokens + tokens > overlap_budget:
+                        break
+                    carried.insert(0, (text, tokens))
+                    carried_tokens += tokens
+                current, current_tokens = carried, carried_tokens
+            current.append((piece, piece_tokens))
+            current_tokens += piece_tokens
+
+    if current:
+        yield '\n'.join(text for text, _ in current)
+
+
+def chunk_records(content, max_tokens=DEFAULT_CHUNK_TOKENS, overlap_records=0):
+    """Pack cleaned content into chunks of at most max_tokens, breaking only between records
+
+    Records (see split_records) are packed greedily in order, so each chunk
+    fills up close to the budget. A record longer than the budget on its own
+    is split at sentence or word boundaries. With overlap_records, the last
+    records of a chunk are repeated at the start of the next one (up to
+    half the budget), so rows at chunk edges keep their context.
+    """
+    with get_metrics().timer('chunk'):
+        return list(pack_records(split_records(content), max_tokens, overlap_records))
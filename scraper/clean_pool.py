@@ -0,0 +1,74 @@
+"""Process pool for cleaning many pages at once
+
+clean_dom_content is CPU-bound Python, so cleaning in crawl threads
+serializes on the GIL. CleaningPool hands pages to worker processes instead.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from .cleaning import clean_dom_content
+
+# Workers are replaced after this many pages, so memory held on to by
+# parse trees and the allocator does not grow for the whole crawl.
+CLEAN_WORKER_MAX_PAGES = 200
+
+
+def clean_html_bytes(html_bytes, text_mode, parser):
+    """Worker side of CleaningPool.submit: decode the page and clean it"""
+    return clean_dom_content(html_bytes.decode('utf-8', errors='surrogatepass'), text_mode, parser)
+
+
+class CleaningPool:
+    """Clean raw HTML in a pool of worker processes
+
+    Pages are sent as UTF-8 bytes, which pickle as a single copy. At most
+    max_pending pages are queued or in progress; submit blocks beyond that,
+    so fetch threads wait for the cleaners instead of piling up HTML in
+    memory. Each worker is restarted after max_pages_per_worker pages.
+    """
+
+    def __init__(self, max_workers=None, max_pending=None, max_pages_per_worker=CLEAN_WORKER_MAX_PAGES):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.max_workers * 2
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+        try:
+            self.executor = ProcessPoolExecutor(self.max_workers, max_tasks_per_child=max_pages_per_worker)
+        except TypeError:
+            # max_tasks_per_child needs Python 3.11
+            self.executor = ProcessPoolExecutor(self.max_workers)
+
+    def submit(self, html_content, text_mode='nested', parser=None):
+        """Queue a page for cleaning and return a future for its text, blocking while the pool is full"""
+        html_bytes = html_content.encode('utf-8', errors='surrogatepass')
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(clean_html_bytes, html_bytes, text_mode, parser)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def clean(self, html_content, text_mode='nested', parser=None):
+        """clean_dom_content in a worker process"""
+        return self.submit(html_content, text_mode, parser).result()
+
+    def map(self, pages, text_mode='nested', parser=None):
+        """Clean an iterable of pages, yielding texts in order with at most max_pending in flight"""
+        pending = []
+        for html_content in pages:
+            pending.append(self.submit(html_content, text_mode, parser))
+            while pending and pending[0].done():
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,377 @@
+"""HTML cleaning: strip boilerplate and hidden elements, keep readable text"""
+import re
+
+from bs4 import BeautifulSoup, Tag, NavigableString, CData
+from bs4.builder import builder_registry
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+PARSER_BACKEND = 'selectolax'  # 'selectolax', 'lxml' or 'html.parser'
+
+# Removal rules for clean_dom_content, evaluated once per element.
+# An element matching any rule is dropped together with its subtree.
+REMOVED_TAGS = frozenset([
+    'script', 'style', 'meta', 'link', 'noscript', 'iframe',
+    'header', 'footer', 'nav', 'aside', 'cookie', 'banner'
+])
+REMOVED_ATTRS = ('data-tracking', 'data-analytics')
+REMOVED_ID_RE = re.compile(r'cookie|popup|modal')
+# Class substrings are matched case-sensitively on the raw class string ...
+REMOVED_CLASS_RE = re.compile(r'cookie|popup|modal|overlay|banner|notice|advertising|ad-|tracker')
+# ... and case-insensitively on the lower-cased class string
+REMOVED_CLASS_LOWER_RE = re.compile(r'track|pixel|gtm|analytics|cookie|popup|modal|overlay')
+
+# Tags whose text is extracted, and inline styles that hide an element's own text
+VALID_TAGS = frozenset([
+    'p', 'div', 'span', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'li', 'td', 'th', 'a', 'article', 'section', 'main'
+])
+HIDDEN_STYLES = ('display: none', 'visibility: hidden')
+
+# Text extraction modes for clean_dom_content. In 'blocks' mode inline
+# elements such as span fold their text into the enclosing block.
+TEXT_MODES = ('nested', 'blocks')
+BLOCK_TAGS = VALID_TAGS - {'span'}
+TEXT_NODE_TYPES = (NavigableString, CData)
+
+
+def is_unwanted_element(name, attrs):
+    """Check an element against the removal rules"""
+    if name in REMOVED_TAGS:
+        return True
+
+    for attr in REMOVED_ATTRS:
+        if attr in attrs:
+            return True
+
+    element_id = attrs.get('id')
+    if element_id and REMOVED_ID_RE.search(element_id):
+        return True
+
+    classes = attrs.get('class')
+    if classes:
+        if not isinstance(classes, str):
+            classes = ' '.join(classes)
+        if REMOVED_CLASS_RE.search(classes) or REMOVED_CLASS_LOWER_RE.search(classes.lower()):
+            return True
+
+    return False
+
+
+def is_hidden_element(attrs):
+    """Check whether an element hides itself with an inline style"""
+    style = attrs.get('style')
+    return bool(style) and any(hidden in style for hidden in HIDDEN_STYLES)
+
+
+class SoupBackend:
+    """Parser backend that builds a BeautifulSoup tree with the given tree builder"""
+
+    def __init__(self, features):
+        self.name = features
+        self.features = features
+
+    def is_available(self):
+        return builder_registry.lookup(self.features) is not None
+
+    def parse(self, html_content):
+        return BeautifulSoup(html_content, self.features)
+
+    def collect_text_elements(self, soup):
+        """Walk the tree once, pruning unwanted subtrees and collecting text elements
+
+        Returns (name, attrs, text) for every valid element, in document order.
+        """
+        unwanted = []
+        candidates = []
+        stack = [child for child in reversed(soup.contents) if isinstance(child, Tag)]
+
+        while stack:
+            element = stack.pop()
+            if is_unwanted_element(element.name, element.attrs):
+                # Skip the whole subtree; it is detached once the walk is done
+                unwanted.append(element)
+                continue
+
+            if element.name in VALID_TAGS and not is_hidden_element(element.attrs):
+                candidates.append(element)
+
+            stack.extend(child for child in reversed(element.contents) if isinstance(child, Tag))
+
+        for element in unwanted:
+            element.decompose()
+
+        return [(element.name, element.attrs, element.get_text(strip=True)) for element in candidates]
+
+    def collect_text_blocks(self, soup):
+        """Walk the tree once, assigning every text node to its nearest block element
+
+        Returns (name, attrs, text) for every run of text, in document order.
+        Text that is interrupted by a nested block is split into separate runs,
+        so no text node is emitted twice.
+        """
+        runs = []
+        stack = [(child, None) for child in reversed(soup.contents)]
+
+        while stack:
+            node, block = stack.pop()
+            if isinstance(node, Tag):
+                if is_unwanted_element(node.name, node.attrs):
+                    continue
+                if node.name in BLOCK_TAGS:
+                    block = node
+                stack.extend((child, block) for child in reversed(node.contents))
+            elif type(node) in TEXT_NODE_TYPES and block is not None:
+                text = node.strip()
+                if not text:
+                    continue
+                if runs and runs[-1][0] is block:
+                    runs[-1][1].append(text)
+                else:
+                    runs.append((block, [text]))
+
+        return [(block.name, block.attrs, ' '.join(parts))
+                for block, parts in runs if not is_hidden_element(block.attrs)]
+
+
+class LexborBackend:
+    """Parser backend built on selectolax's lexbor engine, a C HTML5 parser"""
+
+    name = 'selectolax'
+
+    def is_available(self):
+        return LexborHTMLParser is not None
+
+    def parse(self, html_content):
+        return LexborHTMLParser(html_content)
+
+    def collect_text_elements(self, tree):
+        """Walk the tree once, pruning unwanted subtrees and collecting text elements
+
+        Returns (name, attrs, text) for every valid element, in document order.
+        """
+        unwanted = []
+        candidates = []
+        stack = [tree.root] if tree.root is not None else []
+
+        while stack:
+            node = stack.pop()
+            name = node.tag
+            attrs = node.attributes
+            if is_unwanted_element(name, attrs):
+                unwanted.append(node)
+                continue
+
+            if name in VALID_TAGS and not is_hidden_element(attrs):
+                candidates.append((node, name, attrs))
+
+            children = [child for child in node.iter() if child.tag[0] != '-']
+            children.reverse()
+            stack.extend(children)
+
+        for node in unwanted:
+            node.decompose()
+
+        return [(name, attrs, node.text(deep=True, separator='', strip=True))
+                for node, name, attrs in candidates]
+
+    def collect_text_blocks(self, tree):
+        """Walk the tree once, assigning every text node to its nearest block element
+
+        Returns (name, attrs, text) for every run of text, in document order.
+        """
+        runs = []
+        stack = [(tree.root, None)] if tree.root is not None else []
+
+        while stack:
+            node, block = stack.pop()
+            name = node.tag
+            if name == '-text':
+                if block is None:
+                    continue
+                text = node.text_content.strip()
+                if not text:
+                    continue
+                if runs and runs[-1][0] is block:
+                    runs[-1][1].append(text)
+                else:
+                    runs.append((block, [text]))
+            elif name[0] != '-':
+                attrs = node.attributes
+                if is_unwanted_element(name, attrs):
+                    continue
+                if name in BLOCK_TAGS:
+                    # Nodes are rebuilt on every access, so blocks are tracked by a tuple
+                    block = (name, attrs)
+                children = [(child, block) for child in node.iter(include_text=True)]
+                children.reverse()
+                stack.extend(children)
+
+        return [(block[0], block[1], ' '.join(parts))
+                for block, parts in runs if not is_hidden_element(block[1])]
+
+
+# Parser backends for clean_dom_content, fastest first. html.parser is pure
+# Python and always available, so it is the fallback.
+PARSER_BACKENDS = {
+    'selectolax': LexborBackend(),
+    'lxml': SoupBackend('lxml'),
+    'html.parser': SoupBackend('html.parser'),
+}
+missing_parser_backends = set()
+
+
+def get_parser_backend(name=None):
+    """Return the named parser backend, falling back to html.parser if it is not installed"""
+    name = name or PARSER_BACKEND
+    if name not in PARSER_BACKENDS:
+        raise ValueError(f"Unknown parser backend: {name}")
+
+    backend = PARSER_BACKENDS[name]
+    if not backend.is_available():
+        if name not in missing_parser_backends:
+            missing_parser_backends.add(name)
+            print(f"Parser backend {name} is not installed, falling back to html.parser")
+        backend = PARSER_BACKENDS['html.parser']
+    return backend
+
+
+def format_text_element(name, attrs, text):
+    """Add a structured marker to an element's text, or return None to drop it"""
+    # Skip empty elements
+    if not text:
+        return None
+
+    # Skip very short text that might be buttons or labels
+    if len(text) < 3:
+        return None
+
+    # Add structured markers based on element type
+    if name in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
+        text = f"HEADING: {text}"
+    elif name == 'a' and attrs.get('href'):
+        # Clean and validate URL
+        href = attrs.get('href')
+        if href.startswith('javascript:') or href.startswith('#'):
+            return None
+        if not href.startswith(('http://', 'https://', '/')):
+            return None
+        text = f"LINK: {text} (URL: {href})"
+    elif name in ['td', 'th']:
+        text = f"TABLE_CELL: {text}"
+
+    return text
+
+
+# Line normalization for clean_dom_content. Each extracted element becomes
+# one line, and every rule works within that line: bracketed asides and
+# parentheses other than link URLs are removed (nested ones included),
+# whitespace collapses to single spaces, table pipes get one space either
+# side, noise characters are trimmed from the line ends (leading currency
+# signs and '+', a closing ')' or '%' stay) and immediately repeated words
+# are dropped. Lines of MIN_LINE_LENGTH characters or fewer are dropped.
+# Each rule is one linear scan, so adversarial lines cannot blow up.
+MIN_LINE_LENGTH = 3
+ASIDE_CHAR_RE = re.compile(r'[\[\]()]')
+LINE_KEEP_LEADING = frozenset('$€£¥+')
+LINE_KEEP_TRAILING = frozenset(')%')
+
+
+def remove_asides(line):
+    """Replace [bracketed] and (parenthesized) asides with a space, keeping '(URL: ...)'"""
+    squares, parens, spans = [], [], []
+    for match in ASIDE_CHAR_RE.finditer(line):
+        char, position = match.group(), match.start()
+        if char == '[':
+            squares.append(position)
+        elif char == '(':
+            parens.append(position)
+        else:
+            opened, other = (squares, parens) if char == ']' else (parens, squares)
+            if not opened:
+                continue
+            start = opened.pop()
+            # Brackets of the other kind opened inside the pair go with it
+            while other and other[-1] > start:
+                other.pop()
+            if char == ')' and line.startswith('(URL:', start):
+                continue
+            spans.append((start, position + 1))
+    if not spans:
+        return line
+
+    # Inner pairs close first; the outermost pair covering them wins
+    pieces, end = [], 0
+    for start, stop in sorted(spans):
+        if start >= end:
+            pieces.append(line[end:start])
+            end = stop
+    pieces.append(line[end:])
+    return ' '.join(pieces)
+
+
+def is_noise_char(char, keep):
+    return not (char.isalnum() or char == '_' or char in keep)
+
+
+def normalize_line(line):
+    """Apply the line rules to one line of text; returns None when nothing worth keeping is left"""
+    if '[' in line or '(' in line:
+        line = remove_asides(line)
+    line = ' '.join(line.replace('|', ' | ').split())
+
+    start, end = 0, len(line)
+    while start < end and is_noise_char(line[start], LINE_KEEP_LEADING):
+        start += 1
+    while end > start and is_noise_char(line[end - 1], LINE_KEEP_TRAILING):
+        end -= 1
+
+    words = []
+    for word in line[start:end].split(' '):
+        if not (words and word == words[-1] and word.isalnum()):
+            words.append(word)
+    line = ' '.join(words)
+    return line if len(line) > MIN_LINE_LENGTH else None
+
+
+def normalize_text(text):
+    """normalize_line over every line of text, dropping the lines it rejects"""
+    return '\n'.join(line for line in map(normalize_line, text.split('\n')) if line)
+
+
+def extract_text_records(html_content, text_mode='nested', parser=None):
+    """Marked text of every kept element, in document order, before line normalization"""
+    if text_mode not in TEXT_MODES:
+        raise ValueError(f"Unknown text mode: {text_mode}")
+
+    backend = get_parser_backend(parser)
+    tree = backend.parse(html_content)
+
+    # Extract useful text content
+    if text_mode == 'blocks':
+        records = backend.collect_text_blocks(tree)
+    else:
+        records = backend.collect_text_elements(tree)
+
+    text_elements = []
+    for name, attrs, text in records:
+        text = format_text_element(name, attrs, text)
+        if text:
+            text_elements.append(text)
+    return text_elements
+
+
+def clean_dom_content(html_content, text_mode='nested', parser=None):
+    """Clean and extract text content from HTML with improved filtering
+
+    Returns one normalized line per kept element (see normalize_line).
+    text_mode 'nested' emits the full text of every valid element, so nested
+    containers repeat their descendants' text. 'blocks' emits each text node
+    once, under its nearest block element. parser names one of
+    PARSER_BACKENDS and defaults to PARSER_BACKEND.
+    """
+    records = extract_text_records(html_content, text_mode, parser)
+    return '\n'.join(line for line in map(normalize_line, records) if line)
@@ -0,0 +1,481 @@
+"""Command line for the scraping pipeline
+
+    python -m scraper scrape https://example.com/shop > shop.txt
+    python -m scraper extract https://example.com/shop --describe "product names and prices"
+    python -m scraper extract shop.txt --describe "products" --columns "name, price:number" --output products.csv
+    python -m scraper crawl urls.txt --describe "product names and prices" --output results.jsonl
+    python -m scraper crawl https://example.com/sitemap.xml --concurrency 8
+    python -m scraper crawl urls.txt --describe "products" --merged products.csv --fuzzy
+    python -m scraper crawl urls.txt --describe "products" --format json --incremental --key name
+    python -m scraper crawl urls.txt --describe "product names and prices" --templates
+    python -m scraper crawl urls.txt --describe "products" --export products.parquet --partition domain,date
+    python -m scraper submit urls.txt --describe "product names and prices"
+    python -m scraper worker --workers 4 --exit-when-idle
+    python -m scraper status 3f9c2a1b7d4e --results results.jsonl
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+from .cache import ExtractionCache, PageCache, clean_with_cache
+from .chunking import DEFAULT_CHUNK_TOKENS, chunk_records, pack_records, split_records
+from .cleaning import TEXT_MODES
+from .crawl import CrawlStats, crawl, load_crawl_urls
+from .fetch import TieredFetcher
+from .incremental import SnapshotStore, extract_incremental
+from .jobs import LEASE_SECONDS, job_settings, open_queue, run_worker, start_workers
+from .llm import LLM_MAX_CONCURRENCY, OUTPUT_FORMATS, extract_chunks, parse_columns
+from .merge import ROW_FUZZY_SIMILARITY, RowMerger, TableMerger
+from .metrics import write_metrics
+from .relevance import RELEVANCE_MIN_SCORE_RATIO, select_relevant_chunks
+from .sinks import EXPORT_FORMATS, RowSink, export_options, parse_partition_by
+from .streaming import iter_chunks
+from .templates import TemplateStore
+
+
+def add_extraction_arguments(parser, output_format, relevance):
+    parser.add_argument('--chunk-tokens', type=int, default=DEFAULT_CHUNK_TOKENS,
+                        help="Token budget per LLM chunk")
+    parser.add_argument('--format', default=output_format, choices=OUTPUT_FORMATS,
+                        help="'json' returns typed rows via tool calling instead of a markdown table")
+    parser.add_argument('--columns', help="Columns for --format json, e.g. 'name, price:number'")
+    parser.add_argument('--relevance', type=float, default=relevance,
+                        help="Skip chunks scoring below this fraction of the best BM25 match with --describe")
+    parser.add_argument('--fuzzy', action='store_true',
+                        help="Drop near-duplicate rows (one cell differing by a typo) when merging")
+    parser.add_argument('--no-cache', action='store_true', help="Do not read or write the on-disk caches")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Diff each page against its snapshot from the last --incremental run and only send "
+                             "new or changed chunks to the LLM")
+    parser.add_argument('--key', help="Columns identifying a row, e.g. 'name', for reporting changed rows with "
+                                      "--incremental (default: the first column)")
+    parser.add_argument('--export', help="Append rows to part files in this directory as they are extracted, "
+                                         "e.g. rows.parquet")
+    parser.add_argument('--export-format', choices=EXPORT_FORMATS,
+                        help="Format of the --export files (default: from its extension, else jsonl)")
+    parser.add_argument('--partition', help="Split the --export files by 'domain', 'date' or 'domain,date'")
+    parser.add_argument('--compression', help="Codec for the --export files: gzip for csv and jsonl; "
+                                              "snappy (default), zstd or gzip for parquet")
+    add_metrics_argument(parser)
+
+
+def add_metrics_argument(parser):
+    parser.add_argument('--metrics', help="Write per-stage timings and counters to this file when done: "
+                                          "Prometheus text for .prom or .txt, otherwise appended JSON lines")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m scraper', description="Scrape, clean and extract web pages")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    scrape = commands.add_parser('scrape', help="Fetch a page and print its cleaned text")
+    scrape.add_argument('url')
+    scrape.add_argument('--text-mode', default='blocks', choices=TEXT_MODES)
+    scrape.add_argument('--output', help="Output file (default: stdout)")
+    scrape.add_argument('--no-cache', action='store_true', help="Do not read or write the page cache")
+    add_metrics_argument(scrape)
+
+    extract = commands.add_parser('extract', help="Extract a table from a page, an HTML or text file, or stdin")
+    extract.add_argument('source', help="URL, HTML or cleaned text file, or - for stdin")
+    extract.add_argument('--describe', required=True, help="What to extract")
+    extract.add_argument('--text-mode', default='blocks', choices=TEXT_MODES)
+    extract.add_argument('--max-concurrency', type=int, default=LLM_MAX_CONCURRENCY,
+                         help="Upper bound for concurrent LLM calls")
+    extract.add_argument('--output', help="CSV output file (default: stdout)")
+    extract.add_argument('--stream', action='store_true',
+                         help="Download, clean, chunk and extract the page piece by piece, with 'blocks' rules, "
+                              "so memory stays bounded on very large pages (no page cache or --relevance)")
+    extract.add_argument('--changes', help="With --incremental, write the added, changed and removed rows "
+                                           "to this JSON file")
+    # The relevance default depends on --stream (see run_command)
+    add_extraction_arguments(extract, 'json', None)
+
+    crawl_parser = commands.add_parser('crawl', help="Crawl many URLs, writing one JSON line per page")
+    crawl_parser.add_argument('source', help="Text file with one URL per line, or a sitemap file or URL")
+    crawl_parser.add_argument('--describe', help="Extraction request; omit to only fetch and clean")
+    crawl_parser.add_argument('--output', help="JSON lines output file (default: stdout)")
+    crawl_parser.add_argument('--concurrency', type=int, default=4, help="Pages fetched at once")
+    crawl_parser.add_argument('--per-domain', type=int, default=1, help="Pages fetched at once per domain")
+    crawl_parser.add_argument('--delay', type=float, default=1.0, help="Seconds between fetch starts per domain")
+    crawl_parser.add_argument('--text-mode', default='blocks', choices=TEXT_MODES)
+    crawl_parser.add_argument('--clean-workers', type=int, default=0,
+                              help="Clean pages in this many worker processes (0 cleans in the crawl threads)")
+    crawl_parser.add_argument('--templates', action='store_true',
+                              help="Learn CSS extraction templates from the LLM's rows and extract later pages "
+                                   "of the same site and page type with them while their checks pass")
+    crawl_parser.add_argument('--merged', help="Also write every page's rows, merged and deduplicated, to this CSV file")
+    add_extraction_arguments(crawl_parser, 'table', 0)
+
+    submit = commands.add_parser('submit', help="Queue a crawl as a job for worker processes; prints the job id")
+    submit.add_argument('source', help="Text file with one URL per line, or a sitemap file or URL")
+    submit.add_argument('--describe', help="Extraction request; omit to only fetch and clean")
+    submit.add_argument('--text-mode', default='blocks', choices=TEXT_MODES)
+    submit.add_argument('--chunk-tokens', type=int, default=DEFAULT_CHUNK_TOKENS, help="Token budget per LLM chunk")
+    submit.add_argument('--format', default='table', choices=OUTPUT_FORMATS,
+                        help="'json' returns typed rows via tool calling instead of a markdown table")
+    submit.add_argument('--columns', help="Columns for --format json, e.g. 'name, price:number'")
+    submit.add_argument('--relevance', type=float, default=0,
+                        help="Skip chunks scoring below this fraction of the best BM25 match with --describe")
+    add_queue_argument(submit)
+
+    worker = commands.add_parser('worker', help="Run queued job tasks until stopped")
+    worker.add_argument('--workers', type=int, default=1, help="Worker processes to start")
+    worker.add_argument('--exit-when-idle', action='store_true', help="Stop once no task is queued or leased")
+    worker.add_argument('--lease', type=float, default=LEASE_SECONDS,
+                        help="Seconds a task stays leased without renewal before another worker may take it")
+    worker.add_argument('--no-cache', action='store_true', help="Do not read or write the on-disk caches")
+    add_queue_argument(worker)
+    add_metrics_argument(worker)
+
+    status = commands.add_parser('status', help="Show job progress, or list recent jobs")
+    status.add_argument('job', nargs='?', help="Job id (default: list recent jobs)")
+    status.add_argument('--results', help="Write the job's finished pages to this JSON lines file")
+    status.add_argument('--watch', type=float, help="Print the status again every this many seconds until done")
+    add_queue_argument(status)
+
+    for name, help_text in (('resume', "Queue a job's failed and cancelled tasks again"),
+                            ('cancel', "Withdraw a job's queued tasks")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('job', help="Job id")
+        add_queue_argument(command)
+    return parser
+
+
+def add_queue_argument(parser):
+    parser.add_argument('--queue', default=os.environ.get('SCRAPER_QUEUE'),
+                        help="Job queue: a SQLite file (default .scraper_cache/jobs.sqlite3) or a redis:// URL; "
+                             "defaults to $SCRAPER_QUEUE")
+
+
+def make_merger(args):
+    fuzzy_similarity = ROW_FUZZY_SIMILARITY if args.fuzzy else 0
+    return RowMerger(fuzzy_similarity) if args.format == 'json' else TableMerger(fuzzy_similarity)
+
+
+def key_columns(args):
+    return [name.strip() for name in args.key.split(',') if name.strip()] if args.key else None
+
+
+def open_output(path):
+    return open(path, 'w', encoding='utf-8', newline='') if path else sys.stdout
+
+
+def run_scrape(args):
+    fetcher = TieredFetcher(cache=None if args.no_cache else PageCache())
+    try:
+        text = clean_with_cache(fetcher.fetch(args.url), args.text_mode, cache=fetcher.cache)
+    except Exception as e:
+        print(f"Error during scraping: {str(e)}", file=sys.stderr)
+        return 1
+    output = open_output(args.output)
+    try:
+        output.write(text + '\n')
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+
+def read_content(args):
+    """Cleaned text for the extract source: fetched and cleaned URLs and HTML files, text as is"""
+    page_cache = None if args.no_cache else PageCache()
+    if args.source.startswith(('http://', 'https://')):
+        fetcher = TieredFetcher(cache=page_cache)
+        return clean_with_cache(fetcher.fetch(args.source), args.text_mode, cache=page_cache)
+    if args.source == '-':
+        text = sys.stdin.read()
+    else:
+        with open(args.source, encoding='utf-8') as f:
+            text = f.read()
+    if text.lstrip().startswith('<'):
+        return clean_with_cache(text, args.text_mode, cache=page_cache)
+    return text
+
+
+def stream_chunks(args):
+    """Chunks of the extract source, yielded while it is read and cleaned
+
+    URLs are streamed from the HTTP response body; text files are split
+    into records line by line.
+    """
+    if args.source.startswith(('http://', 'https://')):
+        yield from iter_chunks(TieredFetcher().iter_fetch(args.source), args.chunk_tokens)
+        return
+    source = sys.stdin.buffer if args.source == '-' else open(args.source, 'rb')
+    try:
+        start = source.peek(1024)[:1024] if hasattr(source, 'peek') else b'<'
+        if start.lstrip().startswith(b'<'):
+            yield from iter_chunks(source, args.chunk_tokens)
+        else:
+            lines = io.TextIOWrapper(source, encoding='utf-8')
+            try:
+                yield from pack_records((record for line in lines for record in split_records(line)),
+                                        args.chunk_tokens)
+            finally:
+                # Leave the source (stdin included) open for the close below
+                lines.detach()
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+
+
+def write_csv(merger, path):
+    output = open_output(path)
+    try:
+        merger.to_dataframe().to_csv(output, index=False)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+def open_sink(args, columns):
+    if not args.export:
+        return None
+    return RowSink(args.export, args.export_format, parse_partition_by(args.partition), args.compression, columns)
+
+
+def source_url(args):
+    return args.source if args.source.startswith(('http://', 'https://')) else None
+
+
+def run_incremental_extract(args, columns):
+    try:
+        content = read_content(args)
+    except Exception as e:
+        print(f"Error reading {args.source}: {str(e)}", file=sys.stderr)
+        return 1
+
+    extracted = extract_incremental(args.source, content, args.describe, SnapshotStore(), args.chunk_tokens,
+                                    None if args.no_cache else ExtractionCache(), args.format, columns,
+                                    args.relevance, ROW_FUZZY_SIMILARITY if args.fuzzy else 0, key_columns(args),
+                                    max_concurrency=args.max_concurrency)
+    merger = make_merger(args)
+    merger.add(extracted['rows'])
+    if args.output or not args.export:
+        write_csv(merger, args.output)
+    sink = open_sink(args, columns)
+    if sink is not None:
+        with sink:
+            sink.write(extracted['rows'], source_url(args))
+        extracted['report']['export'] = sink.stats()
+    if args.changes:
+        with open(args.changes, 'w', encoding='utf-8') as f:
+            json.dump(extracted['changes'], f, indent=2, ensure_ascii=False, default=str)
+    print(json.dumps(extracted['report'], indent=2), file=sys.stderr)
+    return 0 if len(merger) or not extracted['report']['chunks'] else 1
+
+
+def run_extract(args, columns):
+    if args.incremental:
+        return run_incremental_extract(args, columns)
+    if args.stream:
+        # Chunks are read, extracted and let go one window at a time; every
+        # chunk is sent, since relevance scoring needs the whole page
+        all_chunks = stream_chunks(args)
+        chunks = None
+    else:
+        try:
+            all_chunks = chunk_records(read_content(args), args.chunk_tokens)
+        except Exception as e:
+            print(f"Error reading {args.source}: {str(e)}", file=sys.stderr)
+            return 1
+        chunks = [all_chunks[i] for i in select_relevant_chunks(all_chunks, args.describe, args.relevance)]
+
+    extraction_cache = None if args.no_cache else ExtractionCache()
+    # With --export, rows go to the sink as chunks finish and are only
+    # merged in memory when a CSV --output is asked for too
+    sink = open_sink(args, columns)
+    merger = make_merger(args) if args.output or sink is None else None
+    sent = failed = 0
+    try:
+        for _, table in extract_chunks(all_chunks if chunks is None else chunks, args.describe,
+                                       cache=extraction_cache, max_concurrency=args.max_concurrency,
+                                       output_format=args.format, columns=columns):
+            sent += 1
+            failed += table is None
+            if merger is not None:
+                merger.add(table)
+            if sink is not None:
+                sink.write(table, source_url(args))
+    except Exception as e:
+        if not args.stream:
+            raise
+        print(f"Error reading {args.source}: {str(e)}", file=sys.stderr)
+        return 1
+    finally:
+        if sink is not None:
+            sink.close()
+
+    if merger is not None:
+        write_csv(merger, args.output)
+
+    report = {'chunks': sent if chunks is None else len(all_chunks), 'chunks_sent': sent, 'chunks_failed': failed}
+    if merger is not None:
+        report.update(rows=len(merger), duplicates=merger.duplicates, near_duplicates=merger.near_duplicates)
+    if sink is not None:
+        report['export'] = sink.stats()
+    if extraction_cache:
+        report['extraction_cache'] = extraction_cache.stats()
+    print(json.dumps(report, indent=2), file=sys.stderr)
+    rows = len(merger) if merger is not None else sink.rows
+    return 0 if rows or not sent else 1
+
+
+def run_crawl(args, columns):
+    urls = load_crawl_urls(args.source)
+    stats = CrawlStats()
+    cache = None if args.no_cache else PageCache()
+    extraction_cache = None if args.no_cache else ExtractionCache()
+    merger = make_merger(args) if args.merged else None
+    snapshots = SnapshotStore() if args.incremental else None
+    templates = TemplateStore() if args.templates else None
+    sink = open_sink(args, columns)
+    incremental = Counter()
+    output = open_output(args.output)
+    try:
+        for result in crawl(urls, args.describe, concurrency=args.concurrency,
+                            per_domain_concurrency=args.per_domain,
+                            per_domain_delay=args.delay, text_mode=args.text_mode,
+                            chunk_tokens=args.chunk_tokens, stats=stats, cache=cache,
+                            extraction_cache=extraction_cache, output_format=args.format,
+                            columns=columns, relevance=args.relevance,
+                            clean_workers=args.clean_workers, snapshots=snapshots,
+                            key_columns=key_columns(args), templates=templates):
+            output.write(json.dumps(result) + '\n')
+            output.flush()
+            incremental.update(result.get('incremental', {}))
+            if merger is not None:
+                merger.add(result['table'])
+            if sink is not None:
+                sink.write(result['table'], result['url'])
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if sink is not None:
+            sink.close()
+
+    if merger is not None:
+        merger.to_dataframe().to_csv(args.merged, index=False)
+
+    report = stats.report()
+    if snapshots is not None:
+        report['incremental'] = dict(incremental)
+    if templates is not None:
+        report['templates'] = templates.stats()
+    if sink is not None:
+        report['export'] = sink.stats()
+    if merger is not None:
+        report['merged'] = {'rows': len(merger), 'duplicates': merger.duplicates,
+                            'near_duplicates': merger.near_duplicates}
+    if cache:
+        report['cache'] = cache.stats()
+        report['extraction_cache'] = extraction_cache.stats()
+    print(json.dumps(report, indent=2), file=sys.stderr)
+    return 0
+
+
+def run_submit(args, columns):
+    urls = load_crawl_urls(args.source)
+    settings = job_settings(args.describe, args.text_mode, args.chunk_tokens, args.format, columns, args.relevance)
+    print(open_queue(args.queue).submit(urls, settings))
+    return 0
+
+
+def run_workers(args):
+    options = {'use_cache': not args.no_cache, 'lease_seconds': args.lease, 'exit_when_idle': args.exit_when_idle}
+    if args.workers <= 1:
+        try:
+            run_worker(open_queue(args.queue), **options)
+        except KeyboardInterrupt:
+            pass
+        return 0
+    processes = start_workers(args.workers, args.queue, **options)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+    return 0
+
+
+def run_status(args):
+    queue = open_queue(args.queue)
+    if args.job is None:
+        for status in queue.jobs():
+            print(f"{status['job']}  {status['state']:<9} {status['pages_done']}/{status['urls']} pages done, "
+                  f"{status['pages_failed']} failed")
+        return 0
+    while True:
+        status = queue.status(args.job)
+        if status is None:
+            print(f"No job {args.job}", file=sys.stderr)
+            return 1
+        print(json.dumps(status, indent=2))
+        if not args.watch or status['state'] in ('done', 'cancelled'):
+            break
+        time.sleep(args.watch)
+    if args.results:
+        with open(args.results, 'w', encoding='utf-8') as f:
+            for result in queue.results(args.job):
+                f.write(json.dumps(result) + '\n')
+    return 0
+
+
+def run_job_command(args):
+    queue = open_queue(args.queue)
+    if queue.status(args.job) is None:
+        print(f"No job {args.job}", file=sys.stderr)
+        return 1
+    if args.command == 'resume':
+        print(f"{queue.resume(args.job)} tasks queued again", file=sys.stderr)
+    else:
+        queue.cancel(args.job)
+    return 0
+
+
+def run_command(parser, args):
+    if args.command == 'scrape':
+        return run_scrape(args)
+    if args.command == 'worker':
+        return run_workers(args)
+    if args.command == 'status':
+        return run_status(args)
+    if args.command in ('resume', 'cancel'):
+        return run_job_command(args)
+
+    try:
+        columns = parse_columns(args.columns)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.command == 'extract' and args.incremental and args.stream:
+        parser.error("--incremental needs the whole page; it cannot be combined with --stream")
+    if args.command == 'extract' and args.relevance is None:
+        args.relevance = 0 if args.stream else RELEVANCE_MIN_SCORE_RATIO
+    elif args.command == 'extract' and args.stream and args.relevance:
+        parser.error("--relevance scores each chunk against the whole page; use --relevance 0 with --stream")
+    if args.command in ('extract', 'crawl') and args.export:
+        try:
+            export_options(args.export, args.export_format, args.compression)
+            parse_partition_by(args.partition)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.command == 'extract':
+        return run_extract(args, columns)
+    if args.command == 'submit':
+        return run_submit(args, columns)
+    return run_crawl(args, columns)
+
+
+def main_cli(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        return run_command(parser, args)
+    finally:
+        if getattr(args, 'metrics', None):
+            write_metrics(args.metrics)
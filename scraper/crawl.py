@@ -0,0 +1,213 @@
+"""Batch crawling: many URLs with bounded concurrency and per-domain politeness"""
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from contextlib import contextmanager
+from html import unescape
+from urllib.parse import urlparse
+from urllib.request import urlopen
+
+from .cache import clean_with_cache
+from .chunking import DEFAULT_CHUNK_TOKENS, chunk_records
+from .clean_pool import CleaningPool
+from .fetch import TieredFetcher
+from .incremental import extract_incremental
+from .llm import process_chunk
+from .merge import RowMerger, markdown_rows, merge_tables
+from .metrics import get_metrics, percentile
+from .relevance import select_relevant_chunks
+from .templates import extract_with_template, learn_template
+
+def load_crawl_urls(source):
+    """Read crawl URLs from a text file (one per line) or a sitemap file or URL"""
+    if source.startswith(('http://', 'https://')):
+        with urlopen(source, timeout=30) as response:
+            text = response.read().decode('utf-8', errors='replace')
+    else:
+        with open(source, encoding='utf-8') as f:
+            text = f.read()
+
+    if '<urlset' in text or '<sitemapindex' in text:
+        return [unescape(loc.strip()) for loc in re.findall(r'<loc>(.*?)</loc>', text, re.S)]
+    return [line.strip() for line in text.splitlines() if line.strip() and not line.startswith('#')]
+
+
+class DomainLimiter:
+    """Per-domain politeness: at most max_concurrent fetches and min_delay seconds between starts"""
+
+    def __init__(self, max_concurrent=1, min_delay=1.0):
+        self.max_concurrent = max_concurrent
+        self.min_delay = min_delay
+        self.lock = threading.Lock()
+        self.slots = {}
+        self.next_start = {}
+
+    @contextmanager
+    def slot(self, domain):
+        with self.lock:
+            if domain not in self.slots:
+                self.slots[domain] = threading.Semaphore(self.max_concurrent)
+            slots = self.slots[domain]
+
+        with slots:
+            with self.lock:
+                now = time.monotonic()
+                start = max(now, self.next_start.get(domain, now))
+                self.next_start[domain] = start + self.min_delay
+            if start > now:
+                time.sleep(start - now)
+            yield
+
+
+class CrawlStats:
+    """Throughput, fetch latency and per-domain failure counters for a crawl"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.pages = 0
+        self.fetch_seconds = []
+        self.failures = Counter()
+
+    def record(self, result):
+        with self.lock:
+            self.pages += 1
+            if result['fetch_seconds'] is not None:
+                self.fetch_seconds.append(result['fetch_seconds'])
+            if result['error']:
+                self.failures[result['domain']] += 1
+
+    def report(self):
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            return {
+                'pages': self.pages,
+                'failed': sum(self.failures.values()),
+                'elapsed_seconds': round(elapsed, 3),
+                'pages_per_minute': round(self.pages * 60 / elapsed, 1) if elapsed else 0.0,
+                'fetch_p50_seconds': round(percentile(self.fetch_seconds, 0.5), 3),
+                'fetch_p95_seconds': round(percentile(self.fetch_seconds, 0.95), 3),
+                'failures_per_domain': dict(self.failures),
+            }
+
+
+def extract_from_content(content, parse_description, chunk_tokens=DEFAULT_CHUNK_TOKENS, cache=None,
+                         output_format='table', columns=None, relevance=0):
+    """Run the chunk/LLM/merge extraction on cleaned page content
+
+    Returns a markdown table, or a list of row dicts for the 'json' output
+    format. With relevance > 0 only chunks passing select_relevant_chunks
+    are sent.
+    """
+    chunks = chunk_records(content, chunk_tokens)
+    chunks = [chunks[i] for i in select_relevant_chunks(chunks, parse_description, relevance)]
+    tables = [table for table in (process_chunk(chunk, parse_description, cache, output_format, columns)
+                                  for chunk in chunks) if table]
+    if output_format == 'json':
+        merger = RowMerger()
+        for table in tables:
+            merger.add(table)
+        return merger.to_records() or None
+    return merge_tables(tables) if tables else None
+
+
+def crawl_page(url, fetch, limiter, parse_description, text_mode, chunk_tokens, cache=None,
+               extraction_cache=None, output_format='table', columns=None, relevance=0, clean_pool=None,
+               snapshots=None, key_columns=None, templates=None):
+    """Fetch, clean and optionally extract one page, never raising"""
+    domain = (urlparse(url).hostname or '').lower()
+    result = {'url': url, 'domain': domain, 'fetch_seconds': None,
+              'content': None, 'table': None, 'error': None}
+    try:
+        with limiter.slot(domain):
+            fetch_start = time.monotonic()
+            html = fetch(url)
+            result['fetch_seconds'] = time.monotonic() - fetch_start
+
+        result['content'] = clean_with_cache(html, text_mode, cache=cache, pool=clean_pool)
+        rows = None
+        if parse_description and result['content'] and templates is not None:
+            rows = extract_with_template(templates, url, html, parse_description, output_format, columns)
+            result['template'] = rows is not None
+        if rows is not None:
+            result['table'] = rows if output_format == 'json' else merge_tables([rows])
+        elif parse_description and result['content'] and snapshots is not None:
+            extracted = extract_incremental(url, result['content'], parse_description, snapshots, chunk_tokens,
+                                            extraction_cache, output_format, columns, relevance,
+                                            key_columns=key_columns, max_concurrency=1)
+            rows = extracted['rows'] or None
+            result['table'] = rows if output_format == 'json' or rows is None else merge_tables([rows])
+            result['changes'] = extracted['changes']
+            result['incremental'] = extracted['report']
+        elif parse_description and result['content']:
+            result['table'] = extract_from_content(result['content'], parse_description, chunk_tokens,
+                                                   extraction_cache, output_format, columns, relevance)
+        if templates is not None and rows is None and result['table']:
+            llm_rows = result['table'] if output_format == 'json' else markdown_rows(result['table'])
+            learn_template(templates, url, html, llm_rows, parse_description, output_format, columns)
+    except Exception as e:
+        result['error'] = str(e) or type(e).__name__
+    get_metrics().increment('pages_total', outcome='error' if result['error'] else 'ok')
+    return result
+
+
+def crawl(urls, parse_description=None, concurrency=4, per_domain_concurrency=1,
+          per_domain_delay=1.0, fetch=None, text_mode='blocks', chunk_tokens=DEFAULT_CHUNK_TOKENS, stats=None,
+          cache=None, extraction_cache=None, output_format='table', columns=None, relevance=0,
+          clean_workers=0, snapshots=None, key_columns=None, templates=None):
+    """Crawl many URLs with bounded concurrency, yielding each page result as it completes
+
+    Pages are fetched over HTTP, falling back to a browser session pool
+    sized to concurrency, unless a fetch(url) -> html callable is given. Each result is a dict
+    with url, domain, fetch_seconds, content, table and error. Pass a
+    CrawlStats to read throughput and latency figures afterwards, and a
+    PageCache to reuse fetched pages and cleaned text between runs, and an
+    ExtractionCache to reuse LLM results for chunks seen before. With
+    output_format='json' each table is a list of row dicts shaped by columns,
+    and relevance > 0 skips chunks that do not match parse_description.
+    With clean_workers > 0 pages are cleaned in that many worker processes
+    (see CleaningPool) instead of in the crawl threads. With a SnapshotStore,
+    only new or changed chunks of pages extracted before are sent to the
+    LLM (see extract_incremental), and each result also has the page's
+    changes (rows paired on key_columns count as changed) and an
+    incremental report. With a TemplateStore, pages whose domain and page
+    type have a learned template are extracted with it instead of the LLM
+    while its checks pass, and templates are learned from the LLM's rows.
+    """
+    if fetch is None:
+        from .browser import BrowserSessionPool
+
+        pool = BrowserSessionPool(max_size=concurrency)
+        fetch = TieredFetcher(pool, cache, max_connections=concurrency).fetch
+    else:
+        pool = None
+    clean_pool = CleaningPool(clean_workers, max_pending=concurrency) if clean_workers else None
+    stats = stats if stats is not None else CrawlStats()
+    limiter = DomainLimiter(per_domain_concurrency, per_domain_delay)
+
+    urls = iter(urls)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            # Keep a bounded window of pages in flight so huge URL lists stream
+            pending = set()
+            for url in urls:
+                pending.add(executor.submit(crawl_page, url, fetch, limiter,
+                                            parse_description, text_mode, chunk_tokens, cache,
+                                            extraction_cache, output_format, columns, relevance,
+                                            clean_pool, snapshots, key_columns, templates))
+                if len(pending) >= concurrency * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        stats.record(future.result())
+                        yield future.result()
+
+            for future in as_completed(pending):
+                stats.record(future.result())
+                yield future.result()
+    finally:
+        if pool is not None:
+            pool.close()
+        if clean_pool is not None:
+            clean_pool.close()
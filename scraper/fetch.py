@@ -0,0 +1,298 @@
+"""Page fetching: a keep-alive HTTP client first, a remote browser only when a page needs it"""
+import functools
+import re
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlparse
+
+import requests
+
+from .cache import clean_with_cache, get_page_cache
+from .metrics import get_metrics
+from .streaming import STREAM_PIECE_SIZE
+
+# Readiness strategies used by browser.wait_until_ready instead of a fixed
+# sleep. They also key cached pages, so they live here with the fetcher.
+# SITE_READINESS maps a hostname (subdomains included) to its settings;
+# every other site uses DEFAULT_READINESS. Strategies:
+#   'document'  - document.readyState is 'complete'
+#   'network'   - no new resource loads for quiet_seconds
+#   'mutations' - no DOM mutations for quiet_seconds
+#   'selector'  - an element matching selector is present
+DEFAULT_READINESS = {'strategy': 'document', 'timeout': 10}
+SITE_READINESS = {
+    # 'example.com': {'strategy': 'selector', 'selector': '.product-card', 'timeout': 15},
+}
+
+
+def get_readiness_settings(url):
+    """Return the readiness settings for a URL's site"""
+    host = (urlparse(url).hostname or '').lower()
+    while host:
+        if host in SITE_READINESS:
+            return {**DEFAULT_READINESS, **SITE_READINESS[host]}
+        host = host.partition('.')[2]
+    return DEFAULT_READINESS
+
+
+# Signals that a page fetched over plain HTTP still needs a browser to render.
+# SPA and captcha markers only name the reason when the visible body text is
+# thin; a page with enough text is used as fetched, whatever its scripts.
+HTTP_USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                   '(KHTML, like Gecko) Chrome/124.0 Safari/537.36')
+BROWSER_STATUS_CODES = frozenset([401, 403])
+MIN_BODY_TEXT_LENGTH = 200
+SPA_MARKER_RE = re.compile(
+    r'<div[^>]+id=["\'](?:root|app|__next|__nuxt)["\'][^>]*>\s*</div>'
+    r'|ng-app|data-reactroot|window\.__NUXT__|window\.__INITIAL_STATE__',
+    re.I,
+)
+CHALLENGE_MARKER_RE = re.compile(r'cf-challenge|cf_chl_|challenge-platform', re.I)
+CHALLENGE_TEXT_RE = re.compile(
+    r'captcha|verify (?:that )?you are (?:a )?human|are you a robot|checking your browser'
+    r'|just a moment\.\.\.|enable javascript and cookies to continue',
+    re.I,
+)
+NON_VISIBLE_RE = re.compile(r'<(script|style|noscript|template)\b.*?</\1\s*>|<!--.*?-->', re.I | re.S)
+TAG_RE = re.compile(r'<[^>]+>')
+# Reasons that say how a site renders; only these are cached per domain
+RENDER_REASONS = frozenset(['captcha', 'spa marker', 'near-empty body'])
+
+# Rate limits, unavailable servers and network errors are retried over HTTP
+# with backoff (honouring a short Retry-After) instead of moving to the browser.
+RETRY_STATUS_CODES = frozenset([429, 502, 503, 504])
+HTTP_RETRIES = 2
+HTTP_RETRY_BACKOFF_SECONDS = 1.0
+HTTP_RETRY_MAX_SECONDS = 10.0
+
+
+def visible_body_text(html):
+    """The page's body text without tags, scripts, styles and comments"""
+    body_start = html.lower().find('<body')
+    return ' '.join(TAG_RE.sub(' ', NON_VISIBLE_RE.sub(' ', html[body_start if body_start != -1 else 0:])).split())
+
+
+def render_reason(html):
+    """Why a fetched page must be rendered in a browser, or None when its body has enough text"""
+    visible = visible_body_text(html)
+    if len(visible.replace(' ', '')) >= MIN_BODY_TEXT_LENGTH:
+        return None
+    if CHALLENGE_TEXT_RE.search(visible) or CHALLENGE_MARKER_RE.search(html):
+        return "captcha"
+    if SPA_MARKER_RE.search(html):
+        return "spa marker"
+    return "near-empty body"
+
+
+def needs_browser(response):
+    """Decide whether an HTTP response must be re-fetched in a browser
+
+    Returns the reason as a string, or None if a browser would not do better.
+    A rate-limit or unavailable response only needs the browser when it is a
+    challenge page.
+    """
+    if response.status_code in BROWSER_STATUS_CODES:
+        return f"status {response.status_code}"
+    if 'html' not in response.headers.get('Content-Type', 'text/html'):
+        return None
+    if response.status_code in RETRY_STATUS_CODES:
+        return "captcha" if render_reason(response.text) == "captcha" else None
+    if response.status_code >= 400:
+        return None
+    return render_reason(response.text)
+
+
+def retry_after_seconds(response, attempt):
+    """Seconds to wait before retrying a transient HTTP failure"""
+    delay = HTTP_RETRY_BACKOFF_SECONDS * 2 ** attempt
+    retry_after = response.headers.get('Retry-After', '') if response is not None else ''
+    if retry_after.strip().isdigit():
+        delay = max(delay, int(retry_after))
+    return min(delay, HTTP_RETRY_MAX_SECONDS)
+
+
+class TieredFetcher:
+    """Fetch pages over a pooled keep-alive HTTP client, using the browser only when needed
+
+    Whether a domain renders in the browser is cached for decision_ttl
+    seconds: once one of its pages needed rendering (see RENDER_REASONS), its
+    pages skip the HTTP attempt. A 401/403 sends only that page to the
+    browser. Network errors and RETRY_STATUS_CODES are retried over HTTP
+    http_retries times, then raised. With a PageCache, fresh pages are
+    served from disk and expired ones are revalidated.
+    """
+
+    def __init__(self, pool=None, cache=None, max_connections=16, http_timeout=15, decision_ttl=3600,
+                 http_retries=HTTP_RETRIES):
+        self.pool = pool
+        self.cache = cache
+        self.http_timeout = http_timeout
+        self.decision_ttl = decision_ttl
+        self.http_retries = http_retries
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = HTTP_USER_AGENT
+        adapter = requests.adapters.HTTPAdapter(pool_connections=max_connections,
+                                                pool_maxsize=max_connections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.lock = threading.Lock()
+        self.domain_tiers = {}
+        self.counts = Counter()
+
+    def get_domain_tier(self, domain):
+        with self.lock:
+            tier, decided_at = self.domain_tiers.get(domain, (None, 0))
+            if tier and time.monotonic() - decided_at > self.decision_ttl:
+                del self.domain_tiers[domain]
+                return None
+            return tier
+
+    def set_domain_tier(self, domain, tier):
+        with self.lock:
+            self.domain_tiers[domain] = (tier, time.monotonic())
+
+    def fetch_browser(self, url):
+        from .browser import fetch_page_html
+
+        with self.lock:
+            self.counts['browser'] += 1
+        get_metrics().increment('fetches_total', tier='browser')
+        return fetch_page_html(url, self.pool)
+
+    def fetch(self, url):
+        """Return the raw HTML for url from the cache or the cheapest tier that renders it"""
+        domain = (urlparse(url).hostname or '').lower()
+        options = {'user_agent': HTTP_USER_AGENT, 'readiness': get_readiness_settings(url)}
+        cached = self.cache.get_page(url, options) if self.cache else None
+        if cached and cached['fresh']:
+            self.cache.count('page_hit')
+            get_metrics().increment('fetches_total', tier='cache')
+            return cached['html']
+
+        if self.get_domain_tier(domain) == 'browser':
+            html = self.fetch_browser(url)
+            self.store(url, options, html)
+            return html
+
+        # Revalidate an expired copy instead of downloading it again
+        headers = {}
+        if cached and cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached and cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+
+        response = self.get_http(url, headers)
+        if response.status_code == 304 and cached:
+            self.cache.touch_page(url, options)
+            self.cache.count('page_revalidated')
+            get_metrics().increment('fetches_total', tier='revalidated')
+            with self.lock:
+                self.counts['http'] += 1
+            return cached['html']
+        reason = needs_browser(response)
+
+        if reason is None:
+            # Errors like 404 would look the same in a browser
+            response.raise_for_status()
+            self.set_domain_tier(domain, 'http')
+            get_metrics().increment('fetches_total', tier='http')
+            with self.lock:
+                self.counts['http'] += 1
+            self.store(url, options, response.text,
+                       response.headers.get('ETag'), response.headers.get('Last-Modified'))
+            return response.text
+
+        print(f"Falling back to browser for {url}: {reason}")
+        if reason in RENDER_REASONS:
+            self.set_domain_tier(domain, 'browser')
+        with self.lock:
+            self.counts['fallback'] += 1
+        html = self.fetch_browser(url)
+        self.store(url, options, html)
+        return html
+
+    def iter_fetch(self, url, piece_size=STREAM_PIECE_SIZE):
+        """Yield a page's raw HTML in byte pieces as it downloads, for pages too large to hold whole
+
+        The page cache and the thin-body check are skipped, since both need
+        the whole body. A page whose domain is pinned to the browser, or that
+        answers 401/403 or a challenge, is loaded in the browser and yielded
+        as one string.
+        """
+        domain = (urlparse(url).hostname or '').lower()
+        if self.get_domain_tier(domain) == 'browser':
+            yield self.fetch_browser(url)
+            return
+
+        response = self.get_http(url, {}, stream=True)
+        with response:
+            reason = needs_browser(response) if response.status_code >= 400 else None
+            if reason is None:
+                response.raise_for_status()
+                get_metrics().increment('fetches_total', tier='http')
+                with self.lock:
+                    self.counts['http'] += 1
+                yield from response.iter_content(piece_size)
+                return
+
+        print(f"Falling back to browser for {url}: {reason}")
+        if reason in RENDER_REASONS:
+            self.set_domain_tier(domain, 'browser')
+        with self.lock:
+            self.counts['fallback'] += 1
+        yield self.fetch_browser(url)
+
+    def get_http(self, url, headers, stream=False):
+        """GET a page, retrying network errors and RETRY_STATUS_CODES with backoff"""
+        for attempt in range(self.http_retries + 1):
+            response = None
+            try:
+                with get_metrics().timer('http_fetch'):
+                    response = self.session.get(url, headers=headers, timeout=self.http_timeout, stream=stream)
+                if response.status_code not in RETRY_STATUS_CODES or needs_browser(response):
+                    return response
+                if attempt == self.http_retries:
+                    response.raise_for_status()
+            except requests.RequestException:
+                if attempt == self.http_retries:
+                    raise
+            with self.lock:
+                self.counts['retried'] += 1
+            delay = retry_after_seconds(response, attempt)
+            if response is not None:
+                response.close()  # hand a streamed response's connection back to the pool
+            time.sleep(delay)
+
+    def store(self, url, options, html, etag=None, last_modified=None):
+        if self.cache:
+            self.cache.count('page_miss')
+            self.cache.put_page(url, options, html, etag, last_modified)
+
+    def stats(self):
+        """Pages served over HTTP, by the browser, HTTP attempts that fell back and retried HTTP requests"""
+        with self.lock:
+            return {'http': self.counts['http'], 'browser': self.counts['browser'],
+                    'fallback': self.counts['fallback'], 'retried': self.counts['retried']}
+
+
+@functools.cache
+def get_tiered_fetcher():
+    """Tiered fetcher shared by everything in this process, backed by the shared browser pool"""
+    return TieredFetcher(cache=get_page_cache())
+
+
+def scrape_website(url, text_mode='nested', fetcher=None):
+    """Scrape website content over HTTP or a pooled Selenium session with improved error handling"""
+    fetcher = fetcher or get_tiered_fetcher()
+    try:
+        html = fetcher.fetch(url)
+        # Clean after the driver is back in the pool
+        content = clean_with_cache(html, text_mode, cache=fetcher.cache)
+        get_metrics().increment('pages_total', outcome='ok')
+        return content
+
+    except Exception as e:
+        print(f"Error during scraping: {str(e)}")
+        get_metrics().increment('pages_total', outcome='error')
+        return None
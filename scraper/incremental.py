@@ -0,0 +1,272 @@
+"""Incremental re-extraction of pages that were extracted before
+
+A snapshot keeps, per URL and extraction request, the hashes of the page's
+cleaned records, the record span of each chunk and the rows extracted from
+each chunk. On the next run, chunks whose records all reappear in the same
+order keep their spans and rows. Only the stretches of new or changed
+records are chunked again and sent to the LLM. The merged table is then
+compared with the previous one and reported as added, changed and removed
+rows.
+"""
+import hashlib
+import json
+import os
+import time
+import zlib
+
+from .cache import SQLiteStore, content_hash
+from .chunking import DEFAULT_CHUNK_TOKENS, pack_records, record_token_cost, split_records
+from .llm import (EXTRACTION_PROMPT_VERSION, MODEL_NAME, default_llm_call, extract_chunks,
+                  extraction_prompt_tokens, extraction_variant)
+from .merge import RowMerger, TableMerger, markdown_rows, normalize_cell, normalize_column
+from .metrics import get_metrics
+from .relevance import select_relevant_chunks
+
+SNAPSHOT_PATH = os.path.join('.scraper_cache', 'snapshots.sqlite3')
+
+
+def record_hash(record):
+    return hashlib.blake2b(record.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def snapshot_scope(parse_description, output_format='table', columns=None, chunk_tokens=DEFAULT_CHUNK_TOKENS,
+                   relevance=0):
+    """Key for the settings a snapshot's rows depend on; other settings start from an empty snapshot"""
+    return content_hash(json.dumps([parse_description, EXTRACTION_PROMPT_VERSION, MODEL_NAME,
+                                    extraction_variant(output_format, columns), chunk_tokens, relevance]))
+
+
+class SnapshotStore(SQLiteStore):
+    """Per-URL snapshots of the last incremental extraction
+
+    A snapshot is a dict with 'records' (record hashes in page order) and
+    'chunks' ([start, end, rows] record spans; rows is None when the
+    extraction failed, so the chunk is sent again next time).
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS snapshots (
+            url TEXT NOT NULL, scope TEXT NOT NULL, data BLOB NOT NULL, updated_at REAL NOT NULL,
+            PRIMARY KEY (url, scope));
+    """
+
+    def __init__(self, path=SNAPSHOT_PATH):
+        super().__init__(path)
+
+    def get(self, url, scope):
+        with self.connect() as db:
+            row = db.execute("SELECT data FROM snapshots WHERE url = ? AND scope = ?", (url, scope)).fetchone()
+        self.count('hit' if row else 'miss')
+        return json.loads(zlib.decompress(row[0])) if row else None
+
+    def put(self, url, scope, snapshot):
+        data = zlib.compress(json.dumps(snapshot, ensure_ascii=False).encode('utf-8'))
+        with self.connect() as db:
+            db.execute("INSERT OR REPLACE INTO snapshots (url, scope, data, updated_at) VALUES (?, ?, ?, ?)",
+                       (url, scope, data, time.time()))
+
+
+def match_chunks(snapshot, hashes):
+    """Find each snapshot chunk whose records reappear unchanged; returns [(start, end, rows)] in new indices
+
+    Chunks are matched in page order at their first free occurrence, so
+    moved chunks are found too; a chunk that failed last time never matches.
+    """
+    positions = {}
+    for i, value in enumerate(hashes):
+        positions.setdefault(value, []).append(i)
+    claimed = bytearray(len(hashes))
+    matched = []
+    cursor = 0
+    for start, end, rows in snapshot['chunks'] if snapshot else ():
+        if rows is None:
+            continue
+        old = snapshot['records'][start:end]
+        candidates = positions.get(old[0], ())
+        for position in sorted(candidates, key=lambda p: p < cursor):
+            new_end = position + len(old)
+            if hashes[position:new_end] == old and not any(claimed[position:new_end]):
+                claimed[position:new_end] = b'\x01' * len(old)
+                matched.append((position, new_end, rows))
+                cursor = new_end
+                break
+    return sorted(matched, key=lambda chunk: chunk[0])
+
+
+def pack_spans(records, start, end, max_tokens):
+    """Greedily split records[start:end] into spans of at most max_tokens; an over-long record is a span alone"""
+    spans = []
+    span_start, span_tokens = start, 0
+    for i in range(start, end):
+        tokens = record_token_cost(records[i])
+        if i > span_start and span_tokens + tokens > max_tokens:
+            spans.append((span_start, i))
+            span_start, span_tokens = i, 0
+        span_tokens += tokens
+    if span_start < end:
+        spans.append((span_start, end))
+    return spans
+
+
+def plan_chunks(records, hashes, snapshot, max_tokens):
+    """Page chunks as [start, end, rows] spans: reused ones carry their rows, new ones have rows None"""
+    plan = []
+    covered = 0
+    for start, end, rows in match_chunks(snapshot, hashes) + [(len(records), len(records), None)]:
+        plan.extend([span_start, span_end, None] for span_start, span_end in
+                    pack_spans(records, covered, start, max_tokens))
+        if start < end:
+            plan.append([start, end, rows])
+        covered = end
+    return plan
+
+
+def result_rows(result, output_format):
+    if output_format == 'json':
+        return json.loads(result)
+    return markdown_rows(result)
+
+
+def merge_chunk_rows(chunks, output_format, fuzzy_similarity=0):
+    merger = RowMerger(fuzzy_similarity) if output_format == 'json' else TableMerger(fuzzy_similarity)
+    for _, _, rows in chunks:
+        merger.add(rows)
+    return merger
+
+
+def diff_rows(previous, current, key_columns=None):
+    """Compare two row lists as added, changed and removed rows
+
+    Rows with the same values (case, whitespace and column name spelling
+    ignored) are unchanged. Of the rest, a previous and a current row that
+    agree on key_columns (default: the first column) are a changed pair.
+    """
+    def cells(row):
+        return {normalize_column(name): value for name, value in row.items() if value not in (None, '')}
+
+    def full_key(row):
+        return tuple(sorted((name, normalize_cell(value)) for name, value in cells(row).items()))
+
+    if key_columns is None:
+        first = next((row for row in current or previous if row), None)
+        key_columns = [next(iter(first))] if first else []
+    keys = [normalize_column(name) for name in key_columns]
+
+    def identity(row):
+        values = cells(row)
+        if not keys or any(key not in values for key in keys):
+            return None
+        return tuple(normalize_cell(values[key]) for key in keys)
+
+    unmatched = {}
+    for row in previous:
+        unmatched.setdefault(full_key(row), []).append(row)
+    added = []
+    for row in current:
+        same = unmatched.get(full_key(row))
+        if same:
+            same.pop()
+        else:
+            added.append(row)
+    removed = [row for rows in unmatched.values() for row in rows]
+
+    by_identity = {}
+    for row in removed:
+        by_identity.setdefault(identity(row), []).append(row)
+    by_identity.pop(None, None)
+    changed = []
+    still_added = []
+    for row in added:
+        before = by_identity.get(identity(row))
+        if before:
+            changed.append({'before': before.pop(0), 'after': row})
+        else:
+            still_added.append(row)
+    paired = {id(change['before']) for change in changed}
+    return {'added': still_added, 'changed': changed,
+            'removed': [row for row in removed if id(row) not in paired]}
+
+
+def extract_incremental(url, content, parse_description, store, chunk_tokens=DEFAULT_CHUNK_TOKENS, cache=None,
+                        output_format='table', columns=None, relevance=0, fuzzy_similarity=0, key_columns=None,
+                        **engine_options):
+    """Extract rows from a page's cleaned content, re-using its snapshot for unchanged chunks
+
+    Only new and changed chunks that pass the relevance filter go to the
+    LLM, through extract_chunks (engine_options such as max_concurrency or
+    llm_call are passed on). They are not looked up in cache, only stored in
+    it. Returns a dict with the merged 'rows', the
+    'changes' against the previous run (see diff_rows) and a 'report' of
+    chunks, and of LLM calls and prompt tokens avoided: those the reused
+    chunks would have cost if sent again.
+    """
+    metrics = get_metrics()
+    scope = snapshot_scope(parse_description, output_format, columns, chunk_tokens, relevance)
+    snapshot = store.get(url, scope)
+    with metrics.timer('diff'):
+        records = split_records(content)
+        hashes = [record_hash(record) for record in records]
+        plan = plan_chunks(records, hashes, snapshot, chunk_tokens)
+
+    # A span holding one over-long record is split into several chunk texts
+    texts, owners = [], []
+    for index, (start, end, _) in enumerate(plan):
+        for text in pack_records(records[start:end], chunk_tokens):
+            texts.append(text)
+            owners.append(index)
+    selected = set(select_relevant_chunks(texts, parse_description, relevance))
+
+    report = {'chunks': len(texts), 'chunks_reused': 0, 'chunks_sent': 0, 'chunks_failed': 0,
+              'llm_calls_avoided': 0, 'tokens_avoided': 0}
+    results = {index: [] for index, chunk in enumerate(plan) if chunk[2] is None}
+    to_send = []
+    for i, (text, owner) in enumerate(zip(texts, owners)):
+        if plan[owner][2] is not None:
+            report['chunks_reused'] += 1
+            if i in selected:
+                report['llm_calls_avoided'] += 1
+                report['tokens_avoided'] += extraction_prompt_tokens(text, parse_description, output_format)
+        elif i in selected:
+            to_send.append(i)
+
+    if to_send:
+        # extract_chunks gives None both for an answer without rows and after
+        # the last failed retry; only the latter is sent again next time
+        llm_call = engine_options.pop('llm_call', None) or default_llm_call(output_format, columns)
+        answered = set()
+
+        async def call(chunk, description):
+            result = await llm_call(chunk, description)
+            answered.add(chunk)
+            return result
+
+        # New and changed chunks are never read from the extraction cache, so
+        # every chunk sent is a real LLM call; their results are stored for others
+        variant = extraction_variant(output_format, columns)
+        for position, result in extract_chunks([texts[i] for i in to_send], parse_description, llm_call=call,
+                                               output_format=output_format, columns=columns, **engine_options):
+            owner = owners[to_send[position]]
+            report['chunks_sent'] += 1
+            if result is not None and cache is not None:
+                cache.put(texts[to_send[position]], parse_description, result, variant)
+            if result is None and texts[to_send[position]] in answered:
+                continue
+            if result is None:
+                report['chunks_failed'] += 1
+                results[owner] = None
+            elif results[owner] is not None:
+                results[owner].extend(result_rows(result, output_format))
+    for index, rows in results.items():
+        plan[index][2] = rows
+
+    store.put(url, scope, {'records': hashes, 'chunks': plan})
+    merger = merge_chunk_rows(plan, output_format, fuzzy_similarity)
+    previous = merge_chunk_rows(snapshot['chunks'], output_format, fuzzy_similarity).to_records() \
+        if snapshot else []
+    rows = merger.to_records()
+    changes = diff_rows(previous, rows, key_columns)
+    report.update(previous=snapshot is not None, rows=len(rows),
+                  **{kind: len(changed) for kind, changed in changes.items()})
+    metrics.increment('llm_calls_avoided_total', report['llm_calls_avoided'])
+    metrics.increment('llm_tokens_avoided_total', report['tokens_avoided'])
+    return {'rows': rows, 'changes': changes, 'report': report}
@@ -0,0 +1,677 @@
+"""Durable job queue and stateless workers for crawls that outlive the UI
+
+A job is a list of URLs with crawl settings. Each URL becomes a chain of
+tasks, fetch -> clean -> extract, and a finished task checkpoints its
+output in the queue in the same step that queues the next one. A stopped
+crawl therefore resumes where it was. A worker that dies loses only the
+task it had leased, which is handed out again once the lease expires.
+Failed tasks are retried with exponential backoff up to max_attempts
+times in all.
+
+SQLiteQueue keeps the queue in a local file shared by worker processes on
+one machine. RedisQueue keeps it in Redis, or in any server or in-process
+stand-in that speaks the redis-py client API, for workers on several
+machines.
+"""
+import functools
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from .cache import ExtractionCache, PageCache, SQLiteStore, clean_with_cache
+from .chunking import DEFAULT_CHUNK_TOKENS
+from .crawl import extract_from_content
+from .metrics import get_metrics
+
+JOBS_PATH = os.path.join('.scraper_cache', 'jobs.sqlite3')
+TASK_KINDS = ('fetch', 'clean', 'extract')
+# Later tasks are handed out first, so pages finish (and their fetched
+# HTML leaves the queue) before more pages are fetched.
+TASK_PRIORITY = {'fetch': 0, 'clean': 1, 'extract': 2}
+LEASE_SECONDS = 120
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF_SECONDS = 5
+WORKER_POLL_SECONDS = 1.0
+# Workers seen within this many seconds count as active in job status
+WORKER_ACTIVE_SECONDS = 30
+
+
+def job_settings(parse_description=None, text_mode='blocks', chunk_tokens=DEFAULT_CHUNK_TOKENS,
+                 output_format='table', columns=None, relevance=0):
+    """Crawl settings stored with a job; without parse_description pages are only fetched and cleaned"""
+    return {'parse_description': parse_description, 'text_mode': text_mode, 'chunk_tokens': chunk_tokens,
+            'output_format': output_format, 'columns': [list(column) for column in columns] if columns else None,
+            'relevance': relevance}
+
+
+def task_id(job_id, index, kind):
+    return f"{job_id}:{index}:{kind}"
+
+
+def next_task_kind(kind, settings, output):
+    """Kind of the task that follows a finished one, or None when the page is done"""
+    if kind == 'fetch':
+        return 'clean'
+    if kind == 'clean' and settings['parse_description'] and output:
+        return 'extract'
+    return None
+
+
+def retry_delay(attempts):
+    return RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1)
+
+
+def encode_output(value):
+    return zlib.compress(json.dumps(value, ensure_ascii=False).encode('utf-8'))
+
+
+def decode_output(data):
+    return json.loads(zlib.decompress(data))
+
+
+def job_state(status):
+    if status['cancelled']:
+        return 'cancelled'
+    if status['pages_done'] + status['pages_failed'] >= status['urls']:
+        return 'done'
+    tasks = status['tasks']
+    if any(counts.get('leased') or counts.get('done') or counts.get('failed') for counts in tasks.values()):
+        return 'running'
+    return 'queued'
+
+
+def page_result(url, content, table, error):
+    """A finished page in the shape of crawl's results"""
+    return {'url': url, 'domain': (urlparse(url).hostname or '').lower(),
+            'content': content, 'table': table, 'error': error}
+
+
+def finished_pages(queue, job_id, pages):
+    """Results of the pages whose task chain ended; pages maps index -> {'url', kind: (state, error)}"""
+    for index, page in sorted(pages.items()):
+        states = {kind: page[kind][0] for kind in TASK_KINDS if kind in page}
+        failed = [page[kind][1] for kind in TASK_KINDS if states.get(kind) == 'failed']
+        if failed:
+            yield page_result(page['url'], None, None, failed[0] or 'failed')
+        elif states.get('extract') == 'done':
+            yield page_result(page['url'], queue.output(task_id(job_id, index, 'clean')),
+                              queue.output(task_id(job_id, index, 'extract')), None)
+        elif states.get('clean') == 'done' and 'extract' not in states:
+            yield page_result(page['url'], queue.output(task_id(job_id, index, 'clean')), None, None)
+
+
+class SQLiteQueue(SQLiteStore):
+    """Job queue in a SQLite file, shared by worker processes on one machine
+
+    Leasing a task is a single UPDATE, so two workers never get the same
+    task. Outputs are stored compressed, one per finished task; a page's
+    fetched HTML is dropped once it is cleaned.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY, settings TEXT NOT NULL, urls INTEGER NOT NULL,
+            pages_done INTEGER NOT NULL DEFAULT 0, pages_failed INTEGER NOT NULL DEFAULT 0,
+            cancelled INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL);
+        CREATE TABLE IF NOT EXISTS tasks (
+            id TEXT PRIMARY KEY, job_id TEXT NOT NULL, idx INTEGER NOT NULL, url TEXT NOT NULL,
+            kind TEXT NOT NULL, priority INTEGER NOT NULL, state TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0, available_at REAL NOT NULL,
+            lease TEXT, lease_expires REAL, worker TEXT, error TEXT);
+        CREATE INDEX IF NOT EXISTS tasks_ready ON tasks (state, priority, available_at);
+        CREATE INDEX IF NOT EXISTS tasks_job ON tasks (job_id, kind, state);
+        CREATE TABLE IF NOT EXISTS outputs (
+            task_id TEXT PRIMARY KEY, data BLOB NOT NULL);
+        CREATE TABLE IF NOT EXISTS workers (
+            id TEXT PRIMARY KEY, last_seen REAL NOT NULL, tasks INTEGER NOT NULL DEFAULT 0);
+    """
+
+    def __init__(self, path=JOBS_PATH, max_attempts=MAX_ATTEMPTS):
+        super().__init__(path)
+        self.max_attempts = max_attempts
+
+    def submit(self, urls, settings):
+        """Queue a fetch task per URL; returns the new job's id"""
+        job_id = uuid.uuid4().hex[:12]
+        urls = list(urls)
+        now = time.time()
+        with self.connect() as db:
+            db.execute("INSERT INTO jobs (id, settings, urls, created_at) VALUES (?, ?, ?, ?)",
+                       (job_id, json.dumps(settings), len(urls), now))
+            db.executemany("INSERT INTO tasks (id, job_id, idx, url, kind, priority, state, available_at) "
+                           "VALUES (?, ?, ?, ?, 'fetch', ?, 'queued', ?)",
+                           [(task_id(job_id, i, 'fetch'), job_id, i, url, TASK_PRIORITY['fetch'], now)
+                            for i, url in enumerate(urls)])
+        return job_id
+
+    def expire_leases(self, db, now):
+        """Queue tasks whose lease ran out again, or fail them after max_attempts"""
+        # The first statement writes, so the whole expiry runs in one transaction
+        expired = Counter(row[0] for row in db.execute(
+            "UPDATE tasks SET state = 'failed', lease = NULL, error = 'lease expired' "
+            "WHERE state = 'leased' AND lease_expires < ? AND attempts >= ? RETURNING job_id",
+            (now, self.max_attempts)).fetchall())
+        db.executemany("UPDATE jobs SET pages_failed = pages_failed + ? WHERE id = ?",
+                       [(count, job_id) for job_id, count in expired.items()])
+        db.execute("UPDATE tasks SET state = 'queued', available_at = ?, lease = NULL, error = 'lease expired' "
+                   "WHERE state = 'leased' AND lease_expires < ?", (now, now))
+
+    def lease(self, worker_id, lease_seconds=LEASE_SECONDS):
+        """Take the next ready task for lease_seconds; returns a task dict or None"""
+        now = time.time()
+        lease = uuid.uuid4().hex
+        with self.connect() as db:
+            self.expire_leases(db, now)
+            rows = db.execute(
+                "UPDATE tasks SET state = 'leased', lease = ?, lease_expires = ?, worker = ?, "
+                "attempts = attempts + 1 WHERE id = ("
+                "  SELECT id FROM tasks WHERE state = 'queued' AND available_at <= ? "
+                "  ORDER BY priority DESC, available_at LIMIT 1) "
+                "RETURNING id, job_id, idx, url, kind, attempts",
+                (lease, now + lease_seconds, worker_id, now)).fetchall()
+            row = rows[0] if rows else None
+            settings = row and db.execute("SELECT settings FROM jobs WHERE id = ?", (row[1],)).fetchone()[0]
+        if row is None:
+            return None
+        return {'id': row[0], 'job': row[1], 'index': row[2], 'url': row[3], 'kind': row[4],
+                'attempts': row[5], 'lease': lease, 'worker': worker_id, 'settings': json.loads(settings)}
+
+    def renew(self, task, lease_seconds=LEASE_SECONDS):
+        """Extend a task's lease; False when it was lost to another worker"""
+        with self.connect() as db:
+            return db.execute("UPDATE tasks SET lease_expires = ? WHERE id = ? AND lease = ? AND state = 'leased'",
+                              (time.time() + lease_seconds, task['id'], task['lease'])).rowcount == 1
+
+    def complete(self, task, output):
+        """Store a task's output and queue the page's next task; False when the lease was lost"""
+        kind = next_task_kind(task['kind'], task['settings'], output)
+        with self.connect() as db:
+            if db.execute("UPDATE tasks SET state = 'done', lease = NULL, error = NULL "
+                          "WHERE id = ? AND lease = ? AND state = 'leased'",
+                          (task['id'], task['lease'])).rowcount != 1:
+                return False
+            db.execute("INSERT OR REPLACE INTO outputs (task_id, data) VALUES (?, ?)",
+                       (task['id'], encode_output(output)))
+            if task['kind'] == 'clean':
+                db.execute("DELETE FROM outputs WHERE task_id = ?", (task_id(task['job'], task['index'], 'fetch'),))
+            if kind:
+                db.execute("INSERT OR IGNORE INTO tasks (id, job_id, idx, url, kind, priority, state, available_at) "
+                           "SELECT ?, ?, ?, ?, ?, ?, CASE WHEN cancelled THEN 'cancelled' ELSE 'queued' END, ? "
+                           "FROM jobs WHERE id = ?",
+                           (task_id(task['job'], task['index'], kind), task['job'], task['index'], task['url'],
+                            kind, TASK_PRIORITY[kind], time.time(), task['job']))
+            else:
+                db.execute("UPDATE jobs SET pages_done = pages_done + 1 WHERE id = ?", (task['job'],))
+            db.execute("UPDATE workers SET tasks = tasks + 1 WHERE id = ?", (task['worker'],))
+        return True
+
+    def fail(self, task, error):
+        """Queue a failed task again after a backoff, or mark it failed after max_attempts
+
+        Returns the task's new state, or None when the lease was lost.
+        """
+        state = 'failed' if task['attempts'] >= self.max_attempts else 'queued'
+        with self.connect() as db:
+            if db.execute("UPDATE tasks SET state = ?, available_at = ?, lease = NULL, error = ? "
+                          "WHERE id = ? AND lease = ? AND state = 'leased'",
+                          (state, time.time() + retry_delay(task['attempts']), error,
+                           task['id'], task['lease'])).rowcount != 1:
+                return None
+            if state == 'failed':
+                db.execute("UPDATE jobs SET pages_failed = pages_failed + 1 WHERE id = ?", (task['job'],))
+        return state
+
+    def output(self, task):
+        """Output of a finished task, given as a task dict or id"""
+        with self.connect() as db:
+            row = db.execute("SELECT data FROM outputs WHERE task_id = ?",
+                             (task['id'] if isinstance(task, dict) else task,)).fetchone()
+        if row is None:
+            raise LookupError(f"No stored output for task {task}")
+        return decode_output(row[0])
+
+    def cancel(self, job_id):
+        """Withdraw a job's queued tasks; leased ones finish, but the pages' next tasks are not queued"""
+        with self.connect() as db:
+            db.execute("UPDATE jobs SET cancelled = 1 WHERE id = ?", (job_id,))
+            db.execute("UPDATE tasks SET state = 'cancelled', lease = NULL WHERE job_id = ? AND state = 'queued'",
+                       (job_id,))
+
+    def resume(self, job_id):
+        """Queue a job's failed and cancelled tasks again with fresh attempts; returns how many"""
+        with self.connect() as db:
+            db.execute("UPDATE jobs SET cancelled = 0 WHERE id = ?", (job_id,))
+            failed = db.execute("SELECT COUNT(*) FROM tasks WHERE job_id = ? AND state = 'failed'",
+                                (job_id,)).fetchone()[0]
+            db.execute("UPDATE jobs SET pages_failed = pages_failed - ? WHERE id = ?", (failed, job_id))
+            return db.execute("UPDATE tasks SET state = 'queued', attempts = 0, available_at = ?, error = NULL "
+                              "WHERE job_id = ? AND state IN ('failed', 'cancelled')",
+                              (time.time(), job_id)).rowcount
+
+    def beat(self, worker_id):
+        with self.connect() as db:
+            db.execute("INSERT INTO workers (id, last_seen) VALUES (?, ?) "
+                       "ON CONFLICT (id) DO UPDATE SET last_seen = excluded.last_seen", (worker_id, time.time()))
+
+    def pending(self):
+        """Tasks queued (including those waiting out a retry backoff) or leased, over all jobs"""
+        with self.connect() as db:
+            return db.execute("SELECT COUNT(*) FROM tasks WHERE state IN ('queued', 'leased')").fetchone()[0]
+
+    def status(self, job_id):
+        """Progress of a job: pages done and failed, task counts per kind and state, and active workers"""
+        with self.connect() as db:
+            job = db.execute("SELECT settings, urls, pages_done, pages_failed, cancelled, created_at "
+                             "FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            tasks = {}
+            for kind, state, count in db.execute("SELECT kind, state, COUNT(*) FROM tasks WHERE job_id = ? "
+                                                 "GROUP BY kind, state", (job_id,)):
+                tasks.setdefault(kind, {})[state] = count
+            workers = db.execute("SELECT COUNT(*) FROM workers WHERE last_seen > ?",
+                                 (time.time() - WORKER_ACTIVE_SECONDS,)).fetchone()[0]
+        status = {'job': job_id, 'settings': json.loads(job[0]), 'urls': job[1], 'pages_done': job[2],
+                  'pages_failed': job[3], 'cancelled': bool(job[4]), 'created_at': job[5],
+                  'tasks': tasks, 'workers': workers}
+        status['state'] = job_state(status)
+        return status
+
+    def jobs(self, limit=20):
+        """Status of the most recently submitted jobs"""
+        with self.connect() as db:
+            ids = [row[0] for row in db.execute("SELECT id FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,))]
+        return [self.status(job_id) for job_id in ids]
+
+    def results(self, job_id):
+        """Yield a crawl-style result dict for each finished or failed page of a job, in URL order"""
+        with self.connect() as db:
+            pages = {}
+            for index, url, kind, state, error in db.execute(
+                    "SELECT idx, url, kind, state, error FROM tasks WHERE job_id = ? ORDER BY idx", (job_id,)):
+                pages.setdefault(index, {'url': url})[kind] = (state, error)
+        return finished_pages(self, job_id, pages)
+
+
+class RedisQueue:
+    """Job queue in Redis, for workers on several machines
+
+    client is a redis-py client or anything with its API: redis.Redis, a
+    server speaking the Redis protocol, or an in-process stand-in such as
+    fakeredis. Ready tasks sit in one sorted set per kind scored by when they
+    become available; leased tasks in a sorted set scored by lease expiry.
+    Every state change writes the task's hash, and is one MULTI/EXEC
+    transaction that WATCHes it: of two workers claiming a task only one
+    succeeds, and a worker that dies midway leaves the task as it was.
+    Changes that depend on the job's cancelled flag WATCH the job's hash
+    too, so a cancel or resume in between makes them start over.
+    """
+
+    def __init__(self, client, prefix='scraper:', max_attempts=MAX_ATTEMPTS):
+        self.client = client
+        self.prefix = prefix
+        self.max_attempts = max_attempts
+
+    def key(self, *parts):
+        return self.prefix + ':'.join(parts)
+
+    @staticmethod
+    def text(value):
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    def task_fields(self, tid, client=None):
+        """A task's hash, read with client (a watching pipeline) or the queue's client"""
+        client = self.client if client is None else client
+        return {self.text(name): self.text(value) for name, value in client.hgetall(self.key('task', tid)).items()}
+
+    def move(self, pipe, job_id, kind, old_state, new_state):
+        """Keep the per-job task counts in step with a state change"""
+        counts = self.key('counts', job_id)
+        if old_state:
+            pipe.hincrby(counts, f'{kind}:{old_state}', -1)
+        pipe.hincrby(counts, f'{kind}:{new_state}', 1)
+
+    def queue_task(self, pipe, job_id, index, url, kind, available_at, cancelled=False):
+        tid = task_id(job_id, index, kind)
+        state = 'cancelled' if cancelled else 'queued'
+        pipe.hset(self.key('task', tid), mapping={'job': job_id, 'index': index, 'url': url, 'kind': kind,
+                                                  'state': state, 'attempts': 0, 'error': ''})
+        if not cancelled:
+            pipe.zadd(self.key('ready', kind), {tid: available_at})
+        self.move(pipe, job_id, kind, None, state)
+
+    def submit(self, urls, settings):
+        job_id = uuid.uuid4().hex[:12]
+        urls = list(urls)
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.hset(self.key('job', job_id), mapping={'settings': json.dumps(settings), 'urls': len(urls),
+                                                    'pages_done': 0, 'pages_failed': 0, 'cancelled': 0,
+                                                    'created_at': now})
+        pipe.zadd(self.key('jobs'), {job_id: now})
+        for i, url in enumerate(urls):
+            self.queue_task(pipe, job_id, i, url, 'fetch', now)
+        pipe.execute()
+        return job_id
+
+    def transaction(self, change, *keys):
+        """Run change(pipe) under WATCH on keys, retried until EXEC goes through; returns its value
+
+        change reads first, then calls pipe.multi() and queues its writes,
+        or returns without writing.
+        """
+        return self.client.transaction(change, *keys, value_from_callable=True)
+
+    def expire_leases(self, now):
+        for tid in self.client.zrangebyscore(self.key('leased'), '-inf', now):
+            tid = self.text(tid)
+            self.transaction(lambda pipe: self.expire_task(pipe, tid, now), self.key('leased'),
+                             self.key('task', tid))
+
+    def expire_task(self, pipe, tid, now):
+        expires = pipe.zscore(self.key('leased'), tid)
+        if expires is None or expires > now:
+            return  # finished or renewed meanwhile
+        fields = self.task_fields(tid, pipe)
+        failed = int(fields['attempts']) >= self.max_attempts
+        pipe.multi()
+        pipe.zrem(self.key('leased'), tid)
+        pipe.hset(self.key('task', tid), mapping={'state': 'failed' if failed else 'queued', 'lease': '',
+                                                  'error': 'lease expired'})
+        if failed:
+            pipe.hincrby(self.key('job', fields['job']), 'pages_failed', 1)
+        else:
+            pipe.zadd(self.key('ready', fields['kind']), {tid: now})
+        self.move(pipe, fields['job'], fields['kind'], 'leased', 'failed' if failed else 'queued')
+
+    def lease(self, worker_id, lease_seconds=LEASE_SECONDS):
+        now = time.time()
+        self.expire_leases(now)
+        for kind in sorted(TASK_KINDS, key=TASK_PRIORITY.get, reverse=True):
+            for tid in self.client.zrangebyscore(self.key('ready', kind), '-inf', now, start=0, num=5):
+                tid = self.text(tid)
+                lease = uuid.uuid4().hex
+                fields = self.transaction(
+                    lambda pipe: self.lease_task(pipe, tid, kind, worker_id, lease, now + lease_seconds),
+                    self.key('task', tid))
+                if fields is None:
+                    continue  # claimed by another worker
+                settings = self.text(self.client.hget(self.key('job', fields['job']), 'settings'))
+                return {'id': tid, 'job': fields['job'], 'index': int(fields['index']), 'url': fields['url'],
+                        'kind': kind, 'attempts': int(fields['attempts']) + 1, 'lease': lease,
+                        'worker': worker_id, 'settings': json.loads(settings)}
+        return None
+
+    def lease_task(self, pipe, tid, kind, worker_id, lease, expires):
+        """Move a ready task to the leased set; returns its fields before the lease, or None if it is gone"""
+        if pipe.zscore(self.key('ready', kind), tid) is None:
+            return None
+        fields = self.task_fields(tid, pipe)
+        pipe.multi()
+        pipe.zrem(self.key('ready', kind), tid)
+        pipe.zadd(self.key('leased'), {tid: expires})
+        pipe.hset(self.key('task', tid), mapping={'state': 'leased', 'lease': lease, 'worker': worker_id,
+                                                  'attempts': int(fields['attempts']) + 1})
+        self.move(pipe, fields['job'], kind, 'queued', 'leased')
+        return fields
+
+    def renew(self, task, lease_seconds=LEASE_SECONDS):
+        def change(pipe):
+            if not self.holds_lease_in(pipe, task):
+                return False
+            pipe.multi()
+            pipe.zadd(self.key('leased'), {task['id']: time.time() + lease_seconds})
+            return True
+
+        return self.transaction(change, self.key('task', task['id']))
+
+    def holds_lease_in(self, pipe, task):
+        return (self.text(pipe.hget(self.key('task', task['id']), 'lease')) == task['lease']
+                and pipe.zscore(self.key('leased'), task['id']) is not None)
+
+    def complete(self, task, output):
+        kind = next_task_kind(task['kind'], task['settings'], output)
+
+        def change(pipe):
+            if not self.holds_lease_in(pipe, task):
+                return False
+            cancelled = self.cancelled(pipe, task['job'])
+            pipe.multi()
+            pipe.zrem(self.key('leased'), task['id'])
+            pipe.set(self.key('output', task['id']), encode_output(output))
+            pipe.hset(self.key('task', task['id']), mapping={'state': 'done', 'lease': '', 'error': ''})
+            self.move(pipe, task['job'], task['kind'], 'leased', 'done')
+            if task['kind'] == 'clean':
+                pipe.delete(self.key('output', task_id(task['job'], task['index'], 'fetch')))
+            if kind:
+                self.queue_task(pipe, task['job'], task['index'], task['url'], kind, time.time(), cancelled)
+            else:
+                pipe.hincrby(self.key('job', task['job']), 'pages_done', 1)
+            pipe.hincrby(self.key('worker_tasks'), task['worker'], 1)
+            return True
+
+        return self.transaction(change, self.key('task', task['id']), self.key('job', task['job']))
+
+    def fail(self, task, error):
+        state = 'failed' if task['attempts'] >= self.max_attempts else 'queued'
+
+        def change(pipe):
+            if not self.holds_lease_in(pipe, task):
+                return None
+            pipe.multi()
+            pipe.zrem(self.key('leased'), task['id'])
+            pipe.hset(self.key('task', task['id']), mapping={'state': state, 'lease': '', 'error': error})
+            if state == 'queued':
+                pipe.zadd(self.key('ready', task['kind']), {task['id']: time.time() + retry_delay(task['attempts'])})
+            else:
+                pipe.hincrby(self.key('job', task['job']), 'pages_failed', 1)
+            self.move(pipe, task['job'], task['kind'], 'leased', state)
+            return state
+
+        return self.transaction(change, self.key('task', task['id']))
+
+    def output(self, task):
+        tid = task['id'] if isinstance(task, dict) else task
+        data = self.client.get(self.key('output', tid))
+        if data is None:
+            raise LookupError(f"No stored output for task {tid}")
+        return decode_output(data)
+
+    def job_tasks(self, job_id):
+        urls = int(self.client.hget(self.key('job', job_id), 'urls'))
+        for index in range(urls):
+            for kind in TASK_KINDS:
+                fields = self.task_fields(task_id(job_id, index, kind))
+                if fields:
+                    yield index, kind, fields
+
+    def cancelled(self, pipe, job_id):
+        return self.text(pipe.hget(self.key('job', job_id), 'cancelled')) == '1'
+
+    def cancel(self, job_id):
+        self.client.hset(self.key('job', job_id), 'cancelled', 1)
+        for index, kind, fields in self.job_tasks(job_id):
+            tid = task_id(job_id, index, kind)
+            if fields['state'] == 'queued':
+                self.transaction(lambda pipe: self.cancel_task(pipe, job_id, tid, kind),
+                                 self.key('job', job_id), self.key('task', tid))
+
+    def cancel_task(self, pipe, job_id, tid, kind):
+        if not self.cancelled(pipe, job_id) or pipe.zscore(self.key('ready', kind), tid) is None:
+            return  # resumed or leased meanwhile
+        pipe.multi()
+        pipe.zrem(self.key('ready', kind), tid)
+        pipe.hset(self.key('task', tid), 'state', 'cancelled')
+        self.move(pipe, job_id, kind, 'queued', 'cancelled')
+
+    def resume(self, job_id):
+        resumed = 0
+        now = time.time()
+        self.client.hset(self.key('job', job_id), 'cancelled', 0)
+        for index, kind, fields in self.job_tasks(job_id):
+            if fields['state'] not in ('failed', 'cancelled'):
+                continue
+            tid = task_id(job_id, index, kind)
+            resumed += self.transaction(lambda pipe: self.resume_task(pipe, job_id, tid, kind, now),
+                                        self.key('job', job_id), self.key('task', tid))
+        return resumed
+
+    def resume_task(self, pipe, job_id, tid, kind, now):
+        """Queue a failed or cancelled task again; returns whether it was"""
+        state = self.task_fields(tid, pipe)['state']
+        if self.cancelled(pipe, job_id) or state not in ('failed', 'cancelled'):
+            return False  # cancelled again, or resumed meanwhile
+        pipe.multi()
+        pipe.hset(self.key('task', tid), mapping={'state': 'queued', 'attempts': 0, 'error': ''})
+        pipe.zadd(self.key('ready', kind), {tid: now})
+        if state == 'failed':
+            pipe.hincrby(self.key('job', job_id), 'pages_failed', -1)
+        self.move(pipe, job_id, kind, state, 'queued')
+        return True
+
+    def beat(self, worker_id):
+        self.client.zadd(self.key('workers'), {worker_id: time.time()})
+
+    def pending(self):
+        return (sum(self.client.zcard(self.key('ready', kind)) for kind in TASK_KINDS)
+                + self.client.zcard(self.key('leased')))
+
+    def status(self, job_id):
+        job = {self.text(name): self.text(value) for name, value in self.client.hgetall(self.key('job', job_id)).items()}
+        if not job:
+            return None
+        tasks = {}
+        for name, count in self.client.hgetall(self.key('counts', job_id)).items():
+            kind, state = self.text(name).split(':')
+            if int(count):
+                tasks.setdefault(kind, {})[state] = int(count)
+        workers = self.client.zcount(self.key('workers'), time.time() - WORKER_ACTIVE_SECONDS, '+inf')
+        status = {'job': job_id, 'settings': json.loads(job['settings']), 'urls': int(job['urls']),
+                  'pages_done': int(job['pages_done']), 'pages_failed': int(job['pages_failed']),
+                  'cancelled': job['cancelled'] == '1', 'created_at': float(job['created_at']),
+                  'tasks': tasks, 'workers': workers}
+        status['state'] = job_state(status)
+        return status
+
+    def jobs(self, limit=20):
+        return [self.status(self.text(job_id)) for job_id in self.client.zrevrange(self.key('jobs'), 0, limit - 1)]
+
+    def results(self, job_id):
+        pages = {}
+        for index, kind, fields in self.job_tasks(job_id):
+            pages.setdefault(index, {'url': fields['url']})[kind] = (fields['state'], fields['error'])
+        return finished_pages(self, job_id, pages)
+
+
+@contextmanager
+def keep_leased(queue, task, lease_seconds=LEASE_SECONDS):
+    """Renew a task's lease in the background while the block runs, so long extractions keep it"""
+    stop = threading.Event()
+
+    def renew():
+        while not stop.wait(lease_seconds / 3):
+            if not queue.renew(task, lease_seconds):
+                return
+
+    thread = threading.Thread(target=renew, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_task(queue, task, fetch, page_cache=None, extraction_cache=None):
+    """Run one task and return its output; the inputs are the outputs of the page's earlier tasks"""
+    settings = task['settings']
+    if task['kind'] == 'fetch':
+        return fetch(task['url'])
+    if task['kind'] == 'clean':
+        html = queue.output(task_id(task['job'], task['index'], 'fetch'))
+        return clean_with_cache(html, settings['text_mode'], cache=page_cache)
+    content = queue.output(task_id(task['job'], task['index'], 'clean'))
+    columns = [tuple(column) for column in settings['columns']] if settings['columns'] else None
+    return extract_from_content(content, settings['parse_description'], settings['chunk_tokens'],
+                                extraction_cache, settings['output_format'], columns, settings['relevance'])
+
+
+def run_worker(queue, worker_id=None, fetch=None, use_cache=True, lease_seconds=LEASE_SECONDS,
+               poll_seconds=WORKER_POLL_SECONDS, exit_when_idle=False, max_tasks=None):
+    """Lease and run tasks until stopped; returns the number of tasks completed
+
+    Workers keep no state of their own, so any number can share a queue and
+    one can be killed at any time. Pages are fetched with a TieredFetcher
+    unless a fetch(url) -> html callable is given. With exit_when_idle the
+    worker stops once no task is queued or leased anywhere in the queue.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    page_cache = PageCache() if use_cache else None
+    extraction_cache = ExtractionCache() if use_cache else None
+    if fetch is None:
+        from .fetch import TieredFetcher
+
+        fetch = TieredFetcher(cache=page_cache).fetch
+    metrics = get_metrics()
+    completed = 0
+    while max_tasks is None or completed < max_tasks:
+        queue.beat(worker_id)
+        task = queue.lease(worker_id, lease_seconds)
+        if task is None:
+            if exit_when_idle and not queue.pending():
+                break
+            time.sleep(poll_seconds)
+            continue
+        try:
+            with keep_leased(queue, task, lease_seconds):
+                output = run_task(queue, task, fetch, page_cache, extraction_cache)
+        except Exception as e:
+            state = queue.fail(task, str(e) or type(e).__name__)
+            print(f"{task['kind']} {task['url']} failed (attempt {task['attempts']}): {str(e)}")
+            metrics.increment('job_tasks_total', kind=task['kind'], outcome='retried' if state == 'queued' else
+                              'failed' if state == 'failed' else 'lease_lost')
+            continue
+        ok = queue.complete(task, output)
+        metrics.increment('job_tasks_total', kind=task['kind'], outcome='ok' if ok else 'lease_lost')
+        completed += ok
+    return completed
+
+
+def open_queue(spec=None):
+    """A SQLiteQueue for a file path (default JOBS_PATH), or a RedisQueue for a redis:// URL"""
+    if spec and spec.startswith(('redis://', 'rediss://', 'unix://')):
+        import redis
+
+        return RedisQueue(redis.Redis.from_url(spec))
+    return SQLiteQueue(spec or JOBS_PATH)
+
+
+def worker_main(spec, worker_options):
+    """Entry point of a worker process started by start_workers"""
+    try:
+        run_worker(open_queue(spec), **worker_options)
+    except KeyboardInterrupt:
+        pass
+
+
+def start_workers(count, spec=None, **worker_options):
+    """Start count worker processes on the queue at spec (see open_queue); returns the processes"""
+    processes = [multiprocessing.Process(target=worker_main, args=(spec, worker_options), daemon=True)
+                 for _ in range(count)]
+    for process in processes:
+        process.start()
+    return processes
+
+
+@functools.cache
+def get_job_queue():
+    """Job queue shared by everything in this process, at $SCRAPER_QUEUE or JOBS_PATH"""
+    return open_queue(os.environ.get('SCRAPER_QUEUE'))
@@ -0,0 +1,538 @@
+"""LLM extraction: prompts, response parsing and the async extraction engine
+
+LangChain and the chat model are loaded on the first extraction call.
+"""
+import asyncio
+import contextvars
+import functools
+import itertools
+import json
+import random
+import re
+import time
+
+from .chunking import count_tokens
+from .metrics import get_metrics
+
+GROQ_API_KEY = ''
+MODEL_NAME = "llama3-8b-8192"
+MODEL_CONTEXT_TOKENS = 8192
+LLM_OUTPUT_RESERVE_TOKENS = 2048
+
+# Bump EXTRACTION_PROMPT_VERSION whenever the template changes, so cached
+# chunk results from the old prompt are not reused.
+EXTRACTION_PROMPT_VERSION = 1
+EXTRACTION_PROMPT_TEMPLATE = """
+You are a web scraping assistant. Based on the text content provided and the user's extraction request,
+please extract and organize the information in a clean table format.
+
+Content to analyze: {dom_content}
+
+Extraction request: {parse_description}
+
+Rules:
+1. Format the output as a SINGLE clean markdown table
+2. Use clear, concise column headers
+3. Each row must contain related information
+4. Remove duplicates and irrelevant information
+5. Ensure consistent column alignment
+6. Follow this exact format:
+   | Header1 | Header2 | Header3 |
+   |---------|---------|---------|
+   | Data1   | Data2   | Data3   |
+
+Important: 
+- Output ONLY the markdown table
+- Do not include any explanatory text
+- Do not create multiple separate tables
+- Ensure all table rows have the same number of columns
+- Use proper markdown table syntax with aligned separators
+"""
+
+
+@functools.cache
+def get_model():
+    """Chat model used for extraction, built on first use"""
+    from langchain_groq import ChatGroq
+
+    return ChatGroq(
+        api_key=GROQ_API_KEY,
+        model=MODEL_NAME,
+    )
+
+
+def build_chain(template, schema=None):
+    """Prompt | model chain; with a JSON schema the model answers through tool calling
+
+    Structured output keeps the raw message (include_raw) so its token usage
+    can be read.
+    """
+    from langchain_core.prompts import ChatPromptTemplate
+
+    model = get_model()
+    if schema is not None:
+        model = model.with_structured_output(schema, method='function_calling', include_raw=True)
+    return ChatPromptTemplate.from_template(template) | model
+
+
+# Token usage the provider reported for the last call made in this context, as
+# (prompt, completion). The parse functions set it; a call that reports none
+# (or a stand-in llm_call) leaves it None and the counts are estimated.
+llm_usage = contextvars.ContextVar('llm_usage', default=None)
+
+
+def response_usage(response):
+    """(prompt, completion) tokens reported in a chat model message's metadata, or None"""
+    usage = getattr(response, 'usage_metadata', None)
+    if usage:
+        return usage.get('input_tokens', 0), usage.get('output_tokens', 0)
+    token_usage = (getattr(response, 'response_metadata', None) or {}).get('token_usage')
+    if token_usage:
+        return token_usage.get('prompt_tokens', 0), token_usage.get('completion_tokens', 0)
+    return None
+
+
+def structured_output(response):
+    """The parsed tool-call arguments of a structured-output response, recording its usage"""
+    if isinstance(response, dict) and 'raw' in response:
+        llm_usage.set(response_usage(response['raw']))
+        return response.get('parsed')
+    return response
+
+
+def max_chunk_tokens():
+    """Largest chunk that fits in the context next to the prompt and the answer"""
+    return MODEL_CONTEXT_TOKENS - count_tokens(EXTRACTION_PROMPT_TEMPLATE) - LLM_OUTPUT_RESERVE_TOKENS
+
+
+def parse_llm_response(response):
+    """Pull the markdown table out of a chat model response"""
+    # Extract just the table content
+    result = str(response).strip()
+
+    # Clean up the response
+    if "content=" in result:
+        start = result.find("content=") + len("content=")
+        end = result.find("additional_kwargs", start)
+        if start != -1 and end != -1:
+            table_content = result[start:end].strip().strip('"').replace("\\n", "\n")
+
+            # Clean up any remaining quotes or escape characters
+            table_content = re.sub(r'[\'"]', '', table_content)
+            table_content = re.sub(r'\\+', '', table_content)
+
+            # Ensure proper table formatting
+            lines = table_content.split('\n')
+            cleaned_lines = []
+            for line in lines:
+                if '|' in line:
+                    # Ensure proper spacing in table cells
+                    cells = [cell.strip() for cell in line.split('|')]
+                    cleaned_line = '| ' + ' | '.join(cells[1:-1]) + ' |'
+                    cleaned_lines.append(cleaned_line)
+
+            return '\n'.join(cleaned_lines)
+
+    return None
+
+
+def parse_with_llm(content, parse_description):
+    """Parse content using LLM with improved prompt and response handling"""
+    chain = build_chain(EXTRACTION_PROMPT_TEMPLATE)
+
+    try:
+        response = chain.invoke({
+            "dom_content": content,
+            "parse_description": parse_description
+        })
+        llm_usage.set(response_usage(response))
+        return parse_llm_response(response)
+    except Exception as e:
+        print(f"Error in LLM parsing: {str(e)}")
+        return None
+
+
+async def aparse_with_llm(content, parse_description):
+    """Async parse_with_llm; errors propagate so the caller can retry or back off"""
+    chain = build_chain(EXTRACTION_PROMPT_TEMPLATE)
+
+    response = await chain.ainvoke({
+        "dom_content": content,
+        "parse_description": parse_description
+    })
+    llm_usage.set(response_usage(response))
+    return parse_llm_response(response)
+
+
+# Output formats: 'table' asks for a markdown table, 'json' has the model
+# return schema-constrained rows through tool calling.
+OUTPUT_FORMATS = ('table', 'json')
+COLUMN_TYPES = ('string', 'number', 'integer', 'boolean')
+EXTRACTION_JSON_PROMPT_TEMPLATE = """
+You are a web scraping assistant. Based on the text content provided and the user's extraction request,
+extract every matching record by calling the extracted_rows function.
+
+Content to analyze: {dom_content}
+
+Extraction request: {parse_description}
+
+Columns: {columns}
+
+Rules:
+1. One row per record, with the same keys in every row
+2. Copy values as they appear in the content; use null when a value is missing
+3. Remove duplicates and irrelevant information
+4. Return an empty rows list if nothing matches
+"""
+NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+
+
+def parse_columns(spec):
+    """Parse 'name, price:number, in_stock:boolean' into [(name, type), ...]"""
+    columns = []
+    for item in (spec or '').split(','):
+        name, _, column_type = item.partition(':')
+        name, column_type = name.strip(), column_type.strip().lower() or 'string'
+        if not name:
+            continue
+        if column_type not in COLUMN_TYPES:
+            raise ValueError(f"Unknown column type {column_type!r} for {name!r}; use one of {', '.join(COLUMN_TYPES)}")
+        columns.append((name, column_type))
+    return columns or None
+
+
+def row_schema(columns=None):
+    """JSON schema for the extracted_rows tool; free-form rows when no columns are given"""
+    if columns:
+        row = {'type': 'object',
+               'properties': {name: {'type': [column_type, 'null']} for name, column_type in columns},
+               'required': [name for name, _ in columns]}
+    else:
+        row = {'type': 'object', 'additionalProperties': {'type': ['string', 'number', 'boolean', 'null']}}
+    return {'title': 'extracted_rows',
+            'description': "Records extracted from the page content, one object per row",
+            'type': 'object',
+            'properties': {'rows': {'type': 'array', 'items': row}},
+            'required': ['rows']}
+
+
+def coerce_value(value, column_type):
+    """Convert a cell to its declared type, or None when it does not fit"""
+    if value is None or column_type == 'string':
+        return value if value is None or isinstance(value, str) else str(value)
+    if column_type == 'boolean':
+        if isinstance(value, bool):
+            return value
+        return {'true': True, 'yes': True, 'false': False, 'no': False}.get(str(value).strip().lower())
+    if isinstance(value, bool):
+        return None
+    if not isinstance(value, (int, float)):
+        match = NUMBER_RE.search(str(value).replace(',', ''))
+        if not match:
+            return None
+        value = float(match.group())
+    return int(value) if column_type == 'integer' else value
+
+
+def parse_json_rows(result, columns=None):
+    """Turn a structured-output result into a JSON list of rows, or None if it has none"""
+    if isinstance(result, str):
+        try:
+            result = json.loads(result)
+        except ValueError:
+            return None
+    rows = result.get('rows') if isinstance(result, dict) else result
+    if not isinstance(rows, list):
+        return None
+
+    parsed = []
+    for row in rows:
+        if not isinstance(row, dict):
+            continue
+        if columns:
+            row = {name: coerce_value(row.get(name), column_type) for name, column_type in columns}
+        if any(value not in (None, '') for value in row.values()):
+            parsed.append(row)
+    return json.dumps(parsed, ensure_ascii=False)
+
+
+def json_extraction_inputs(content, parse_description, columns):
+    return {
+        "dom_content": content,
+        "parse_description": parse_description,
+        "columns": ', '.join(f"{name} ({column_type})" for name, column_type in columns)
+                   if columns else "short snake_case keys that fit the request",
+    }
+
+
+def parse_json_with_llm(content, parse_description, columns=None):
+    """Extract rows as schema-constrained JSON through tool calling"""
+    chain = build_chain(EXTRACTION_JSON_PROMPT_TEMPLATE, row_schema(columns))
+    try:
+        response = chain.invoke(json_extraction_inputs(content, parse_description, columns))
+        return parse_json_rows(structured_output(response), columns)
+    except Exception as e:
+        print(f"Error in LLM parsing: {str(e)}")
+        return None
+
+
+async def aparse_json_with_llm(content, parse_description, columns=None):
+    """Async parse_json_with_llm; errors propagate so the caller can retry or back off"""
+    chain = build_chain(EXTRACTION_JSON_PROMPT_TEMPLATE, row_schema(columns))
+    response = await chain.ainvoke(json_extraction_inputs(content, parse_description, columns))
+    return parse_json_rows(structured_output(response), columns)
+
+
+def extraction_variant(output_format='table', columns=None):
+    """Cache-key suffix for an output format; None for the markdown table format"""
+    if output_format == 'table':
+        return None
+    return json.dumps([output_format, columns or []])
+
+
+def extraction_prompt_tokens(chunk, parse_description, output_format='table'):
+    """Prompt tokens of one extraction call, counted with the chunking tokenizer"""
+    template = EXTRACTION_JSON_PROMPT_TEMPLATE if output_format == 'json' else EXTRACTION_PROMPT_TEMPLATE
+    return count_tokens(template + chunk + parse_description)
+
+
+def record_llm_call(seconds, prompt_tokens, result, error=None, usage=None):
+    """Add one LLM call's latency, outcome and token counts to the metrics
+
+    Token counts come from the provider's usage when given, else prompt_tokens
+    and a count of the result.
+    """
+    metrics = get_metrics()
+    metrics.observe_stage('llm_call', seconds)
+    if error is not None:
+        outcome = 'rate_limited' if is_rate_limit_error(error) else 'error'
+    else:
+        outcome = 'ok' if result else 'no_result'
+    metrics.increment('llm_calls_total', outcome=outcome)
+    if usage is not None:
+        prompt_tokens, completion_tokens = usage
+    else:
+        completion_tokens = count_tokens(result) if result else 0
+    metrics.increment('llm_tokens_total', prompt_tokens, kind='prompt')
+    if completion_tokens:
+        metrics.increment('llm_tokens_total', completion_tokens, kind='completion')
+
+
+def process_chunk(chunk, parse_description, cache=None, output_format='table', columns=None):
+    """Process a single chunk with the LLM, reusing cached results when a cache is given"""
+    if output_format == 'json':
+        call = lambda: parse_json_with_llm(chunk, parse_description, columns)
+    else:
+        call = lambda: parse_with_llm(chunk, parse_description)
+
+    def parse():
+        llm_usage.set(None)
+        start = time.perf_counter()
+        result = call()
+        record_llm_call(time.perf_counter() - start, extraction_prompt_tokens(chunk, parse_description, output_format),
+                        result, usage=llm_usage.get())
+        return result
+
+    if cache is None:
+        return parse()
+
+    variant = extraction_variant(output_format, columns)
+    result = cache.get(chunk, parse_description, variant)
+    if result is None:
+        result = parse()
+        if result:
+            cache.put(chunk, parse_description, result, variant)
+    return result
+
+
+# Async extraction engine defaults. Groq's free tier allows roughly 30k
+# tokens per minute for llama3-8b-8192.
+LLM_MAX_CONCURRENCY = 8
+LLM_TOKENS_PER_MINUTE = 30000
+LLM_MAX_RETRIES = 4
+LLM_BACKOFF_BASE_SECONDS = 1.0
+LLM_BACKOFF_MAX_SECONDS = 30.0
+LLM_EXPECTED_OUTPUT_TOKENS = 500
+
+
+def is_rate_limit_error(error):
+    """Check whether an LLM error is a 429 / rate-limit response"""
+    status = getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+    return status == 429 or 'rate limit' in str(error).lower() or 'rate_limit' in str(error).lower()
+
+
+class AIMDLimiter:
+    """Concurrency limit that grows additively while calls succeed and halves on rate limits
+
+    The limit rises by one after a full window of successes (as many as the
+    current limit). Only a call started under the current limit can halve it,
+    so a burst of 429s from calls already in flight counts once.
+    """
+
+    def __init__(self, initial=2, minimum=1, maximum=LLM_MAX_CONCURRENCY):
+        self.limit = min(initial, maximum)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.successes = 0
+        self.epoch = 0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self):
+        """Wait for a free slot; returns the epoch to pass back to release()"""
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+            return self.epoch
+
+    async def release(self, epoch, rate_limited=False):
+        async with self.condition:
+            self.in_flight -= 1
+            if rate_limited:
+                if epoch == self.epoch:
+                    self.limit = max(self.minimum, self.limit // 2)
+                    self.successes = 0
+                    self.epoch += 1
+            else:
+                self.successes += 1
+                if self.successes >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self.successes = 0
+            self.condition.notify_all()
+
+
+class TokenBudget:
+    """Token bucket holding LLM spend to tokens_per_minute
+
+    A call is charged an estimate up front (spend) and settled against the
+    usage the provider reports once it returns (settle).
+    """
+
+    def __init__(self, tokens_per_minute=LLM_TOKENS_PER_MINUTE):
+        self.capacity = tokens_per_minute
+        self.rate = tokens_per_minute / 60.0
+        self.available = float(tokens_per_minute)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def spend(self, tokens):
+        """Wait until tokens are available and take them; returns the tokens charged"""
+        # A single request larger than the bucket may still go through once it is full
+        tokens = min(tokens, self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.available >= tokens:
+                    self.available -= tokens
+                    return tokens
+                await asyncio.sleep((tokens - self.available) / self.rate)
+
+    def settle(self, charged, used):
+        """Replace an estimated charge with the tokens a call really used
+
+        Overspend leaves the bucket below zero, so later calls wait it off.
+        """
+        self.available = min(self.capacity, self.available + charged - used)
+
+
+async def extract_chunk_async(index, chunk, parse_description, llm_call, limiter, budget, cache, max_retries,
+                              variant=None):
+    """Extract one chunk with retries and jittered exponential backoff; returns (index, table)"""
+    if cache is not None:
+        cached = cache.get(chunk, parse_description, variant)
+        if cached is not None:
+            return index, cached
+
+    prompt_tokens = extraction_prompt_tokens(chunk, parse_description, 'table' if variant is None else 'json')
+    metrics = get_metrics()
+    for attempt in range(max_retries + 1):
+        with metrics.timer('llm_queue'):
+            charged = await budget.spend(prompt_tokens + LLM_EXPECTED_OUTPUT_TOKENS)
+            epoch = await limiter.acquire()
+        rate_limited = False
+        start = time.perf_counter()
+        try:
+            llm_usage.set(None)
+            table = await llm_call(chunk, parse_description)
+            usage = llm_usage.get()
+            if usage is not None:
+                budget.settle(charged, sum(usage))
+            record_llm_call(time.perf_counter() - start, prompt_tokens, table, usage=usage)
+            if table and cache is not None:
+                cache.put(chunk, parse_description, table, variant)
+            return index, table
+        except Exception as e:
+            record_llm_call(time.perf_counter() - start, prompt_tokens, None, e)
+            rate_limited = is_rate_limit_error(e)
+            if attempt == max_retries:
+                print(f"Error in LLM parsing after {attempt + 1} attempts: {str(e)}")
+                return index, None
+        finally:
+            await limiter.release(epoch, rate_limited)
+
+        delay = min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** attempt)
+        await asyncio.sleep(random.uniform(delay / 2, delay))
+
+
+def default_llm_call(output_format='table', columns=None):
+    """The async (chunk, parse_description) -> result call for an output format"""
+    if output_format == 'json':
+        return lambda chunk, description: aparse_json_with_llm(chunk, description, columns)
+    return aparse_with_llm
+
+
+async def extract_chunks_async(chunks, parse_description, llm_call=None, cache=None,
+                               max_concurrency=LLM_MAX_CONCURRENCY,
+                               tokens_per_minute=LLM_TOKENS_PER_MINUTE, max_retries=LLM_MAX_RETRIES,
+                               output_format='table', columns=None):
+    """Extract every chunk concurrently, yielding (index, table) as each one completes
+
+    llm_call is an async (chunk, parse_description) -> table function and
+    defaults to aparse_with_llm, or aparse_json_with_llm for the 'json'
+    output format, whose results are JSON row lists. Concurrency adapts
+    between 1 and max_concurrency (AIMD on rate-limit errors) and total
+    spend is held to tokens_per_minute. chunks may be any iterable: only
+    2 x max_concurrency chunks are taken ahead of the finished ones, so a
+    generator is read as extraction proceeds.
+    """
+    if llm_call is None:
+        llm_call = default_llm_call(output_format, columns)
+    variant = extraction_variant(output_format, columns)
+    limiter = AIMDLimiter(maximum=max_concurrency)
+    budget = TokenBudget(tokens_per_minute)
+    chunks = enumerate(chunks)
+    window = 2 * max_concurrency
+    pending = set()
+    try:
+        while True:
+            for index, chunk in itertools.islice(chunks, window - len(pending)):
+                pending.add(asyncio.ensure_future(extract_chunk_async(index, chunk, parse_description, llm_call,
+                                                                      limiter, budget, cache, max_retries,
+                                                                      variant)))
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        # Cancel chunks still in flight when the consumer stops early
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+def extract_chunks(chunks, parse_description, **kwargs):
+    """Synchronous wrapper around extract_chunks_async, for Streamlit and worker threads"""
+    loop = asyncio.new_event_loop()
+    results = extract_chunks_async(chunks, parse_description, **kwargs)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(results.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(results.aclose())
+        loop.close()
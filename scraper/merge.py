@@ -0,0 +1,220 @@
+"""Merging per-chunk extraction results into one deduplicated table
+
+pandas is only imported to build DataFrames.
+"""
+import json
+import re
+from difflib import SequenceMatcher
+
+from .metrics import get_metrics
+
+# Row merging. Columns are aligned by normalized header name and rows are
+# deduplicated on normalized values. With fuzzy_similarity > 0, a row that
+# matches a kept row on every column but one, and whose remaining text value
+# is at least that similar (difflib ratio, same digits), is dropped too.
+ROW_FUZZY_SIMILARITY = 0.9
+SEPARATOR_ROW_RE = re.compile(r'^\|?[\s:|-]*-{2,}[\s:|-]*$')
+NON_ALNUM_RE = re.compile(r'[^0-9a-z]+')
+DIGITS_RE = re.compile(r'\d+')
+
+
+def normalize_column(name):
+    """Header key used to line up columns: 'Product  Name' and 'product_name' match"""
+    return NON_ALNUM_RE.sub('_', str(name).casefold()).strip('_')
+
+
+def normalize_cell(value):
+    """Value key used for deduplication: case, whitespace and int/float differences are ignored
+
+    Booleans become the text 'true' / 'false', so they never equal the numbers 1 and 0.
+    """
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    return ' '.join(str(value).casefold().split())
+
+
+def near_match_ratio(value, other):
+    """Similarity of two normalized text cells, or 0 when they are not both text or their digits differ"""
+    if not (isinstance(value, str) and isinstance(other, str)) or \
+            DIGITS_RE.findall(value) != DIGITS_RE.findall(other):
+        return 0
+    return SequenceMatcher(None, value, other).ratio()
+
+
+def markdown_rows(table):
+    """Parse a markdown table into row dicts keyed by its header cells
+
+    Separator lines are skipped wherever they appear, short rows are padded
+    with None and rows with more cells than the header are dropped.
+    """
+    header = None
+    rows = []
+    for line in table.split('\n'):
+        line = line.strip()
+        if '|' not in line or SEPARATOR_ROW_RE.match(line):
+            continue
+        cells = [cell.strip() for cell in line.strip('|').split('|')]
+        if header is None:
+            header = cells
+        elif len(cells) <= len(header):
+            rows.append({name: cell or None for name, cell in zip(header, cells)})
+    return rows
+
+
+class RowMerger:
+    """Merge chunk results into one columnar table, removing duplicate rows
+
+    Results are JSON row lists (see parse_json_rows) or lists of row dicts.
+    Columns are matched by normalize_column and keep the name and position
+    they were first seen with; values are stored per column, so memory grows
+    with the number of cells rather than with per-row objects. Dedup keys
+    (normalized value tuples) are kept whole, so two rows are only merged
+    when their keys are equal, never on a hash collision. Fuzzy matching
+    looks rows up by each of their "all columns but one" keys, so it stays
+    linear in the row count.
+    """
+
+    def __init__(self, fuzzy_similarity=0):
+        self.fuzzy_similarity = fuzzy_similarity
+        self.names = {}
+        self.data = {}
+        self.length = 0
+        self.seen_rows = set()
+        self.fuzzy_index = {}
+        self.duplicates = 0
+        self.near_duplicates = 0
+
+    def __len__(self):
+        return self.length
+
+    def parse(self, result):
+        return json.loads(result)
+
+    def add(self, result):
+        """Merge one chunk's result; returns the number of new rows"""
+        if not result:
+            return 0
+        with get_metrics().timer('merge'):
+            return self.add_rows(result if isinstance(result, list) else self.parse(result))
+
+    def add_rows(self, rows):
+        added = 0
+        for row in rows:
+            cells = {}
+            for name, value in row.items():
+                key = normalize_column(name)
+                if key and value not in (None, ''):
+                    cells.setdefault(key, value)
+                    if key not in self.names:
+                        self.names[key] = name
+                        self.data[key] = [None] * self.length
+            if not cells or self.is_duplicate(cells):
+                continue
+            for key, column in self.data.items():
+                column.append(cells.get(key))
+            self.length += 1
+            added += 1
+        return added
+
+    def is_duplicate(self, cells):
+        """Check a row against the kept rows, remembering it when it is new"""
+        key = tuple(sorted((name, normalize_cell(value)) for name, value in cells.items()))
+        if key in self.seen_rows:
+            self.duplicates += 1
+            return True
+
+        masked = []
+        if self.fuzzy_similarity and len(key) > 1:
+            for i, (name, value) in enumerate(key):
+                masked.append(key[:i] + ((name, None),) + key[i + 1:])
+                for row in self.fuzzy_index.get(masked[-1], ()):
+                    if near_match_ratio(value, normalize_cell(self.data[name][row])) >= self.fuzzy_similarity:
+                        self.near_duplicates += 1
+                        return True
+
+        self.seen_rows.add(key)
+        for masked_key in masked:
+            self.fuzzy_index.setdefault(masked_key, []).append(self.length)
+        return False
+
+    @property
+    def columns(self):
+        return list(self.names.values())
+
+    def iter_records(self, start=0):
+        """Rows from index start on, as dicts of their filled cells"""
+        for i in range(start, self.length):
+            yield {self.names[key]: column[i] for key, column in self.data.items() if column[i] is not None}
+
+    def to_records(self):
+        return [{self.names[key]: self.data[key][i] for key in self.data} for i in range(self.length)]
+
+    def to_dataframe(self):
+        import pandas as pd
+
+        return pd.DataFrame({self.names[key]: column for key, column in self.data.items()},
+                            columns=self.columns)
+
+
+class TableMerger(RowMerger):
+    """RowMerger for markdown table results (see markdown_rows)"""
+
+    def parse(self, result):
+        return markdown_rows(result)
+
+    def to_markdown(self):
+        if not self.names:
+            return None
+        keys = list(self.data)
+        lines = ['| ' + ' | '.join(self.names[key] for key in keys) + ' |',
+                 '|' + '|'.join('---' for _ in keys) + '|']
+        for i in range(self.length):
+            lines.append('| ' + ' | '.join('' if self.data[key][i] is None else str(self.data[key][i])
+                                           for key in keys) + ' |')
+        return '\n'.join(lines)
+
+
+def merge_tables(tables, fuzzy_similarity=0):
+    """Merge multiple tables while removing duplicates"""
+    merger = TableMerger(fuzzy_similarity)
+    for table in tables or []:
+        merger.add(table)
+    return merger.to_markdown()
+
+
+def markdown_table_to_df(markdown_table):
+    """Convert markdown table to pandas DataFrame with improved error handling"""
+    import pandas as pd
+
+    try:
+        if not markdown_table or '|' not in markdown_table:
+            return None
+
+        # Split the table into lines
+        lines = markdown_table.strip().split('\n')
+        lines = [line for line in lines if line.strip()]
+
+        if len(lines) < 2:
+            return None
+
+        # Extract headers
+        headers = [col.strip() for col in lines[0].split('|')[1:-1]]
+
+        # Skip the separator line
+        data_lines = lines[2:]
+
+        # Parse data rows
+        data = []
+        for line in data_lines:
+            row = [cell.strip() for cell in line.split('|')[1:-1]]
+            if len(row) == len(headers):  # Only include rows that match header count
+                data.append(row)
+
+        return pd.DataFrame(data, columns=headers)
+    except Exception as e:
+        print(f"Error converting to DataFrame: {str(e)}")
+        return None
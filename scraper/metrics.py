@@ -0,0 +1,172 @@
+"""Per-stage timings and counters for the pipeline, exportable as Prometheus text or JSON lines"""
+import functools
+import json
+import math
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+METRICS_PREFIX = 'scraper'
+# Recent samples kept per timing series for the percentiles
+METRICS_SAMPLE_SIZE = 1000
+METRIC_HELP = {
+    'stage_seconds': "Wall-clock seconds spent per pipeline stage",
+    'pages_total': "Pages fetched and cleaned, by outcome",
+    'fetches_total': "Page fetches, by the tier that served them",
+    'llm_calls_total': "LLM calls, by outcome",
+    'llm_tokens_total': "LLM tokens by kind, as reported by the provider or else counted with the chunking tokenizer",
+    'llm_calls_avoided_total': "LLM calls skipped because incremental extraction reused a chunk's rows",
+    'llm_tokens_avoided_total': "Prompt tokens of the LLM calls skipped by incremental extraction",
+    'template_pages_total': "Pages offered to a learned extraction template, by outcome",
+    'templates_learned_total': "Extraction templates induced from LLM rows, by whether they were stored",
+    'job_tasks_total': "Job queue tasks run by workers, by kind and outcome",
+    'export_rows_total': "Rows appended to export files, by format",
+}
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Timing:
+    """Count, sum, max and recent samples of one timing series"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=METRICS_SAMPLE_SIZE)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+
+
+class MetricsRegistry:
+    """Thread-safe counters and timings keyed by metric name and labels
+
+    Stages are timed with timer('clean') and land in the stage_seconds
+    series with a stage label; counters are plain increments. Both can be
+    read back with snapshot(), or exported with to_prometheus() and
+    write_jsonl().
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = Counter()
+        self.timings = {}
+
+    def increment(self, name, value=1, **labels):
+        with self.lock:
+            self.counters[name, tuple(sorted(labels.items()))] += value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.timings:
+                self.timings[key] = Timing()
+            self.timings[key].add(seconds)
+
+    def observe_stage(self, stage, seconds):
+        self.observe('stage_seconds', seconds, stage=stage)
+
+    @contextmanager
+    def timer(self, stage):
+        """Time a with block as one sample of stage, whether it succeeds or raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, time.perf_counter() - start)
+
+    def counter(self, name, **labels):
+        with self.lock:
+            return self.counters[name, tuple(sorted(labels.items()))]
+
+    def snapshot(self):
+        """One dict per series: counters with their value, timings with count, sum and percentiles"""
+        with self.lock:
+            series = [{'type': 'counter', 'name': name, 'labels': dict(labels), 'value': value}
+                      for (name, labels), value in sorted(self.counters.items())]
+            for (name, labels), timing in sorted(self.timings.items()):
+                samples = list(timing.samples)
+                series.append({
+                    'type': 'timing', 'name': name, 'labels': dict(labels),
+                    'count': timing.count, 'sum': round(timing.total, 6), 'max': round(timing.max, 6),
+                    'p50': round(percentile(samples, 0.5), 6), 'p95': round(percentile(samples, 0.95), 6),
+                })
+        return series
+
+    def stage_summary(self):
+        """Rows of stage, calls, total, average and p95 seconds, slowest stage first"""
+        rows = [{'stage': item['labels']['stage'], 'calls': item['count'], 'total_s': round(item['sum'], 3),
+                 'avg_s': round(item['sum'] / item['count'], 3), 'p95_s': round(item['p95'], 3)}
+                for item in self.snapshot() if item['name'] == 'stage_seconds']
+        return sorted(rows, key=lambda row: -row['total_s'])
+
+    def to_prometheus(self):
+        """Prometheus text exposition format; timings are summaries with 0.5 and 0.95 quantiles"""
+        lines = []
+        described = set()
+        for item in self.snapshot():
+            name = f"{METRICS_PREFIX}_{item['name']}"
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {METRIC_HELP.get(item['name'], item['name'])}")
+                lines.append(f"# TYPE {name} {'counter' if item['type'] == 'counter' else 'summary'}")
+            if item['type'] == 'counter':
+                lines.append(f"{name}{prometheus_labels(item['labels'])} {item['value']}")
+                continue
+            for quantile in ('0.5', '0.95'):
+                value = item['p50'] if quantile == '0.5' else item['p95']
+                lines.append(f"{name}{prometheus_labels({**item['labels'], 'quantile': quantile})} {value}")
+            lines.append(f"{name}_sum{prometheus_labels(item['labels'])} {item['sum']}")
+            lines.append(f"{name}_count{prometheus_labels(item['labels'])} {item['count']}")
+        return '\n'.join(lines) + '\n'
+
+    def to_jsonl(self):
+        """The snapshot as JSON lines, each stamped with the current time"""
+        now = round(time.time(), 3)
+        return ''.join(json.dumps({'time': now, **item}) + '\n' for item in self.snapshot())
+
+    def write_jsonl(self, path):
+        """Append the snapshot to a JSON lines file, so repeated exports form a time series"""
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(self.to_jsonl())
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.timings.clear()
+
+
+def prometheus_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+@functools.cache
+def get_metrics():
+    """Metrics registry shared by everything in this process"""
+    return MetricsRegistry()
+
+
+def write_metrics(path, registry=None):
+    """Export metrics to path: Prometheus text for .prom/.txt files, JSON lines otherwise"""
+    registry = registry or get_metrics()
+    if path.endswith(('.prom', '.txt')):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(registry.to_prometheus())
+    else:
+        registry.write_jsonl(path)
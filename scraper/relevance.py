@@ -0,0 +1,83 @@
+"""Pre-extraction relevance filtering: BM25 scores of chunks against the extraction request"""
+import math
+import re
+from collections import Counter
+
+from .metrics import get_metrics
+
+WORD_RE = re.compile(r'\w+')
+
+# Relevance filtering. Chunks are scored against the extraction request with
+# BM25 and only those scoring at least min_score_ratio of the best chunk are
+# sent to the LLM; 0 sends everything. Values the request names by type
+# ("prices", "phone numbers") match typed tokens emitted for the values
+# themselves, since pages rarely spell out the field name.
+RELEVANCE_MIN_SCORE_RATIO = 0.25
+BM25_K1 = 1.5
+BM25_B = 0.75
+QUERY_STOPWORDS = frozenset("""a all an and any are as at by each every extract find for from get give in
+    information is list me of on or other please show table that the their them these this to with""".split())
+VALUE_TOKENS = [
+    ('__money__', re.compile(r'[$€£¥]\s?\d|\d\s?(?:usd|eur|gbp)\b', re.I), {'price', 'cost', 'amount', 'fee'}),
+    ('__phone__', re.compile(r'\+?\d[\d\s().-]{7,}\d'), {'phone', 'telephone', 'tel', 'number', 'contact'}),
+    ('__email__', re.compile(r'[\w.+-]+@[\w-]+\.[\w.]+'), {'email', 'mail', 'contact'}),
+    ('__time__', re.compile(r'\b\d{1,2}(?::\d{2})?\s?(?:am|pm)\b', re.I), {'hour', 'time', 'opening'}),
+]
+
+
+def stem(word):
+    """Crude plural folding so 'prices' matches 'price'"""
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 4 and word.endswith(('sses', 'xes', 'ches', 'shes')):
+        return word[:-2]
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def relevance_terms(text):
+    """Stemmed words of a chunk plus one typed token per recognised value (prices, phones...)"""
+    terms = [stem(word) for word in WORD_RE.findall(text.lower())]
+    for token, pattern, _ in VALUE_TOKENS:
+        terms.extend(token for _ in pattern.finditer(text))
+    return terms
+
+
+def query_terms(parse_description):
+    """Terms of an extraction request, with value types added for the fields it names"""
+    words = {stem(word) for word in WORD_RE.findall(parse_description.lower())} - QUERY_STOPWORDS
+    return words | {token for token, _, names in VALUE_TOKENS if words & names}
+
+
+def bm25_scores(query, documents, k1=BM25_K1, b=BM25_B):
+    """BM25 score of each document (a list of terms) for a set of query terms"""
+    counts = [Counter(terms) for terms in documents]
+    average_length = sum(len(terms) for terms in documents) / len(documents) or 1
+    scores = [0.0] * len(documents)
+    for term in query:
+        frequency = sum(1 for count in counts if term in count)
+        if not frequency:
+            continue
+        idf = math.log(1 + (len(documents) - frequency + 0.5) / (frequency + 0.5))
+        for i, (count, terms) in enumerate(zip(counts, documents)):
+            tf = count[term]
+            if tf:
+                scores[i] += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(terms) / average_length))
+    return scores
+
+
+def select_relevant_chunks(chunks, parse_description, min_score_ratio=RELEVANCE_MIN_SCORE_RATIO):
+    """Indexes of the chunks worth sending to the LLM for an extraction request
+
+    Keeps chunks scoring at least min_score_ratio of the best chunk. Every
+    chunk is kept when the ratio is 0 or nothing matches the request.
+    """
+    if not chunks or not min_score_ratio:
+        return list(range(len(chunks)))
+    with get_metrics().timer('relevance'):
+        scores = bm25_scores(query_terms(parse_description), [relevance_terms(chunk) for chunk in chunks])
+    best = max(scores)
+    if best <= 0:
+        return list(range(len(chunks)))
+    return [i for i, score in enumerate(scores) if score >= best * min_score_ratio]
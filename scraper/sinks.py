@@ -0,0 +1,400 @@
+"""Streaming export of extracted rows to CSV, JSON lines or Parquet files
+
+A sink appends rows as chunks or pages finish, so a crawl's rows are never
+all held in memory. Rows are buffered per partition and written in batches
+to a directory of part files. The layout uses key=value directories, which
+pandas, pyarrow and Spark read as one dataset:
+
+    products.csv/domain=example.com/date=2026-10-17/part-00000.csv.gz
+
+CSV and Parquet files have a fixed header, so a new part is started when
+new columns turn up. Each run adds parts next to the existing ones.
+pyarrow is imported only for Parquet.
+"""
+import csv
+import gzip
+import io
+import itertools
+import json
+import os
+import time
+from collections import OrderedDict
+from urllib.parse import quote, unquote, urlparse
+
+from .merge import markdown_rows, normalize_cell, normalize_column
+from .metrics import get_metrics
+
+EXPORT_FORMATS = ('jsonl', 'csv', 'parquet')
+# Where the app exports each extraction run
+EXPORT_PATH = os.path.join('.scraper_cache', 'exports')
+PARTITION_KEYS = ('domain', 'date')
+# Codecs per format; the first is the default
+EXPORT_COMPRESSIONS = {'jsonl': ('none', 'gzip'), 'csv': ('none', 'gzip'),
+                       'parquet': ('snappy', 'zstd', 'gzip', 'none')}
+# Rows buffered per partition before a write, and part files kept open at
+# once; together they bound a sink's memory.
+EXPORT_BATCH_ROWS = 1000
+EXPORT_MAX_OPEN_PARTS = 32
+# With dedupe, rows are compared against the most recent distinct rows
+# only, so memory stays flat on long crawls. Repeats from overlapping chunks
+# and re-listed pages arrive close together; use RowMerger for a fully
+# deduplicated table.
+EXPORT_DEDUPE_WINDOW = 100_000
+JSON_ROW_ENCODER = json.JSONEncoder(ensure_ascii=False, default=str)
+PARQUET_TYPES = {'string': 'string', 'number': 'float64', 'integer': 'int64', 'boolean': 'bool_'}
+
+
+def export_format(path, format=None):
+    """The format named, or the one the path's extension suggests (default jsonl)"""
+    if format:
+        return format
+    extension = os.path.splitext(path.rstrip('/\\'))[1].lstrip('.').lower()
+    return extension if extension in EXPORT_FORMATS else 'jsonl'
+
+
+def export_options(path, format=None, compression=None):
+    """Check an export's format and compression; returns them with the defaults filled in"""
+    format = export_format(path, format)
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {format!r}; use one of {', '.join(EXPORT_FORMATS)}")
+    compression = compression or EXPORT_COMPRESSIONS[format][0]
+    if compression not in EXPORT_COMPRESSIONS[format]:
+        raise ValueError(f"{format} export supports {', '.join(EXPORT_COMPRESSIONS[format])} "
+                         f"compression, not {compression!r}")
+    if format == 'parquet':
+        import_pyarrow()
+    return format, compression
+
+
+def parse_partition_by(spec):
+    """Parse 'domain, date' into ['domain', 'date']"""
+    keys = [key.strip() for key in (spec or '').split(',') if key.strip()]
+    for key in keys:
+        if key not in PARTITION_KEYS:
+            raise ValueError(f"Unknown partition key {key!r}; use {' or '.join(PARTITION_KEYS)}")
+    return keys
+
+
+def result_rows(result):
+    """Row dicts of a chunk or page result: a list of rows, JSON rows or a markdown table"""
+    if not result:
+        return []
+    if isinstance(result, list):
+        return result
+    return json.loads(result) if result.lstrip().startswith('[') else markdown_rows(result)
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError("Parquet export needs pyarrow: pip install pyarrow") from None
+    return pyarrow
+
+
+class JSONLPart:
+    """One JSON lines part file; rows keep only their filled cells"""
+
+    EXTENSION = '.jsonl'
+
+    def __init__(self, path, columns, compression):
+        self.columns = columns
+        self.file = gzip.open(path, 'wt', encoding='utf-8') if compression == 'gzip' else \
+            open(path, 'w', encoding='utf-8')
+
+    def accepts(self, keys):
+        return True
+
+    def write(self, rows, names):
+        encode = JSON_ROW_ENCODER.encode
+        self.file.write(''.join(encode({names[key]: value for key, value in row.items()}) + '\n' for row in rows))
+
+    def close(self):
+        self.file.close()
+
+
+class CSVPart(JSONLPart):
+    """One CSV part file with a header of the columns known when it was opened"""
+
+    EXTENSION = '.csv'
+
+    def __init__(self, path, columns, compression):
+        self.columns = columns
+        self.file = gzip.open(path, 'wt', encoding='utf-8', newline='') if compression == 'gzip' else \
+            open(path, 'w', encoding='utf-8', newline='')
+        self.writer = csv.writer(self.file)
+        self.header_written = False
+
+    def accepts(self, keys):
+        return keys <= set(self.columns)
+
+    def write(self, rows, names):
+        if not self.header_written:
+            self.writer.writerow(names[key] for key in self.columns)
+            self.header_written = True
+        self.writer.writerows(['' if row.get(key) is None else row[key] for key in self.columns] for row in rows)
+
+
+class ParquetPart(CSVPart):
+    """One Parquet part file; each batch is a row group
+
+    Declared columns keep their type, other columns are strings.
+    """
+
+    EXTENSION = '.parquet'
+
+    def __init__(self, path, columns, compression, column_types=None):
+        from .llm import coerce_value
+
+        self.pyarrow = import_pyarrow()
+        self.coerce_value = coerce_value
+        self.columns = columns
+        self.path = path
+        self.compression = compression
+        self.types = {key: (column_types or {}).get(key, 'string') for key in columns}
+        self.writer = None
+
+    def write(self, rows, names):
+        pyarrow = self.pyarrow
+        if self.writer is None:
+            schema = pyarrow.schema([(names[key], getattr(pyarrow, PARQUET_TYPES[self.types[key]])())
+                                     for key in self.columns])
+            self.writer = pyarrow.parquet.ParquetWriter(self.path, schema, compression=self.compression)
+        self.writer.write_table(pyarrow.Table.from_pydict(
+            {names[key]: [self.coerce_value(row.get(key), self.types[key]) for row in rows] for key in self.columns},
+            schema=self.writer.schema))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+PART_CLASSES = {'jsonl': JSONLPart, 'csv': CSVPart, 'parquet': ParquetPart}
+
+
+class RowSink:
+    """Append extracted rows to part files of one format as they arrive
+
+    write() takes a chunk or page result (see result_rows) and the page URL
+    for the 'domain' partition; 'date' partitions by the UTC day rows are
+    written. Columns are matched by normalize_column and keep the name they
+    were first seen with, or the names of the declared columns. Memory is
+    bounded by batch_rows buffered rows per partition and max_open_parts
+    open files. With dedupe, a row equal (values compared like RowMerger)
+    to one of the last dedupe_window distinct rows is dropped; older repeats
+    are kept.
+    """
+
+    def __init__(self, path, format=None, partition_by=(), compression=None, columns=None,
+                 batch_rows=EXPORT_BATCH_ROWS, max_open_parts=EXPORT_MAX_OPEN_PARTS, dedupe=False,
+                 dedupe_window=EXPORT_DEDUPE_WINDOW):
+        self.path = path
+        self.format, self.compression = export_options(path, format, compression)
+        self.partition_by = list(partition_by)
+        self.batch_rows = batch_rows
+        self.max_open_parts = max_open_parts
+        self.names = {normalize_column(name): name for name, _ in columns or []}
+        self.column_types = {normalize_column(name): column_type for name, column_type in columns or []}
+        self.keys = {}  # normalize_column of each header spelling seen
+        self.buffers = {}
+        self.buffered = 0
+        self.parts = OrderedDict()
+        self.seen = OrderedDict() if dedupe else None
+        self.dedupe_window = dedupe_window
+        self.rows = 0
+        self.duplicates = 0
+        self.files = []
+        os.makedirs(path, exist_ok=True)
+
+    def partition(self, url):
+        values = {'domain': (urlparse(url or '').hostname or 'unknown').lower(),
+                  'date': time.strftime('%Y-%m-%d', time.gmtime())}
+        return tuple((key, values[key]) for key in self.partition_by)
+
+    def write(self, result, url=None):
+        """Buffer one result's rows, writing full batches; returns the number of rows kept"""
+        rows = result_rows(result)
+        if not rows:
+            return 0
+        partition = self.partition(url)
+        buffer = self.buffers.setdefault(partition, [])
+        kept = 0
+        with get_metrics().timer('export'):
+            for row in rows:
+                cells = {}
+                for name, value in row.items():
+                    key = self.keys.get(name)
+                    if key is None:
+                        key = self.keys[name] = normalize_column(name)
+                    if key and value not in (None, ''):
+                        cells.setdefault(key, value)
+                        self.names.setdefault(key, name)
+                if not cells:
+                    continue
+                if self.seen is not None:
+                    row_key = tuple(sorted((key, normalize_cell(value)) for key, value in cells.items()))
+                    if row_key in self.seen:
+                        self.seen.move_to_end(row_key)
+                        self.duplicates += 1
+                        continue
+                    self.seen[row_key] = None
+                    if len(self.seen) > self.dedupe_window:
+                        self.seen.popitem(last=False)
+                buffer.append(cells)
+                kept += 1
+            self.rows += kept
+            self.buffered += kept
+            if len(buffer) >= self.batch_rows:
+                self.flush_partition(partition)
+            if self.buffered >= self.batch_rows * self.max_open_parts:
+                self.flush()
+        get_metrics().increment('export_rows_total', kept, format=self.format)
+        return kept
+
+    def part_path(self, partition):
+        directory = os.path.join(self.path, *(f'{key}={quote(value, safe="")}' for key, value in partition))
+        os.makedirs(directory, exist_ok=True)
+        extension = PART_CLASSES[self.format].EXTENSION + ('.gz' if self.compression == 'gzip'
+                                                           and self.format != 'parquet' else '')
+        for number in itertools.count(len(os.listdir(directory))):
+            path = os.path.join(directory, f'part-{number:05d}{extension}')
+            if not os.path.exists(path):
+                return path
+
+    def open_part(self, partition):
+        path = self.part_path(partition)
+        columns = list(self.names)
+        part_class = PART_CLASSES[self.format]
+        if part_class is ParquetPart:
+            part = ParquetPart(path, columns, self.compression, self.column_types)
+        else:
+            part = part_class(path, columns, self.compression)
+        self.files.append(path)
+        self.parts[partition] = part
+        while len(self.parts) > self.max_open_parts:
+            self.parts.popitem(last=False)[1].close()
+        return part
+
+    def flush_partition(self, partition):
+        rows = self.buffers.pop(partition, None)
+        if not rows:
+            return
+        self.buffered -= len(rows)
+        part = self.parts.get(partition)
+        if part is None or not part.accepts(set().union(*rows)):
+            if part is not None:
+                self.parts.pop(partition).close()
+            part = self.open_part(partition)
+        self.parts.move_to_end(partition)
+        part.write(rows, self.names)
+
+    def flush(self):
+        """Write every buffered row"""
+        with get_metrics().timer('export'):
+            for partition in list(self.buffers):
+                self.flush_partition(partition)
+            for part in self.parts.values():
+                if hasattr(part, 'file'):
+                    part.file.flush()
+
+    def close(self):
+        self.flush()
+        while self.parts:
+            self.parts.popitem()[1].close()
+
+    def stats(self):
+        return {'rows': self.rows, 'duplicates': self.duplicates, 'files': len(self.files)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def export_parts(path):
+    """Part files of an export directory with their partition values, by partition and part number"""
+    parts = []
+    for directory, _, files in os.walk(path):
+        partition = {}
+        for name in os.path.relpath(directory, path).split(os.sep):
+            key, _, value = name.partition('=')
+            if key in PARTITION_KEYS:
+                partition[key] = unquote(value)
+        parts.extend((os.path.join(directory, name), partition) for name in files if name.startswith('part-'))
+    return sorted(parts, key=lambda part: part[0])
+
+
+def open_part_file(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, encoding='utf-8', newline='')
+
+
+def iter_part_rows(path, skip=0):
+    """Yield a part file's rows as dicts after the first skip, reading it a batch at a time
+
+    Skipped rows are not parsed: JSON lines are passed over as text, and
+    whole Parquet row groups are passed over using their metadata.
+    """
+    if path.endswith('.parquet'):
+        parquet_file = import_pyarrow().parquet.ParquetFile(path)
+        for group in range(parquet_file.num_row_groups):
+            count = parquet_file.metadata.row_group(group).num_rows
+            if skip >= count:
+                skip -= count
+                continue
+            yield from parquet_file.read_row_group(group).to_pylist()[skip:]
+            skip = 0
+        return
+    with open_part_file(path) as file:
+        if '.csv' in os.path.basename(path):
+            reader = csv.reader(file)
+            header = next(reader, [])
+            for row in itertools.islice(reader, skip, None):
+                yield {name: value or None for name, value in zip(header, row)}
+        else:
+            for line in itertools.islice(file, skip, None):
+                yield json.loads(line)
+
+
+def count_part_rows(path):
+    """Rows in a part file, without building them (Parquet from metadata)"""
+    if path.endswith('.parquet'):
+        return import_pyarrow().parquet.ParquetFile(path).metadata.num_rows
+    if '.csv' in os.path.basename(path):
+        with open_part_file(path) as file:
+            return max(0, sum(1 for _ in csv.reader(file)) - 1)
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as file:
+        return sum(block.count(b'\n') for block in iter(lambda: file.read(io.DEFAULT_BUFFER_SIZE), b''))
+
+
+def iter_export(path):
+    """Yield every row of an export directory, with its partition values as extra columns"""
+    for part, partition in export_parts(path):
+        for row in iter_part_rows(part):
+            yield {**row, **partition}
+
+
+def read_export(path, offset=0, limit=100):
+    """Rows offset to offset + limit of an export, parsing only the rows returned"""
+    rows = []
+    for part, partition in export_parts(path):
+        if offset:
+            count = count_part_rows(part)
+            if count <= offset:
+                offset -= count
+                continue
+        for row in iter_part_rows(part, offset):
+            rows.append({**row, **partition})
+            if len(rows) >= limit:
+                return rows
+        offset = 0
+    return rows
+
+
+def count_export_rows(path):
+    """Rows in an export directory"""
+    return sum(count_part_rows(part) for part, _ in export_parts(path))
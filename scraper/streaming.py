@@ -0,0 +1,171 @@
+"""Memory-bounded clean-and-chunk for very large pages
+
+clean_dom_content builds a whole parse tree and several full-size copies of
+the text, so peak memory is many times the page size. Here html.parser's
+incremental tokenizer is fed the page piece by piece, and cleaned records
+and chunks are yielded as soon as they are complete. Memory is bounded by
+the open-element stack, the current text run and one chunk.
+"""
+import codecs
+from html.parser import HTMLParser
+
+from .chunking import DEFAULT_CHUNK_TOKENS, pack_records
+from .cleaning import BLOCK_TAGS, format_text_element, is_hidden_element, is_unwanted_element, normalize_line
+
+STREAM_PIECE_SIZE = 64 * 1024
+
+# Elements that never have content, and open elements a start tag closes
+# implicitly; enough of the HTML tree-building rules for flat text runs.
+VOID_TAGS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen',
+    'link', 'meta', 'param', 'source', 'track', 'wbr'
+])
+CLOSES_P = frozenset([
+    'address', 'article', 'aside', 'blockquote', 'div', 'dl', 'fieldset', 'footer', 'form',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'main', 'nav', 'ol', 'p', 'pre',
+    'section', 'table', 'ul'
+])
+IMPLIED_END_TAGS = {
+    'li': ({'li'}, {'ul', 'ol'}),
+    'td': ({'td', 'th'}, {'tr', 'table'}),
+    'th': ({'td', 'th'}, {'tr', 'table'}),
+    'tr': ({'tr', 'td', 'th'}, {'table', 'thead', 'tbody', 'tfoot'}),
+    'option': ({'option'}, {'select', 'datalist'}),
+}
+
+def clean_record(name, attrs, text):
+    """Format and normalize one text run; returns the record line or None"""
+    text = format_text_element(name, attrs, text)
+    return normalize_line(text) if text else None
+
+
+class StreamingCleaner(HTMLParser):
+    """Incremental cleaner applying clean_dom_content's 'blocks' rules to a fed page
+
+    Each text run is assigned to its nearest block element, as in 'blocks'
+    mode, and removal rules drop whole subtrees. Cleaned records collect in
+    self.records until the caller takes them.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack = []  # [name, attrs, unwanted] per open element
+        self.pending_text = []
+        self.run_block = None
+        self.run_parts = []
+        self.records = []
+
+    def current_block(self):
+        for element in reversed(self.stack):
+            if element[0] in BLOCK_TAGS:
+                return element
+        return None
+
+    def flush_text(self):
+        """Add the text seen since the last tag to the current run"""
+        if not self.pending_text:
+            return
+        text = ''.join(self.pending_text).strip()
+        self.pending_text = []
+        if not text or (self.stack and self.stack[-1][2]):
+            return
+        block = self.current_block()
+        if block is None:
+            return
+        if block is not self.run_block:
+            self.flush_run()
+            self.run_block = block
+        self.run_parts.append(text)
+
+    def flush_run(self):
+        if self.run_block is not None and self.run_parts:
+            name, attrs, _ = self.run_block
+            if not is_hidden_element(attrs):
+                record = clean_record(name, attrs, ' '.join(self.run_parts))
+                if record:
+                    self.records.append(record)
+        self.run_block = None
+        self.run_parts = []
+
+    def close_until(self, names, boundary):
+        """Close the innermost open element named in names, unless a boundary element is nearer"""
+        for i in range(len(self.stack) - 1, -1, -1):
+            name = self.stack[i][0]
+            if name in names:
+                del self.stack[i:]
+                return
+            if name in boundary:
+                return
+
+    def handle_starttag(self, tag, attrs):
+        self.flush_text()
+        if tag in CLOSES_P:
+            self.close_until({'p'}, {'div', 'td', 'th', 'li', 'table', 'section', 'article', 'main'})
+        if tag in IMPLIED_END_TAGS:
+            self.close_until(*IMPLIED_END_TAGS[tag])
+        if tag in VOID_TAGS:
+            return
+        attrs = {name: value or '' for name, value in attrs}
+        unwanted = bool(self.stack and self.stack[-1][2]) or is_unwanted_element(tag, attrs)
+        self.stack.append([tag, attrs, unwanted])
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS and self.stack and self.stack[-1][0] == tag:
+            self.stack.pop()
+
+    def handle_endtag(self, tag):
+        self.flush_text()
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i][0] == tag:
+                del self.stack[i:]
+                return
+
+    def handle_data(self, data):
+        self.pending_text.append(data)
+
+    def close(self):
+        super().close()
+        self.flush_text()
+        self.flush_run()
+
+    def take_records(self):
+        records, self.records = self.records, []
+        return records
+
+
+def iter_html_pieces(source, piece_size=STREAM_PIECE_SIZE):
+    """Pieces of an HTML page given as a str, bytes, a file object or an iterable of pieces"""
+    if isinstance(source, (str, bytes)):
+        for start in range(0, len(source), piece_size):
+            yield source[start:start + piece_size]
+    elif hasattr(source, 'read'):
+        while True:
+            piece = source.read(piece_size)
+            if not piece:
+                return
+            yield piece
+    else:
+        yield from source
+
+
+def iter_clean_records(source, piece_size=STREAM_PIECE_SIZE):
+    """Yield cleaned text records of a page while it is being read
+
+    source is anything iter_html_pieces accepts; byte pieces are decoded as
+    UTF-8. Each record is one text run of a block element, so chunks
+    break between them as in chunk_records.
+    """
+    cleaner = StreamingCleaner()
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for piece in iter_html_pieces(source, piece_size):
+        cleaner.feed(decoder.decode(piece) if isinstance(piece, bytes) else piece)
+        yield from cleaner.take_records()
+    cleaner.feed(decoder.decode(b'', final=True))
+    cleaner.close()
+    yield from cleaner.take_records()
+
+
+def iter_chunks(source, max_tokens=DEFAULT_CHUNK_TOKENS, overlap_records=0, piece_size=STREAM_PIECE_SIZE):
+    """Yield chunk_records-style chunks of a page, cleaning it as it is read"""
+    return pack_records(iter_clean_records(source, piece_size), max_tokens, overlap_records)
@@ -0,0 +1,437 @@
+"""Extraction templates learned from LLM output (wrapper induction)
+
+Pages of one site and page type share a layout, so their rows sit at the
+same DOM positions. induce_template finds the values the LLM extracted from
+one page in that page's HTML, and derives CSS selectors from them: one for
+the element that repeats once per record, and one per column within it.
+Later pages of the same domain and page type are then extracted with those
+selectors, without the LLM, as long as the template's checks pass.
+"""
+import json
+import os
+import re
+import time
+from collections import Counter
+from urllib.parse import urlparse
+
+from .cache import SQLiteStore, content_hash
+from .cleaning import LexborHTMLParser, get_parser_backend, is_unwanted_element
+from .llm import NUMBER_RE, coerce_value, extraction_variant
+from .merge import normalize_cell, normalize_column
+from .metrics import get_metrics
+
+# Templates are stored per domain, page type and extraction request. Bump
+# TEMPLATE_RULES_VERSION whenever induction or application changes, so
+# templates learned under the old rules are not used.
+TEMPLATES_PATH = os.path.join('.scraper_cache', 'templates.sqlite3')
+TEMPLATE_RULES_VERSION = 2
+TEMPLATE_PARSER = 'lxml'
+# A template is stored only if it was located from at least TEMPLATE_MIN_ROWS
+# of the LLM's rows and, applied to the same page, gives back the LLM's rows
+# with precision and recall of at least TEMPLATE_MIN_AGREEMENT.
+TEMPLATE_MIN_ROWS = 3
+TEMPLATE_MIN_AGREEMENT = 0.9
+# Checks on later pages: at least one record, and each column the LLM
+# filled in most rows is filled in TEMPLATE_MIN_FILL of the records. A
+# template failing TEMPLATE_MAX_FAILURES checks in a row is retired.
+TEMPLATE_MIN_FILL = 0.8
+TEMPLATE_MAX_FAILURES = 3
+# Longest element text matched against values, anchor elements tried per row,
+# and levels climbed from the anchor to find a row's other values
+TEMPLATE_MAX_VALUE_CHARS = 500
+TEMPLATE_MAX_CANDIDATES = 20
+TEMPLATE_MAX_CLIMB = 6
+# Attributes searched for values, e.g. link URLs
+VALUE_ATTRIBUTES = ('href', 'src', 'alt', 'title', 'datetime', 'content')
+CSS_CLASS_RE = re.compile(r'^-?[A-Za-z_][\w-]*$')
+# Path segments holding ids or slugs; they are wildcarded in the page type
+PATH_ID_RE = re.compile(r'\d|\w-\w+-\w')
+
+
+def page_type(url):
+    """Layout key for a URL: its first path segments with ids and slugs as *, e.g. /p/*"""
+    segments = [segment for segment in urlparse(url).path.split('/') if segment]
+    return '/' + '/'.join('*' if PATH_ID_RE.search(segment) else segment for segment in segments[:3])
+
+
+def template_key(url, parse_description, output_format='table', columns=None):
+    """(domain, page type, scope) under which a page's template is stored"""
+    scope = content_hash(json.dumps([parse_description, extraction_variant(output_format, columns),
+                                     TEMPLATE_RULES_VERSION]))
+    return (urlparse(url).hostname or '').lower(), page_type(url), scope
+
+
+class TemplateStore(SQLiteStore):
+    """Versioned extraction templates, with how often each was applied and failed its checks"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS templates (
+            domain TEXT NOT NULL, page_type TEXT NOT NULL, scope TEXT NOT NULL, version INTEGER NOT NULL,
+            template TEXT NOT NULL, precision REAL NOT NULL, recall REAL NOT NULL, created_at REAL NOT NULL,
+            applied INTEGER NOT NULL DEFAULT 0, failures INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (domain, page_type, scope, version));
+    """
+
+    def __init__(self, path=TEMPLATES_PATH):
+        super().__init__(path)
+
+    def latest(self, domain, page_type, scope):
+        """The newest template as (version, template), or None if there is none or it was retired"""
+        with self.connect() as db:
+            row = db.execute("SELECT version, template, failures FROM templates "
+                             "WHERE domain = ? AND page_type = ? AND scope = ? ORDER BY version DESC LIMIT 1",
+                             (domain, page_type, scope)).fetchone()
+        if row is None or row[2] >= TEMPLATE_MAX_FAILURES:
+            return None
+        return row[0], json.loads(row[1])
+
+    def add(self, domain, page_type, scope, template, precision, recall):
+        """Store a template as the next version; returns the version"""
+        with self.connect() as db:
+            db.execute("INSERT INTO templates (domain, page_type, scope, version, template, precision, recall, "
+                       "created_at) SELECT ?, ?, ?, COALESCE(MAX(version), 0) + 1, ?, ?, ?, ? FROM templates "
+                       "WHERE domain = ? AND page_type = ? AND scope = ?",
+                       (domain, page_type, scope, json.dumps(template), precision, recall, time.time(),
+                        domain, page_type, scope))
+            return db.execute("SELECT MAX(version) FROM templates WHERE domain = ? AND page_type = ? AND scope = ?",
+                              (domain, page_type, scope)).fetchone()[0]
+
+    def record_check(self, domain, page_type, scope, version, passed):
+        with self.connect() as db:
+            db.execute("UPDATE templates SET applied = applied + ?, "
+                       "failures = CASE WHEN ? THEN 0 ELSE failures + 1 END "
+                       "WHERE domain = ? AND page_type = ? AND scope = ? AND version = ?",
+                       (int(passed), passed, domain, page_type, scope, version))
+
+    def stats(self):
+        """Pages extracted by a template, failed checks, pages without one, and templates learned or rejected"""
+        with self.lock:
+            return {event: self.counts[event] for event in ('applied', 'check_failed', 'missing', 'learned',
+                                                            'rejected')}
+
+
+def parse_page(html_content):
+    """Parse a page, dropping the subtrees clean_dom_content removes
+
+    When selectolax is installed, apply_template matches selectors against
+    lexbor's HTML5 tree, so the page is first rebuilt by lexbor: induction
+    then sees the same elements, such as the tbody it adds to tables.
+    """
+    if LexborHTMLParser is not None:
+        html_content = LexborHTMLParser(html_content).html
+    soup = get_parser_backend(TEMPLATE_PARSER).parse(html_content)
+    for element in soup.find_all(True):
+        if not element.decomposed and is_unwanted_element(element.name, element.attrs):
+            element.decompose()
+    return soup
+
+
+def element_text(element):
+    return ' '.join(element.get_text(' ', strip=True).split())
+
+
+def element_classes(element):
+    return [name for name in element.get('class', []) if CSS_CLASS_RE.match(name)]
+
+
+def index_values(soup):
+    """Map element texts, attribute values and lone numbers to (element, attr, text length), innermost first"""
+    texts, numbers = {}, {}
+    for element in reversed(soup.find_all(True)):
+        text = element_text(element)
+        if text and len(text) <= TEMPLATE_MAX_VALUE_CHARS:
+            texts.setdefault(text.casefold(), []).append((element, None, len(text)))
+            found = NUMBER_RE.findall(text.replace(',', ''))
+            if len(found) == 1:
+                numbers.setdefault(float(found[0]), []).append((element, None, len(text)))
+        for attr in VALUE_ATTRIBUTES:
+            value = element.get(attr)
+            if isinstance(value, str) and value.strip():
+                texts.setdefault(' '.join(value.split()).casefold(), []).append((element, attr, len(value)))
+    return texts, numbers
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def lineage(element):
+    return [element, *element.parents]
+
+
+def common_ancestor(elements):
+    chain = lineage(elements[0])
+    for element in elements[1:]:
+        ids = {id(node) for node in lineage(element)}
+        chain = [node for node in chain if id(node) in ids]
+    return chain[0]
+
+
+def depth(element):
+    return sum(1 for _ in element.parents)
+
+
+def nearest_candidate(anchor, by_element):
+    """The candidate inside the nearest ancestor of anchor that holds one, tightest text first"""
+    for ancestor in lineage(anchor)[:TEMPLATE_MAX_CLIMB]:
+        inside = [candidate for node in (ancestor, *ancestor.descendants)
+                  for candidate in by_element.get(id(node), ())]
+        if inside:
+            return min(inside, key=lambda candidate: candidate[2])
+    return None
+
+
+def locate_row(row, texts, numbers, grouped):
+    """Elements holding a row's values, as {column: (element, attr)}, chosen to sit as close together as possible
+
+    The value with the fewest matching elements is the anchor; every other
+    value is taken from the nearest ancestor of the anchor that holds it.
+    grouped caches the candidates of each value by element between rows.
+    """
+    candidates = {}
+    for column, value in row.items():
+        if is_number(value):
+            key = float(value)
+            found = numbers.get(key)
+        elif isinstance(value, str) and value.strip():
+            key = ' '.join(value.split()).casefold()
+            found = texts.get(key)
+        else:
+            found = None
+        if found:
+            candidates[column] = (key, found)
+    if not candidates:
+        return {}
+
+    anchor_column = min(candidates, key=lambda column: len(candidates[column][1]))
+    for column, (key, found) in candidates.items():
+        if column != anchor_column and key not in grouped:
+            grouped[key] = {}
+            for candidate in found:
+                grouped[key].setdefault(id(candidate[0]), []).append(candidate)
+    best, best_depth = {}, -1
+    for anchor in candidates[anchor_column][1][:TEMPLATE_MAX_CANDIDATES]:
+        chosen = {anchor_column: anchor}
+        for column, (key, _) in candidates.items():
+            if column == anchor_column:
+                continue
+            candidate = nearest_candidate(anchor[0], grouped[key])
+            if candidate:
+                chosen[column] = candidate
+        root_depth = depth(common_ancestor([element for element, _, _ in chosen.values()]))
+        if root_depth > best_depth:
+            best, best_depth = chosen, root_depth
+    return {column: (element, attr) for column, (element, attr, _) in best.items()}
+
+
+def same_shape(element, other):
+    """Siblings of one kind: same tag and a shared class, or both without classes"""
+    classes, other_classes = set(element_classes(element)), set(element_classes(other))
+    return element.name == other.name and (bool(classes & other_classes) or not (classes or other_classes))
+
+
+def record_element(element):
+    """Walk up to the element that repeats among its siblings once per record"""
+    node = element
+    while node.parent is not None and node.parent.name != '[document]':
+        for siblings in (node.next_siblings, node.previous_siblings):
+            if any(getattr(sibling, 'name', None) and same_shape(sibling, node) for sibling in siblings):
+                return node
+        node = node.parent
+    return element
+
+
+def shared_selector(elements):
+    """tag.class selector matching every element: the common tag and the classes they all carry"""
+    classes = set(element_classes(elements[0]))
+    for element in elements[1:]:
+        classes &= set(element_classes(element))
+    return elements[0].name + ''.join(f'.{name}' for name in sorted(classes))
+
+
+def relative_selector(record, element):
+    """Child-combinator path from record down to element, with :nth-of-type where siblings look alike"""
+    steps = []
+    node = element
+    while node is not record:
+        step = node.name + ''.join(f'.{name}' for name in element_classes(node))
+        siblings = node.parent.find_all(node.name, recursive=False)
+        if sum(1 for sibling in siblings if element_classes(sibling) == element_classes(node)) > 1:
+            step += f':nth-of-type({next(i for i, sibling in enumerate(siblings) if sibling is node) + 1})'
+        steps.append(step)
+        node = node.parent
+    return ' > '.join(reversed(steps)) or None
+
+
+def induce_template(soup, rows):
+    """Derive a template from the rows the LLM extracted from a parsed page, or None if they cannot be located
+
+    The record selector is the tag and shared classes of the element that
+    repeats once per row, under its parent's. Each column takes the path
+    from the record element that most rows agree on.
+    """
+    texts, numbers = index_values(soup)
+    grouped = {}
+    located = []
+    for row in rows:
+        elements = locate_row(row, texts, numbers, grouped)
+        if elements:
+            root = common_ancestor([element for element, _ in elements.values()])
+            located.append((record_element(root), elements))
+
+    record_tag = Counter(record.name for record, _ in located).most_common(1)
+    located = [(record, elements) for record, elements in located if record_tag and record.name == record_tag[0][0]]
+    if len(located) < TEMPLATE_MIN_ROWS:
+        return None
+    records = [record for record, _ in located]
+    parents = [record.parent for record in records]
+    if len({parent.name for parent in parents}) > 1:
+        return None
+
+    fields = []
+    columns = list(dict.fromkeys(column for row in rows for column in row))
+    for column in columns:
+        paths = Counter((relative_selector(record, elements[column][0]), elements[column][1])
+                        for record, elements in located if column in elements)
+        if not paths or paths.most_common(1)[0][1] < TEMPLATE_MIN_ROWS:
+            continue
+        (selector, attr), _ = paths.most_common(1)[0]
+        values = [row.get(column) for row in rows]
+        filled = [value for value in values if value not in (None, '')]
+        fields.append({'column': column, 'selector': selector, 'attr': attr,
+                       'type': 'number' if filled and all(is_number(value) for value in filled) else 'text',
+                       'required': len(filled) >= TEMPLATE_MIN_FILL * len(values)})
+    if not fields:
+        return None
+    return {'record': f"{shared_selector(parents)} > {shared_selector(records)}", 'fields': fields,
+            'columns': columns}
+
+
+def template_row(template, select, text, attribute):
+    """One row from a record element, given functions to select, read the text of and read attributes of nodes"""
+    row = dict.fromkeys(template['columns'])
+    for field in template['fields']:
+        node = select(field['selector'])
+        if node is None:
+            continue
+        value = attribute(node, field['attr']) if field['attr'] else ' '.join(text(node).split())
+        if field['type'] == 'number':
+            value = coerce_value(value, 'number')
+        row[field['column']] = value if value != '' else None
+    return row
+
+
+def lexbor_is_wanted(node):
+    while node is not None and node.tag[0] != '-':
+        if is_unwanted_element(node.tag, node.attributes):
+            return False
+        node = node.parent
+    return True
+
+
+def lexbor_select_path(node, steps):
+    """First element reached from node through the child steps of a relative selector, like :scope > a > b"""
+    if not steps:
+        return node
+    for child in node.css(steps[0]):
+        if child.parent == node:
+            found = lexbor_select_path(child, steps[1:])
+            if found is not None:
+                return found
+    return None
+
+
+def apply_template(template, html_content):
+    """Extract rows from a page with a template; one row per record element with any value
+
+    Pages are parsed with selectolax when it is installed, which takes
+    milliseconds, and with BeautifulSoup otherwise; either way, field
+    selectors are followed from the record down its children only. Records
+    and values inside subtrees clean_dom_content removes are skipped.
+    """
+    rows = []
+    if LexborHTMLParser is None:
+        soup = parse_page(html_content)
+        for record in soup.select(template['record']):
+            rows.append(template_row(
+                template, lambda selector: record.select_one(f':scope > {selector}') if selector else record,
+                element_text, lambda element, attr: element.get(attr)))
+    else:
+        tree = LexborHTMLParser(html_content)
+        for record in tree.css(template['record']):
+            if not lexbor_is_wanted(record):
+                continue
+
+            def select(selector):
+                node = lexbor_select_path(record, selector.split(' > ') if selector else [])
+                return node if node is not None and lexbor_is_wanted(node) else None
+
+            rows.append(template_row(template, select, lambda node: node.text(separator=' ', strip=True),
+                                     lambda node, attr: node.attributes.get(attr)))
+    return [row for row in rows if any(value is not None for value in row.values())]
+
+
+def check_rows(template, rows):
+    """Template checks on a new page: some records, and every required column mostly filled"""
+    if not rows:
+        return False
+    for field in template['fields']:
+        if field['required']:
+            filled = sum(1 for row in rows if row.get(field['column']) is not None)
+            if filled < TEMPLATE_MIN_FILL * len(rows):
+                return False
+    return True
+
+
+def row_agreement(rows, expected):
+    """Precision and recall of rows against expected rows, comparing whole rows by normalized values"""
+    def keys(items):
+        return Counter(tuple(sorted((normalize_column(name), normalize_cell(value))
+                                    for name, value in row.items() if value not in (None, '')))
+                       for row in items)
+
+    got, wanted = keys(rows), keys(expected)
+    matched = sum((got & wanted).values())
+    return (matched / sum(got.values()) if got else 0.0,
+            matched / sum(wanted.values()) if wanted else 0.0)
+
+
+def extract_with_template(store, url, html_content, parse_description, output_format='table', columns=None):
+    """Rows for a page from the template for its domain and page type, or None when the LLM is needed"""
+    key = template_key(url, parse_description, output_format, columns)
+    found = store.latest(*key)
+    metrics = get_metrics()
+    if found is None:
+        store.count('missing')
+        metrics.increment('template_pages_total', outcome='missing')
+        return None
+
+    version, template = found
+    with metrics.timer('template_apply'):
+        rows = apply_template(template, html_content)
+    passed = check_rows(template, rows)
+    store.record_check(*key, version, passed)
+    outcome = 'applied' if passed else 'check_failed'
+    store.count(outcome)
+    metrics.increment('template_pages_total', outcome=outcome)
+    return rows if passed else None
+
+
+def learn_template(store, url, html_content, rows, parse_description, output_format='table', columns=None):
+    """Induce a template from the LLM's rows for a page and store it as a new version
+
+    The template is kept only if it gives back the LLM's rows from the same
+    page (see TEMPLATE_MIN_AGREEMENT). Returns the stored version, or None.
+    """
+    metrics = get_metrics()
+    with metrics.timer('template_induce'):
+        template = induce_template(parse_page(html_content), rows or [])
+        precision, recall = row_agreement(apply_template(template, html_content), rows) if template else (0.0, 0.0)
+    if min(precision, recall) < TEMPLATE_MIN_AGREEMENT:
+        store.count('rejected')
+        metrics.increment('templates_learned_total', outcome='rejected')
+        return None
+    version = store.add(*template_key(url, parse_description, output_format, columns), template, precision, recall)
+    store.count('learned')
+    metrics.increment('templates_learned_total', outcome='stored')
+    return version
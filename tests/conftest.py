@@ -0,0 +1,47 @@
+import glob
+import os
+import threading
+from contextlib import contextmanager
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fixtures')
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+
+@pytest.fixture(scope='session')
+def pages():
+    """Every saved HTML page in fixtures/, by file name"""
+    return {os.path.basename(path): load_fixture(os.path.basename(path))
+            for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, '*.html')))}
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def serve_http(handler):
+    """Run an HTTP server with a request handler on a free local port; yields the port"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server.server_address[1]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture(scope='session')
+def fixture_server():
+    """Base URL of a local HTTP server for fixtures/"""
+    with serve_http(partial(QuietHandler, directory=FIXTURES_DIR)) as port:
+        yield f'http://127.0.0.1:{port}'
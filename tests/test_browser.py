@@ -0,0 +1,133 @@
+import threading
+
+import pytest
+
+from scraper.browser import BrowserSessionPool, fetch_page_html
+
+
+class FakeDriver:
+    """Stand-in for a remote WebDriver session"""
+
+    def __init__(self, html='<html><body><p>Fake page</p></body></html>'):
+        self.html = html
+        self.alive = True
+        self.quit_calls = 0
+        self.visited = []
+
+    @property
+    def current_url(self):
+        if not self.alive:
+            raise ConnectionError("session is gone")
+        return self.visited[-1] if self.visited else 'about:blank'
+
+    def get(self, url):
+        self.visited.append(url)
+
+    def execute(self, command, params):
+        return {'value': {'status': 'not_detected'}}
+
+    def execute_script(self, script):
+        return 'complete'
+
+    @property
+    def page_source(self):
+        return self.html
+
+    def quit(self):
+        self.alive = False
+        self.quit_calls += 1
+
+
+class DriverFactory:
+    def __init__(self):
+        self.drivers = []
+
+    def __call__(self):
+        driver = FakeDriver()
+        self.drivers.append(driver)
+        return driver
+
+
+def test_sessions_are_reused():
+    factory = DriverFactory()
+    pool = BrowserSessionPool(factory, max_size=2)
+    for _ in range(5):
+        with pool.session() as driver:
+            driver.get('http://example.com/')
+    assert len(factory.drivers) == 1
+    assert pool.stats() == {'created': 1, 'reused': 4, 'recycled': 0, 'idle': 1, 'in_use': 0}
+
+
+def test_worn_out_session_is_recycled():
+    factory = DriverFactory()
+    pool = BrowserSessionPool(factory, max_pages_per_session=2)
+    for _ in range(4):
+        with pool.session():
+            pass
+    assert pool.stats()['created'] == 2
+    assert pool.stats()['recycled'] == 2
+    assert all(driver.quit_calls == 1 for driver in factory.drivers)
+
+
+def test_failed_session_is_recycled():
+    factory = DriverFactory()
+    pool = BrowserSessionPool(factory)
+    with pytest.raises(RuntimeError):
+        with pool.session():
+            raise RuntimeError("page crashed")
+    with pool.session() as driver:
+        pass
+    assert driver is factory.drivers[1]
+    assert factory.drivers[0].quit_calls == 1
+    assert pool.stats()['in_use'] == 0
+
+
+def test_dead_idle_session_is_replaced():
+    factory = DriverFactory()
+    pool = BrowserSessionPool(factory)
+    with pool.session() as driver:
+        pass
+    driver.alive = False
+    with pool.session() as replacement:
+        pass
+    assert replacement is not driver
+    assert pool.stats()['created'] == 2
+    assert pool.stats()['reused'] == 0
+
+
+def test_pool_size_is_bounded():
+    pool = BrowserSessionPool(DriverFactory(), max_size=2, acquire_timeout=0.1)
+    held = [pool.acquire(), pool.acquire()]
+    with pytest.raises(TimeoutError):
+        pool.acquire()
+    pool.release(held.pop())
+    assert pool.acquire() is not None
+
+
+def test_concurrent_borrowers_share_sessions():
+    factory = DriverFactory()
+    pool = BrowserSessionPool(factory, max_size=3)
+
+    def borrow():
+        for _ in range(20):
+            with pool.session() as driver:
+                driver.get('http://example.com/')
+
+    threads = [threading.Thread(target=borrow) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = pool.stats()
+    assert stats['created'] <= 3
+    assert stats['created'] + stats['reused'] == 120
+    assert stats['in_use'] == 0
+
+
+def test_fetch_page_html_uses_the_pool():
+    factory = DriverFactory()
+    pool = BrowserSessionPool(factory)
+    assert fetch_page_html('http://example.com/a', pool) == FakeDriver().html
+    assert fetch_page_html('http://example.com/b', pool) == FakeDriver().html
+    assert factory.drivers[0].visited == ['http://example.com/a', 'http://example.com/b']
+    assert pool.stats()['reused'] == 1
@@ -0,0 +1,80 @@
+import pytest
+
+from scraper.cache import ExtractionCache, PageCache, clean_with_cache, stored_bytes
+from scraper.chunking import chunk_records
+from scraper.cleaning import clean_dom_content
+
+PRODUCT_TABLE = "| Name | Price |\n|---|---|\n| Compact Widget Pro Kit #0 | $170.19 |"
+EMPTY_TABLE = "| Name | Price |\n|---|---|"
+DESCRIPTION = "Extract all product names and prices"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ExtractionCache(str(tmp_path / 'extractions.sqlite3'))
+
+
+@pytest.fixture(scope='module')
+def product_chunk(pages):
+    return chunk_records(clean_dom_content(pages['product_listing.html'], 'blocks'), 500)[0]
+
+
+def test_exact_hit(cache, product_chunk):
+    cache.put(product_chunk, DESCRIPTION, PRODUCT_TABLE)
+    assert cache.get(product_chunk, DESCRIPTION) == PRODUCT_TABLE
+    assert cache.get(product_chunk, "Extract all product weights") is None
+    assert cache.get(product_chunk, DESCRIPTION, variant='["json", []]') is None
+    assert cache.stats() == {'hit': 1, 'miss': 2}
+
+
+def test_edited_price_is_not_served_from_a_cached_chunk(cache, product_chunk):
+    edited = product_chunk.replace('$170.19', '$99.99', 1)
+    assert edited != product_chunk
+
+    cache.put(product_chunk, DESCRIPTION, PRODUCT_TABLE)
+    assert cache.get(edited, DESCRIPTION) is None
+    cache.put(product_chunk, DESCRIPTION, '[{"name": "Compact Widget Pro Kit #0", "price": "$170.19"}]', 'json')
+    assert cache.get(edited, DESCRIPTION, 'json') is None
+
+
+@pytest.mark.parametrize('added', ["\nCeramic Vase $49.95", "\nHEADING: New arrival\nOak Side Table $189.00 In stock"])
+def test_chunk_gaining_a_product_is_not_served_an_empty_result(cache, pages, added):
+    for chunk in chunk_records(clean_dom_content(pages['homeware_store.html'], 'blocks'), 500):
+        cache.put(chunk, DESCRIPTION, EMPTY_TABLE)
+        cache.put(chunk, DESCRIPTION, '[]', 'json')
+        assert cache.get(chunk + added, DESCRIPTION) is None
+        assert cache.get(chunk + added, DESCRIPTION, 'json') is None
+
+
+def test_extraction_cache_eviction(tmp_path):
+    cache = ExtractionCache(str(tmp_path / 'extractions.sqlite3'), max_bytes=200)
+    for i in range(10):
+        cache.put(f'chunk {i}', DESCRIPTION, f'| Name |\n|---|\n| row {i} {"x" * 40} |')
+    assert cache.get('chunk 0', DESCRIPTION) is None
+    assert cache.get('chunk 9', DESCRIPTION) is not None
+
+
+def test_eviction_keeps_a_running_size_without_scanning(tmp_path, pages):
+    caches = [(ExtractionCache(str(tmp_path / 'extractions.sqlite3'), max_bytes=300), 'results'),
+              (PageCache(str(tmp_path / 'cache.sqlite3'), max_bytes=30000), 'blobs')]
+    extractions, page_cache = caches[0][0], caches[1][0]
+    statements = []
+    for cache, _ in caches:
+        cache.connect().set_trace_callback(statements.append)
+    for i in range(20):
+        extractions.put(f'chunk {i % 7}', DESCRIPTION, f'| Name |\n|---|\n| row {i} {"x" * (i * 3)} |')
+    for name, html in pages.items():
+        clean_with_cache(html, 'blocks', cache=page_cache)
+    assert not [statement for statement in statements if 'SUM(' in statement]
+    for cache, table in caches:
+        db = cache.connect()
+        assert stored_bytes(db, table) == db.execute(f"SELECT SUM(size) FROM {table}").fetchone()[0]
+        assert 0 < stored_bytes(db, table) <= cache.max_bytes
+
+
+def test_cleaned_text_cache(tmp_path, pages):
+    cache = PageCache(str(tmp_path / 'cache.sqlite3'))
+    html = pages['blog_article.html']
+    first = clean_with_cache(html, 'blocks', cache=cache)
+    assert clean_with_cache(html, 'blocks', cache=cache) == first == clean_dom_content(html, 'blocks')
+    assert cache.stats()['cleaned_hit'] == 1
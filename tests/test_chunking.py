@@ -0,0 +1,44 @@
+import pytest
+
+from scraper.chunking import chunk_records, count_tokens, split_content, split_records
+from scraper.cleaning import clean_dom_content
+
+
+def cut_records(records, chunks):
+    return [record for record in records if not any(record in chunk.split('\n') for chunk in chunks)]
+
+
+@pytest.mark.parametrize('budget', [1000, 3000])
+def test_records_are_never_cut(pages, budget):
+    for name, html in pages.items():
+        content = clean_dom_content(html, 'blocks')
+        records = split_records(content)
+        chunks = chunk_records(content, budget)
+        assert not cut_records(records, chunks), name
+        assert '\n'.join(chunks).split('\n') == records
+        # tiktoken and the 4 characters per token estimate differ by a few tokens per chunk
+        assert all(count_tokens(chunk) <= budget * 1.05 for chunk in chunks), name
+
+
+def test_same_chunk_count_as_split_content_at_equal_budget(pages):
+    content = '\n'.join(clean_dom_content(html, 'blocks') for html in pages.values())
+    records = split_records(content)
+    chunks = chunk_records(content, 1000)
+    legacy = split_content(content, 4000)
+    assert abs(len(chunks) - len(legacy)) <= 1
+    assert len(cut_records(records, chunks)) == 0 < len(cut_records(records, legacy))
+
+
+def test_oversized_record_is_split_at_sentences():
+    record = ' '.join(f'Sentence number {i} is here.' for i in range(100))
+    chunks = chunk_records(record, 50)
+    assert len(chunks) > 1
+    assert all(chunk.endswith('.') for chunk in chunks)
+    assert ' '.join(chunks) == record
+
+
+def test_overlap_repeats_the_last_records():
+    content = '\n'.join(f'record {i} ' + 'word ' * 20 for i in range(20))
+    chunks = chunk_records(content, 100, overlap_records=1)
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert chunk.split('\n')[0] == previous.split('\n')[-1]
@@ -0,0 +1,24 @@
+import pytest
+
+from scraper.cleaning import PARSER_BACKENDS, TEXT_MODES, clean_dom_content
+
+AVAILABLE_BACKENDS = [name for name, backend in PARSER_BACKENDS.items()
+                      if name != 'html.parser' and backend.is_available()]
+
+
+@pytest.mark.parametrize('text_mode', TEXT_MODES)
+@pytest.mark.parametrize('parser', AVAILABLE_BACKENDS)
+def test_backends_match_html_parser(pages, parser, text_mode):
+    for name, html in pages.items():
+        assert clean_dom_content(html, text_mode, parser) == clean_dom_content(html, text_mode, 'html.parser'), name
+
+
+def test_fast_backend_installed():
+    assert AVAILABLE_BACKENDS, "neither selectolax nor lxml is installed"
+
+
+def test_removed_and_hidden_elements():
+    html = ('<p>Visible paragraph</p><p style="display: none">Hidden paragraph</p>'
+            '<div class="cookie-banner">Accept cookies</div><script>var x = 1;</script>')
+    for parser in ['html.parser'] + AVAILABLE_BACKENDS:
+        assert clean_dom_content(html, parser=parser) == 'Visible paragraph'
@@ -0,0 +1,43 @@
+from scraper.cleaning import clean_dom_content
+from scraper.crawl import CrawlStats, crawl, load_crawl_urls
+from scraper.fetch import TieredFetcher
+
+
+def test_crawl_fixture_server(fixture_server, pages):
+    urls = [f'{fixture_server}/{name}' for name in pages] + [f'{fixture_server}/missing.html']
+    fetcher = TieredFetcher()
+    stats = CrawlStats()
+    results = {result['url']: result for result in crawl(urls * 3, concurrency=4, per_domain_concurrency=2,
+                                                         per_domain_delay=0, fetch=fetcher.fetch, stats=stats)}
+
+    assert set(results) == set(urls)
+    for name, html in pages.items():
+        result = results[f'{fixture_server}/{name}']
+        assert result['error'] is None
+        assert result['content'] == clean_dom_content(html, 'blocks')
+    assert '404' in results[f'{fixture_server}/missing.html']['error']
+
+    report = stats.report()
+    assert report['pages'] == len(urls) * 3
+    assert report['failures_per_domain'] == {'127.0.0.1': 3}
+    assert report['fetch_p50_seconds'] <= report['fetch_p95_seconds']
+    assert fetcher.stats()['browser'] == 0
+
+
+def test_domain_politeness(fixture_server, pages):
+    name = next(iter(pages))
+    stats = CrawlStats()
+    list(crawl([f'{fixture_server}/{name}'] * 4, concurrency=4, per_domain_concurrency=1, per_domain_delay=0.1,
+               fetch=TieredFetcher().fetch, stats=stats))
+    # Four starts spaced 0.1 s apart on one domain
+    assert stats.report()['elapsed_seconds'] >= 0.3
+
+
+def test_load_crawl_urls(tmp_path):
+    sitemap = tmp_path / 'sitemap.xml'
+    sitemap.write_text('<urlset><url><loc>http://example.com/a?x=1&amp;y=2</loc></url>'
+                       '<url><loc> http://example.com/b </loc></url></urlset>')
+    url_list = tmp_path / 'urls.txt'
+    url_list.write_text('# catalog\nhttp://example.com/a\n\nhttp://example.com/b\n')
+    assert load_crawl_urls(str(sitemap)) == ['http://example.com/a?x=1&y=2', 'http://example.com/b']
+    assert load_crawl_urls(str(url_list)) == ['http://example.com/a', 'http://example.com/b']
@@ -0,0 +1,157 @@
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+import requests
+
+import scraper.fetch
+from scraper.fetch import TieredFetcher, needs_browser
+
+from conftest import serve_http
+
+CATALOG_TEXT = ''.join(f'<li class="product">Product {i} - ${i}.99, ships in two days</li>' for i in range(20))
+PAGES = {
+    # Static catalogs that carry SPA or captcha markers in their markup
+    '/ssr-catalog': (200, f'<html><body><div data-reactroot=""><ul>{CATALOG_TEXT}</ul></div></body></html>'),
+    '/recaptcha-form': (200, '<html><head><script src="https://www.google.com/recaptcha/api.js"></script></head>'
+                             f'<body><ul>{CATALOG_TEXT}</ul><div class="g-recaptcha"></div></body></html>'),
+    '/spa-shell': (200, '<html><body><div id="root"></div><script src="/app.js"></script></body></html>'),
+    '/challenge': (503, '<html><head><title>Just a moment...</title></head>'
+                        '<body><h1>Just a moment...</h1><p>Checking your browser</p></body></html>'),
+    '/forbidden': (403, '<html><body>Forbidden</body></html>'),
+    '/busy': (503, '<html><body>Service unavailable</body></html>'),
+    '/catalog.json': (200, '{"products": []}'),
+}
+
+
+class ScriptedHandler(BaseHTTPRequestHandler):
+    """Serves PAGES; /flaky/<n>/<path> answers 429 for the first n requests, then <path>"""
+
+    requests_seen = defaultdict(int)
+
+    def do_GET(self):
+        self.requests_seen[self.path] += 1
+        path = self.path
+        if path.startswith('/flaky/'):
+            _, _, failures, path = path.split('/', 3)
+            if self.requests_seen[self.path] <= int(failures):
+                return self.reply(429, 'slow down', {'Retry-After': '0'})
+            path = '/' + path
+        status, body = PAGES.get(path, (404, 'not found'))
+        self.reply(status, body, {'Content-Type': 'application/json' if path.endswith('.json') else 'text/html'})
+
+    def reply(self, status, body, headers):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RecordingFetcher(TieredFetcher):
+    """Tiered fetcher whose browser tier records the URLs it was asked for"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.browser_urls = []
+
+    def fetch_browser(self, url):
+        self.browser_urls.append(url)
+        return '<html><body>rendered</body></html>'
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(scraper.fetch, 'HTTP_RETRY_BACKOFF_SECONDS', 0)
+    ScriptedHandler.requests_seen.clear()
+    with serve_http(ScriptedHandler) as port:
+        yield f'http://127.0.0.1:{port}'
+
+
+def test_static_pages_with_markers_stay_on_http(server):
+    fetcher = RecordingFetcher()
+    for path in ('/ssr-catalog', '/recaptcha-form', '/catalog.json'):
+        assert fetcher.fetch(server + path) == PAGES[path][1]
+    assert fetcher.browser_urls == []
+    assert fetcher.get_domain_tier('127.0.0.1') == 'http'
+
+
+def test_spa_shell_pins_domain_to_browser(server):
+    fetcher = RecordingFetcher()
+    fetcher.fetch(server + '/spa-shell')
+    fetcher.fetch(server + '/ssr-catalog')
+    assert fetcher.browser_urls == [server + '/spa-shell', server + '/ssr-catalog']
+    assert fetcher.get_domain_tier('127.0.0.1') == 'browser'
+
+
+def test_challenge_page_goes_to_browser(server):
+    fetcher = RecordingFetcher()
+    fetcher.fetch(server + '/challenge')
+    assert fetcher.browser_urls == [server + '/challenge']
+    assert fetcher.stats()['retried'] == 0
+    assert fetcher.get_domain_tier('127.0.0.1') == 'browser'
+
+
+def test_forbidden_page_is_not_cached_per_domain(server):
+    fetcher = RecordingFetcher()
+    fetcher.fetch(server + '/forbidden')
+    assert fetcher.browser_urls == [server + '/forbidden']
+    assert fetcher.get_domain_tier('127.0.0.1') is None
+    fetcher.fetch(server + '/ssr-catalog')
+    assert len(fetcher.browser_urls) == 1
+
+
+def test_rate_limit_is_retried_over_http(server):
+    fetcher = RecordingFetcher()
+    assert fetcher.fetch(server + '/flaky/2/ssr-catalog') == PAGES['/ssr-catalog'][1]
+    assert fetcher.stats()['retried'] == 2
+    assert fetcher.browser_urls == []
+    assert fetcher.get_domain_tier('127.0.0.1') == 'http'
+
+
+def test_retried_streamed_responses_are_closed(server):
+    fetcher = RecordingFetcher()
+    closed = []
+    get = fetcher.session.get
+
+    def recording_get(*args, **kwargs):
+        response = get(*args, **kwargs)
+        close = response.close
+        response.close = lambda: (closed.append(response.status_code), close())
+        return response
+
+    fetcher.session.get = recording_get
+    assert b''.join(fetcher.iter_fetch(server + '/flaky/2/ssr-catalog')).decode() == PAGES['/ssr-catalog'][1]
+    assert closed == [429, 429, 200]
+
+
+def test_persistent_unavailable_raises_without_browser(server):
+    fetcher = RecordingFetcher(http_retries=1)
+    with pytest.raises(requests.HTTPError):
+        fetcher.fetch(server + '/busy')
+    assert ScriptedHandler.requests_seen['/busy'] == 2
+    assert fetcher.browser_urls == []
+    assert fetcher.get_domain_tier('127.0.0.1') is None
+
+
+def test_network_error_raises_without_browser():
+    fetcher = RecordingFetcher(http_retries=0)
+    with pytest.raises(requests.ConnectionError):
+        fetcher.fetch('http://127.0.0.1:9/unreachable')
+    assert fetcher.browser_urls == []
+    assert fetcher.get_domain_tier('127.0.0.1') is None
+
+
+def test_fixture_pages_do_not_need_browser(pages):
+    for name, html in pages.items():
+        response = requests.Response()
+        response.status_code = 200
+        response.headers['Content-Type'] = 'text/html; charset=utf-8'
+        response._content = html.encode('utf-8')
+        response.encoding = 'utf-8'
+        assert needs_browser(response) is None, name
@@ -0,0 +1,84 @@
+import re
+
+import pytest
+
+from scraper.cache import ExtractionCache
+from scraper.incremental import SnapshotStore, diff_rows, extract_incremental
+
+DESCRIPTION = "Extract all product names and prices"
+URL = 'https://shop.example/catalog'
+LINE_RE = re.compile(r'^(.+?) - (\$[\d.]+)')
+
+
+class StubTableLLM:
+    """Extracts 'name - $price' lines of a chunk as a markdown table"""
+
+    def __init__(self):
+        self.chunks = []
+
+    async def __call__(self, chunk, parse_description):
+        self.chunks.append(chunk)
+        rows = [match.groups() for match in map(LINE_RE.match, chunk.split('\n')) if match]
+        return '\n'.join(['| Name | Price |', '|---|---|'] + [f'| {name} | {price} |' for name, price in rows])
+
+
+def catalog(prices):
+    return '\n'.join(f'Compact Widget Pro Kit #{i} - {price}, ships in two days from our warehouse'
+                     for i, price in enumerate(prices))
+
+
+@pytest.fixture
+def stores(tmp_path):
+    return SnapshotStore(str(tmp_path / 'snapshots.sqlite3')), ExtractionCache(str(tmp_path / 'extractions.sqlite3'))
+
+
+def run(content, stores, llm):
+    store, cache = stores
+    return extract_incremental(URL, content, DESCRIPTION, store, chunk_tokens=60, cache=cache, llm_call=llm,
+                               tokens_per_minute=10 ** 9)
+
+
+def test_edited_price_is_a_changed_row(stores):
+    prices = [f'${i}5.99' for i in range(1, 9)]
+    first = run(catalog(prices), stores, StubTableLLM())
+    assert first['report']['rows'] == 8
+    assert first['report']['chunks'] > 2
+
+    prices[0] = '$99.99'
+    lookups = stores[1].stats()
+    llm = StubTableLLM()
+    second = run(catalog(prices), stores, llm)
+    assert second['report']['changed'] == 1
+    assert second['changes']['changed'][0]['before']['Price'] == '$15.99'
+    assert second['changes']['changed'][0]['after']['Price'] == '$99.99'
+    assert second['report']['chunks_sent'] == len(llm.chunks) == 1
+    assert second['report']['chunks_reused'] == second['report']['chunks'] - 1
+    # The changed chunk goes to the LLM without an extraction cache lookup
+    assert stores[1].stats() == lookups
+
+
+def test_unchanged_page_sends_nothing(stores):
+    content = catalog(['$1.99', '$2.99', '$3.99'])
+    run(content, stores, StubTableLLM())
+    llm = StubTableLLM()
+    again = run(content, stores, llm)
+    assert llm.chunks == []
+    assert again['report']['chunks_sent'] == 0
+    assert again['report']['llm_calls_avoided'] == again['report']['chunks']
+    assert again['changes'] == {'added': [], 'changed': [], 'removed': []}
+
+
+def test_sent_chunks_are_stored_in_the_extraction_cache(stores):
+    content = catalog(['$1.99'])
+    result = run(content, stores, StubTableLLM())
+    assert stores[1].get(content, DESCRIPTION) is not None
+    assert result['report']['chunks_sent'] == 1
+
+
+def test_diff_rows():
+    previous = [{'Name': 'Widget', 'Price': '$1'}, {'Name': 'Gadget', 'Price': '$2'}]
+    current = [{'name': 'widget', 'price': '$1'}, {'Name': 'Gadget', 'Price': '$3'}, {'Name': 'Gizmo', 'Price': '$4'}]
+    changes = diff_rows(previous, current)
+    assert changes['changed'] == [{'before': previous[1], 'after': current[1]}]
+    assert changes['added'] == [current[2]]
+    assert changes['removed'] == []
@@ -0,0 +1,306 @@
+import threading
+import time
+from collections import Counter
+
+import pytest
+
+from scraper.jobs import RedisQueue, SQLiteQueue, job_settings, run_worker, start_workers
+
+
+class WatchError(Exception):
+    pass
+
+
+class WorkerKilled(BaseException):
+    """The worker process died; raised instead of sending EXEC"""
+
+
+class StandInRedis:
+    """In-process stand-in for the redis-py commands RedisQueue uses, with WATCH/MULTI/EXEC
+
+    kill_before_exec makes the next transaction die before EXEC, like a
+    worker killed between reading a task and writing its new state.
+    before_exec, if set, is called once just before the next EXEC, like
+    another client's command landing in between.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.versions = Counter()
+        self.lock = threading.RLock()
+        self.kill_before_exec = False
+        self.before_exec = None
+
+    def wrote(self, key):
+        self.versions[key] += 1
+
+    def hget(self, key, field):
+        with self.lock:
+            return self.data.get(key, {}).get(field)
+
+    def hgetall(self, key):
+        with self.lock:
+            return dict(self.data.get(key, {}))
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        with self.lock:
+            values = dict(mapping or {})
+            if field is not None:
+                values[field] = value
+            self.data.setdefault(key, {}).update((name, str(value)) for name, value in values.items())
+            self.wrote(key)
+
+    def hincrby(self, key, field, amount=1):
+        with self.lock:
+            values = self.data.setdefault(key, {})
+            values[field] = str(int(values.get(field, 0)) + amount)
+            self.wrote(key)
+
+    def get(self, key):
+        with self.lock:
+            return self.data.get(key)
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.wrote(key)
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                if self.data.pop(key, None) is not None:
+                    self.wrote(key)
+
+    def zadd(self, key, mapping):
+        with self.lock:
+            self.data.setdefault(key, {}).update((member, float(score)) for member, score in mapping.items())
+            self.wrote(key)
+
+    def zrem(self, key, *members):
+        with self.lock:
+            scores = self.data.get(key, {})
+            removed = sum(scores.pop(member, None) is not None for member in members)
+            if removed:
+                self.wrote(key)
+            return removed
+
+    def zscore(self, key, member):
+        with self.lock:
+            return self.data.get(key, {}).get(member)
+
+    def zrangebyscore(self, key, low, high, start=None, num=None):
+        with self.lock:
+            members = sorted((score, member) for member, score in self.data.get(key, {}).items()
+                             if float(low) <= score <= float(high))
+        members = [member for _, member in members]
+        return members[start:start + num] if start is not None else members
+
+    def zrevrange(self, key, start, end):
+        with self.lock:
+            members = sorted(self.data.get(key, {}).items(), key=lambda item: -item[1])
+        return [member for member, _ in members[start:end + 1]]
+
+    def zcard(self, key):
+        with self.lock:
+            return len(self.data.get(key, {}))
+
+    def zcount(self, key, low, high):
+        return len(self.zrangebyscore(key, low, high))
+
+    def pipeline(self, transaction=True):
+        return StandInPipeline(self)
+
+    def transaction(self, func, *watches, value_from_callable=False):
+        while True:
+            pipe = self.pipeline()
+            try:
+                pipe.watch(*watches)
+                value = func(pipe)
+                results = pipe.execute()
+                return value if value_from_callable else results
+            except WatchError:
+                continue
+
+
+class StandInPipeline:
+    """Commands run at once after watch() and are queued after multi() (or without a watch) until execute()"""
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+        self.watched = {}
+        self.queueing = True
+
+    def watch(self, *keys):
+        self.watched = {key: self.client.versions[key] for key in keys}
+        self.queueing = False
+
+    def multi(self):
+        self.queueing = True
+
+    def execute(self):
+        if self.client.kill_before_exec:
+            self.client.kill_before_exec = False
+            raise WorkerKilled()
+        before_exec, self.client.before_exec = self.client.before_exec, None
+        if before_exec is not None:
+            before_exec()
+        with self.client.lock:
+            if any(self.client.versions[key] != version for key, version in self.watched.items()):
+                raise WatchError()
+            results = [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+        self.commands, self.watched, self.queueing = [], {}, True
+        return results
+
+    def __getattr__(self, name):
+        command = getattr(self.client, name)
+
+        def call(*args, **kwargs):
+            if not self.queueing:
+                return command(*args, **kwargs)
+            self.commands.append((name, args, kwargs))
+            return self
+
+        return call
+
+
+URLS = [f'https://shop.example/p/{i}' for i in range(5)]
+
+
+def fetch_page(url):
+    return f'<html><body><h1>Page {url}</h1><p>Widget for {url}, $9.99</p></body></html>'
+
+
+def drain(queue, worker_id='w', **options):
+    return run_worker(queue, worker_id, fetch=fetch_page, use_cache=False, poll_seconds=0.05, exit_when_idle=True,
+                      **options)
+
+
+@pytest.fixture
+def client():
+    return StandInRedis()
+
+
+def test_redis_queue_runs_a_job(client):
+    queue = RedisQueue(client)
+    job = queue.submit(URLS, job_settings())
+    assert drain(queue) == 2 * len(URLS)
+    status = queue.status(job)
+    assert status['state'] == 'done'
+    assert status['tasks'] == {'fetch': {'done': len(URLS)}, 'clean': {'done': len(URLS)}}
+    assert [page['url'] for page in queue.results(job)] == URLS
+
+
+def test_worker_killed_while_leasing_loses_no_task(client):
+    queue = RedisQueue(client)
+    queue.submit(URLS[:1], job_settings())
+    client.kill_before_exec = True
+    with pytest.raises(WorkerKilled):
+        queue.lease('killed')
+    task = queue.lease('survivor')
+    assert task['url'] == URLS[0]
+    assert task['attempts'] == 1
+
+
+def test_worker_killed_while_expiring_loses_no_task(client):
+    queue = RedisQueue(client)
+    job = queue.submit(URLS[:1], job_settings())
+    assert queue.lease('gone', lease_seconds=0) is not None
+    time.sleep(0.01)
+    client.kill_before_exec = True
+    with pytest.raises(WorkerKilled):
+        queue.lease('killed')
+    task = queue.lease('survivor')
+    assert task['url'] == URLS[0]
+    assert task['attempts'] == 2
+    assert queue.status(job)['tasks'] == {'fetch': {'leased': 1}}
+
+
+def test_lost_lease_cannot_complete(client):
+    queue = RedisQueue(client)
+    queue.submit(URLS[:1], job_settings())
+    stale = queue.lease('slow', lease_seconds=0)
+    time.sleep(0.01)
+    fresh = queue.lease('fast')
+    assert not queue.renew(stale)
+    assert not queue.complete(stale, '<html></html>')
+    assert queue.complete(fresh, '<html></html>')
+
+
+def test_concurrent_workers_lease_each_task_once(client):
+    queue = RedisQueue(client)
+    urls = [f'https://shop.example/p/{i}' for i in range(60)]
+    job = queue.submit(urls, job_settings())
+    leased = Counter()
+
+    class CountingQueue(RedisQueue):
+        def lease(self, worker_id, lease_seconds=60):
+            task = super().lease(worker_id, lease_seconds)
+            if task is not None:
+                leased[task['id']] += 1
+            return task
+
+    workers = [threading.Thread(target=drain, args=(CountingQueue(client), f'w{i}')) for i in range(8)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert set(leased.values()) == {1}
+    assert len(leased) == 2 * len(urls)
+    assert queue.status(job)['pages_done'] == len(urls)
+
+
+def test_resume_while_completing_queues_the_next_task(client):
+    queue = RedisQueue(client)
+    job = queue.submit(URLS[:1], job_settings())
+    task = queue.lease('w')
+    queue.cancel(job)
+    client.before_exec = lambda: queue.resume(job)
+    assert queue.complete(task, fetch_page(task['url']))
+    status = queue.status(job)
+    assert status['tasks'] == {'fetch': {'done': 1}, 'clean': {'queued': 1}}
+    assert drain(queue) == 1
+    assert queue.status(job)['state'] == 'done'
+
+
+def test_cancel_while_resuming_leaves_tasks_cancelled(client):
+    queue = RedisQueue(client)
+    job = queue.submit(URLS[:3], job_settings())
+    queue.cancel(job)
+    client.before_exec = lambda: queue.cancel(job)
+    assert queue.resume(job) == 0
+    status = queue.status(job)
+    assert status['state'] == 'cancelled'
+    assert status['tasks'] == {'fetch': {'cancelled': 3}}
+    assert queue.lease('w') is None
+
+
+def fetch_or_hang(url):
+    """Fetch a page; file:// URLs name a file to create before hanging"""
+    if url.startswith('file://'):
+        open(url[len('file://'):], 'w').close()
+        time.sleep(600)
+    return fetch_page(url)
+
+
+def test_killed_worker_process_loses_no_pages(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite3')
+    queue = SQLiteQueue(path)
+    hanging = tmp_path / 'hanging'
+    urls = URLS[:2] + [f'file://{hanging}'] + URLS[2:]
+    job = queue.submit(urls, job_settings())
+    [process] = start_workers(1, path, fetch=fetch_or_hang, use_cache=False, lease_seconds=1, poll_seconds=0.05)
+    deadline = time.monotonic() + 30
+    while not hanging.exists():
+        assert time.monotonic() < deadline and process.is_alive()
+        time.sleep(0.05)
+    process.kill()
+    process.join()
+
+    hanging.unlink()
+    drain(queue, lease_seconds=1)
+    status = queue.status(job)
+    assert status['state'] == 'done'
+    assert status['pages_done'] == len(urls)
+    assert [page['url'] for page in queue.results(job)] == urls
+    assert all(page['error'] is None for page in queue.results(job))
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+import scraper.llm
+from scraper.cache import ExtractionCache
+from scraper.llm import AIMDLimiter, TokenBudget, extract_chunks, process_chunk
+from scraper.metrics import get_metrics
+
+DESCRIPTION = 'Extract the text'
+
+
+class StubRateLimitError(Exception):
+    status_code = 429
+
+
+class StubLLM:
+    """Local stand-in for the chat model: fixed latency, 429s above a concurrency cap"""
+
+    def __init__(self, latency=0.01, rate_limit_concurrency=100, failures=None):
+        self.latency = latency
+        self.rate_limit_concurrency = rate_limit_concurrency
+        self.failures = dict(failures or {})
+        self.active = 0
+        self.peak = 0
+        self.calls = 0
+        self.rate_limited = 0
+
+    async def __call__(self, chunk, parse_description):
+        self.calls += 1
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            if self.active > self.rate_limit_concurrency:
+                self.rate_limited += 1
+                raise StubRateLimitError("429 rate limit exceeded")
+            if self.failures.get(chunk):
+                self.failures[chunk] -= 1
+                raise ConnectionError("connection reset")
+            await asyncio.sleep(self.latency)
+            return f"| Text |\n|---|\n| {chunk} |"
+        finally:
+            self.active -= 1
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(scraper.llm, 'LLM_BACKOFF_BASE_SECONDS', 0.001)
+
+
+CHUNKS = [f'chunk {i}' for i in range(24)]
+
+
+def test_every_chunk_extracted_once():
+    llm = StubLLM()
+    results = dict(extract_chunks(CHUNKS, DESCRIPTION, llm_call=llm, max_concurrency=4, tokens_per_minute=10 ** 9))
+    assert results == {i: f"| Text |\n|---|\n| {chunk} |" for i, chunk in enumerate(CHUNKS)}
+    assert llm.calls == len(CHUNKS)
+    assert llm.peak <= 4
+
+
+def test_results_arrive_as_chunks_complete():
+    class SlowFirst(StubLLM):
+        async def __call__(self, chunk, parse_description):
+            if chunk == CHUNKS[0]:
+                await asyncio.sleep(0.2)
+            return await super().__call__(chunk, parse_description)
+
+    order = [index for index, _ in extract_chunks(CHUNKS[:4], DESCRIPTION, llm_call=SlowFirst(),
+                                                  max_concurrency=4, tokens_per_minute=10 ** 9)]
+    assert order[-1] == 0
+
+
+def test_rate_limits_are_retried_and_lower_concurrency():
+    llm = StubLLM(rate_limit_concurrency=2)
+    results = dict(extract_chunks(CHUNKS, DESCRIPTION, llm_call=llm, max_concurrency=8, tokens_per_minute=10 ** 9))
+    assert all(results[i] is not None for i in range(len(CHUNKS)))
+    assert llm.rate_limited > 0
+    assert llm.calls == len(CHUNKS) + llm.rate_limited
+
+
+def test_failure_after_retries_gives_none():
+    llm = StubLLM(failures={'chunk 1': 10, 'chunk 2': 1})
+    results = dict(extract_chunks(CHUNKS[:3], DESCRIPTION, llm_call=llm, max_retries=2, tokens_per_minute=10 ** 9))
+    assert results[1] is None
+    assert results[2] is not None
+    assert llm.calls == 1 + 3 + 2
+
+
+def test_stopping_early_cancels_chunks_in_flight():
+    llm = StubLLM(latency=0.05)
+    stream = extract_chunks(CHUNKS, DESCRIPTION, llm_call=llm, max_concurrency=2, tokens_per_minute=10 ** 9)
+    next(stream)
+    stream.close()
+    assert llm.active == 0
+    assert llm.calls < len(CHUNKS)
+
+
+def test_cached_chunks_skip_the_llm(tmp_path):
+    cache = ExtractionCache(str(tmp_path / 'extractions.sqlite3'))
+    cache.put('chunk 0', DESCRIPTION, '| Text |\n|---|\n| cached |')
+    llm = StubLLM()
+    results = dict(extract_chunks(CHUNKS[:3], DESCRIPTION, llm_call=llm, cache=cache, tokens_per_minute=10 ** 9))
+    assert results[0] == '| Text |\n|---|\n| cached |'
+    assert llm.calls == 2
+    assert cache.get('chunk 1', DESCRIPTION) == results[1]
+
+
+def test_aimd_limiter():
+    async def run():
+        limiter = AIMDLimiter(initial=2, maximum=4)
+        for _ in range(2):
+            await limiter.release(await limiter.acquire())
+        assert limiter.limit == 3
+        epochs = [await limiter.acquire() for _ in range(3)]
+        # A burst of 429s from calls started under one limit halves it once
+        for epoch in epochs:
+            await limiter.release(epoch, rate_limited=True)
+        assert limiter.limit == 1
+        assert limiter.in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_token_budget_holds_spend_to_rate():
+    async def run():
+        budget = TokenBudget(tokens_per_minute=6000)
+        start = time.monotonic()
+        await budget.spend(6000)
+        await budget.spend(100)
+        return time.monotonic() - start
+
+    # 100 tokens at 100 tokens/s
+    assert asyncio.run(run()) >= 0.9
+
+
+class FakeMessage:
+    """Chat model message with provider usage metadata"""
+
+    def __init__(self, content, input_tokens, output_tokens):
+        self.content = content
+        self.usage_metadata = {'input_tokens': input_tokens, 'output_tokens': output_tokens,
+                               'total_tokens': input_tokens + output_tokens}
+
+    def __str__(self):
+        return f"content={self.content!r} additional_kwargs={{}} response_metadata={{}}"
+
+
+class FakeChain:
+    def __init__(self, response):
+        self.response = response
+
+    def invoke(self, inputs):
+        return self.response
+
+    async def ainvoke(self, inputs):
+        return self.response
+
+
+def test_token_counts_use_reported_usage(monkeypatch):
+    message = FakeMessage('| Text |\n|---|\n| hello |', input_tokens=1234, output_tokens=56)
+    monkeypatch.setattr(scraper.llm, 'build_chain', lambda template, schema=None: FakeChain(message))
+    metrics = get_metrics()
+    metrics.reset()
+    results = dict(extract_chunks(CHUNKS[:2], DESCRIPTION, tokens_per_minute=10 ** 9))
+    assert results[0] == '| Text |\n| --- |\n| hello |'
+    assert metrics.counter('llm_tokens_total', kind='prompt') == 2 * 1234
+    assert metrics.counter('llm_tokens_total', kind='completion') == 2 * 56
+
+    metrics.reset()
+    assert process_chunk('chunk 0', DESCRIPTION) == results[0]
+    assert metrics.counter('llm_tokens_total', kind='prompt') == 1234
+
+
+def test_structured_output_usage(monkeypatch):
+    response = {'raw': FakeMessage('', input_tokens=900, output_tokens=40),
+                'parsed': {'rows': [{'name': 'Widget', 'price': '$9.99'}]}, 'parsing_error': None}
+    monkeypatch.setattr(scraper.llm, 'build_chain', lambda template, schema=None: FakeChain(response))
+    metrics = get_metrics()
+    metrics.reset()
+    results = dict(extract_chunks(CHUNKS[:1], DESCRIPTION, output_format='json', tokens_per_minute=10 ** 9))
+    assert json.loads(results[0]) == [{'name': 'Widget', 'price': '$9.99'}]
+    assert metrics.counter('llm_tokens_total', kind='prompt') == 900
+    assert metrics.counter('llm_tokens_total', kind='completion') == 40
+
+
+def test_budget_is_settled_against_usage(monkeypatch):
+    message = FakeMessage('| Text |\n|---|\n| hello |', input_tokens=100, output_tokens=10)
+    monkeypatch.setattr(scraper.llm, 'build_chain', lambda template, schema=None: FakeChain(message))
+    settled = []
+    original = TokenBudget.settle
+    monkeypatch.setattr(TokenBudget, 'settle',
+                        lambda budget, charged, used: settled.append((charged, used)) or original(budget, charged, used))
+    list(extract_chunks(CHUNKS[:3], DESCRIPTION, tokens_per_minute=10 ** 9))
+    assert [used for _, used in settled] == [110] * 3
+    assert all(charged > used for charged, used in settled)
+
+
+def test_settle_refunds_and_charges():
+    async def run():
+        budget = TokenBudget(tokens_per_minute=6000)
+        charged = await budget.spend(3000)
+        budget.settle(charged, 1000)
+        assert budget.available == 5000
+        budget.settle(0, 6000)
+        assert budget.available < 0
+
+    asyncio.run(run())
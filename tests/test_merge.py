@@ -0,0 +1,23 @@
+from scraper.merge import RowMerger
+from scraper.sinks import RowSink
+
+
+def test_rows_with_equal_hashes_are_kept():
+    # hash(-1.0) == hash(-2.0) in CPython, so these rows' keys hash alike
+    rows = [{'Name': 'Offset', 'Value': -1}, {'Name': 'Offset', 'Value': -2}]
+    merger = RowMerger(fuzzy_similarity=0.9)
+    assert merger.add(rows) == 2
+    assert merger.duplicates == merger.near_duplicates == 0
+
+
+def test_booleans_are_not_numbers():
+    merger = RowMerger()
+    assert merger.add([{'Name': 'Lamp', 'In stock': True}, {'Name': 'Lamp', 'In stock': 1}]) == 2
+    # A markdown table's 'TRUE' is the same value as JSON true
+    assert merger.add([{'Name': 'Lamp', 'In stock': 'TRUE'}, {'Name': 'Lamp', 'In stock': 1.0}]) == 0
+    assert merger.duplicates == 2
+
+
+def test_export_dedupe_compares_keys(tmp_path):
+    with RowSink(str(tmp_path / 'rows.jsonl'), dedupe=True) as sink:
+        assert sink.write([{'Value': -1}, {'Value': -2}, {'Value': True}, {'Value': 1}, {'Value': -1.0}]) == 4
@@ -0,0 +1,101 @@
+import random
+import re
+import time
+
+import pytest
+
+from scraper.cleaning import normalize_line, normalize_text
+
+# Random texts are built from pieces that exercise each rule of the normalizer
+PIECES = ['word', 'Word', 'word', '42', '$9.99', '€5', '+44', '50%', '[note]', '[', ']', '(aside)', '(',
+          ')', '(URL: /p/1)', '|', ' | ', '  ', '\t', '•', '...', '!', '-', '\n', '\n\n', 'TABLE_CELL:']
+BRACKET_PAIR_RE = re.compile(r'\[[^\[\]]*\]')
+PAREN_PAIR_RE = re.compile(r'\((?!URL:)[^()]*\)')
+PIPE_UNSPACED_RE = re.compile(r'(?<! )\||\|(?! )')
+ADVERSARIAL = {
+    'unclosed brackets': '[',
+    'unclosed parentheses': '(',
+    'repeated words': 'ab ',
+    'pipes': ' |',
+    'punctuation': '.,;',
+}
+
+
+@pytest.fixture(scope='module')
+def samples():
+    rng = random.Random(0)
+    return [''.join(rng.choice(PIECES) + rng.choice(['', ' ']) for _ in range(rng.randint(1, 40)))
+            for _ in range(2000)]
+
+
+def output_lines(text):
+    output = normalize_text(text)
+    return output.split('\n') if output else []
+
+
+def test_idempotent(samples):
+    for text in samples:
+        output = normalize_text(text)
+        assert normalize_text(output) == output, text
+
+
+def test_one_output_line_per_kept_input_line(samples):
+    for text in samples:
+        kept = [line for line in text.split('\n') if normalize_line(line)]
+        if kept:
+            assert len(normalize_text('\n'.join(kept)).split('\n')) == len(kept), text
+
+
+def test_short_lines_dropped_and_whitespace_collapsed(samples):
+    for text in samples:
+        for line in output_lines(text):
+            assert len(line) > 3, text
+            assert line == line.strip() and '  ' not in line and '\t' not in line, text
+
+
+def test_complete_asides_removed(samples):
+    for text in samples:
+        for line in output_lines(text):
+            assert not BRACKET_PAIR_RE.search(line) and not PAREN_PAIR_RE.search(line), text
+
+
+def test_pipes_spaced(samples):
+    for text in samples:
+        for line in output_lines(text):
+            assert not PIPE_UNSPACED_RE.search(line), text
+
+
+def test_repeated_words_dropped(samples):
+    for text in samples:
+        for line in output_lines(text):
+            words = line.split(' ')
+            assert not any(a == b and a.isalnum() for a, b in zip(words, words[1:])), text
+
+
+def test_no_invented_words(samples):
+    for text in samples:
+        input_words = set(re.findall(r'\w+', text))
+        for line in output_lines(text):
+            assert set(re.findall(r'\w+', line)) <= input_words, text
+
+
+def test_kept_prices_and_links():
+    assert normalize_text('Price: $9.99 (incl. VAT) [1]') == 'Price: $9.99'
+    assert normalize_text('Widget (URL: /p/1)') == 'Widget (URL: /p/1)'
+    assert normalize_text('Name|Price') == 'Name | Price'
+
+
+@pytest.mark.parametrize('unit', ADVERSARIAL.values(), ids=ADVERSARIAL.keys())
+def test_linear_time_on_adversarial_input(unit):
+    times = []
+    for size in (4000, 64000):
+        sample = unit * (size // len(unit)) + 'end'
+        best = None
+        for _ in range(3):
+            start = time.perf_counter()
+            normalize_text(sample)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        times.append(best)
+    # 16x the input takes about 16x as long in linear time, 256x in quadratic
+    assert times[1] / max(times[0], 1e-4) < 64
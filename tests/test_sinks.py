@@ -0,0 +1,24 @@
+import json
+import os
+
+from scraper.sinks import RowSink
+
+
+def written_rows(path):
+    rows = []
+    for directory, _, names in os.walk(path):
+        for name in sorted(names):
+            with open(os.path.join(directory, name), encoding='utf-8') as f:
+                rows += [json.loads(line) for line in f]
+    return rows
+
+
+def test_dedupe_remembers_a_bounded_window(tmp_path):
+    path = str(tmp_path / 'rows.jsonl')
+    with RowSink(path, dedupe=True, dedupe_window=3) as sink:
+        for name in ['A', 'B', 'a ', 'C', 'B', 'D', 'E', 'A']:
+            sink.write([{'Name': name}])
+        assert len(sink.seen) == 3
+    # 'a ' repeats 'A' and 'B' was recent; 'A' had left the window
+    assert [row['Name'] for row in written_rows(path)] == ['A', 'B', 'C', 'D', 'E', 'A']
+    assert sink.stats()['duplicates'] == 2
@@ -0,0 +1,94 @@
+import os
+import subprocess
+import sys
+from argparse import Namespace
+from functools import partial
+
+import pytest
+
+from scraper.cleaning import clean_dom_content
+from scraper.cli import stream_chunks
+from scraper.llm import extract_chunks
+from scraper.streaming import iter_chunks, iter_clean_records
+
+from conftest import FIXTURES_DIR, QuietHandler, serve_http
+
+# Peak RSS of clean+chunk over HTTP, measured from a fresh interpreter (Linux)
+STREAM_URL_PROBE = """
+import re, sys
+from argparse import Namespace
+from scraper.cli import stream_chunks
+
+def status_mb(field):
+    with open('/proc/self/status') as f:
+        return int(re.search(field + r':\\s+(\\d+)', f.read()).group(1)) / 1024
+
+with open('/proc/self/clear_refs', 'w') as f:
+    f.write('5')
+before = status_mb('VmRSS')
+chunks = sum(1 for _ in stream_chunks(Namespace(source=sys.argv[1], chunk_tokens=1000)))
+print(chunks, status_mb('VmHWM') - before)
+"""
+
+
+def write_listing(path, target_mb):
+    """Write an infinite-scroll style product listing of about target_mb megabytes"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<html><body><main><h1>All products</h1>')
+        written, i = 0, 0
+        while written < target_mb * 1e6:
+            card = (f'<div class="product-card"><h3>Compact Widget #{i}</h3><span class="price">${i % 500}.99</span>'
+                    f'<p>{"portable steel travel set " * 5}</p></div>\n')
+            f.write(card)
+            written += len(card)
+            i += 1
+        f.write('</main></body></html>')
+
+
+def test_streamed_records_match_whole_page_cleaning(pages):
+    for name, html in pages.items():
+        expected = [line for line in clean_dom_content(html, 'blocks').split('\n') if line]
+        assert list(iter_clean_records(html.encode('utf-8'), piece_size=97)) == expected, name
+
+
+def test_stream_chunks_reads_url_and_files_alike(fixture_server):
+    name = 'product_listing.html'
+    from_url = list(stream_chunks(Namespace(source=f'{fixture_server}/{name}', chunk_tokens=500)))
+    from_file = list(stream_chunks(Namespace(source=f'{FIXTURES_DIR}/{name}', chunk_tokens=500)))
+    assert from_url == from_file == list(iter_chunks(open(f'{FIXTURES_DIR}/{name}', 'rb'), 500))
+    assert len(from_url) > 1
+
+
+def test_extraction_pulls_chunks_a_window_at_a_time():
+    taken = []
+
+    def chunks():
+        for i in range(40):
+            taken.append(i)
+            yield f'chunk {i}'
+
+    async def llm_call(chunk, parse_description):
+        return f"| Text |\n|---|\n| {chunk} |"
+
+    results = extract_chunks(chunks(), 'Extract the text', llm_call=llm_call, max_concurrency=2,
+                             tokens_per_minute=10 ** 9)
+    next(results)
+    assert len(taken) <= 2 * 2
+    assert len(list(results)) == 39
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="reads peak RSS from /proc")
+def test_streamed_url_memory_does_not_grow_with_page_size(tmp_path):
+    for target_mb in (3, 12):
+        write_listing(tmp_path / f'listing-{target_mb}.html', target_mb)
+    peaks = {}
+    with serve_http(partial(QuietHandler, directory=str(tmp_path))) as port:
+        for target_mb in (3, 12):
+            result = subprocess.run([sys.executable, '-c', STREAM_URL_PROBE,
+                                     f'http://127.0.0.1:{port}/listing-{target_mb}.html'],
+                                    capture_output=True, text=True, check=True, cwd=os.path.dirname(FIXTURES_DIR))
+            chunks, peaks[target_mb] = result.stdout.split()[-2:]
+            assert int(chunks) > 100
+    # Four times the page, not four times the memory
+    assert float(peaks[12]) < float(peaks[3]) + 4
+    assert float(peaks[12]) < 12
@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+import scraper.templates
+from scraper.llm import parse_columns
+from scraper.templates import (TEMPLATE_MIN_AGREEMENT, TemplateStore, apply_template, extract_with_template,
+                               induce_template, learn_template, parse_page, row_agreement, template_key)
+
+from conftest import load_fixture
+
+DESCRIPTION = "products with SKU, price and stock"
+# A spec table written without <tbody>: HTML5 parsers add one, lxml does not
+SPEC_ROWS = [{'Product': f'Widget model {i}', 'SKU': f'W-{1000 + i}', 'Price': f'${i}9.99'} for i in range(1, 9)]
+SPEC_TABLE = ('<html><body><main><h1>Widget specs</h1><table class="specs">'
+              '<tr><th>Product</th><th>SKU</th><th>Price</th></tr>'
+              + ''.join(f"<tr><td>{row['Product']}</td><td>{row['SKU']}</td><td>{row['Price']}</td></tr>"
+                        for row in SPEC_ROWS)
+              + '</table></main></body></html>')
+# Cards whose related-product block holds a nested .price; a card without
+# its own price must not take the nested one
+CARDS = ('<html><body><main>'
+         + ''.join(f'<div class="card"><h3>Lamp {i}</h3>'
+                   + (f'<span class="price">${i}.50</span>' if i != 4 else '')
+                   + f'<div class="related"><h4>Shade {i}</h4><span class="price">$0.{i}0</span></div></div>'
+                   for i in range(1, 7))
+         + '</main></body></html>')
+
+
+@pytest.fixture(params=['selectolax', 'beautifulsoup'])
+def backend(request, monkeypatch):
+    if request.param == 'beautifulsoup':
+        monkeypatch.setattr(scraper.templates, 'LexborHTMLParser', None)
+    return request.param
+
+
+@pytest.fixture
+def store(tmp_path):
+    return TemplateStore(str(tmp_path / 'templates.sqlite3'))
+
+
+def test_table_without_tbody(backend, store):
+    template = induce_template(parse_page(SPEC_TABLE), SPEC_ROWS)
+    assert template is not None
+    assert apply_template(template, SPEC_TABLE) == SPEC_ROWS
+
+    url = 'https://shop.example/specs/widgets-2024'
+    assert learn_template(store, url, SPEC_TABLE, SPEC_ROWS, DESCRIPTION) == 1
+    other_page = SPEC_TABLE.replace('Widget', 'Gadget')
+    rows = extract_with_template(store, 'https://shop.example/specs/gadgets-2024', other_page, DESCRIPTION)
+    assert rows == [{name: value.replace('Widget', 'Gadget') for name, value in row.items()} for row in SPEC_ROWS]
+
+
+def test_fields_are_child_anchored(backend):
+    rows = [{'name': f'Lamp {i}', 'price': f'${i}.50'} for i in range(1, 7) if i != 4]
+    template = induce_template(parse_page(CARDS), rows)
+    assert template is not None
+    extracted = apply_template(template, CARDS)
+    assert {'name': 'Lamp 4', 'price': None} in extracted
+    assert all(row in extracted for row in rows)
+
+
+def test_backends_extract_the_same_rows(monkeypatch):
+    template = induce_template(parse_page(CARDS), [{'name': f'Lamp {i}', 'price': f'${i}.50'} for i in range(1, 4)])
+    lexbor_rows = apply_template(template, CARDS)
+    monkeypatch.setattr(scraper.templates, 'LexborHTMLParser', None)
+    assert apply_template(template, CARDS) == lexbor_rows
+
+
+def test_templates_learned_from_fixture_rows(store):
+    labels = json.loads(load_fixture('template_rows.json'))
+    for entry in labels:
+        html = load_fixture(entry['fixture'])
+        columns = parse_columns(entry['columns'])
+        rows = [dict(zip([name for name, _ in columns], row)) for row in entry['rows']]
+        options = (entry['request'], entry['format'], columns if entry['format'] == 'json' else None)
+        url = f"https://fixtures.test/{entry['fixture']}"
+        assert learn_template(store, url, html, rows, *options) is not None, entry['fixture']
+        template = store.latest(*template_key(url, *options))[1]
+        assert min(row_agreement(apply_template(template, html), rows)) >= TEMPLATE_MIN_AGREEMENT